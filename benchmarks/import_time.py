@@ -0,0 +1,55 @@
+""" Measure what importing deform_autoneed costs.
+
+    Each case runs in a fresh interpreter, so nothing is cached between runs.
+    Run from the root of the checkout:
+
+        python benchmarks/import_time.py [runs] [--json]
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+
+CASES = (
+    ('import deform_autoneed',
+     "import deform_autoneed"),
+    ('import deform_autoneed + build registry',
+     "import deform_autoneed; deform_autoneed.get_resource_registry()"),
+    ('import deform_autoneed + includeme',
+     "import deform_autoneed; deform_autoneed.includeme()"),
+    ('import pkg_resources (for reference)',
+     "import pkg_resources"),
+)
+
+TIMER = """
+import time
+_start = time.perf_counter()
+%s
+print(time.perf_counter() - _start)
+"""
+
+
+def measure(code, runs):
+    timings = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', TIMER % code])
+        timings.append(float(output.decode().strip().splitlines()[-1]) * 1000)
+    return timings
+
+def main(runs = 10, as_json = False):
+    results = {}
+    for (name, code) in CASES:
+        timings = measure(code, runs)
+        results[name] = {'median_ms': round(statistics.median(timings), 2),
+                         'min_ms': round(min(timings), 2)}
+        if not as_json:
+            print("%-45s median %8.2f ms   min %8.2f ms" % (name, results[name]['median_ms'], results[name]['min_ms']))
+    if as_json:
+        print(json.dumps(results, indent = 2))
+    return results
+
+
+if __name__ == '__main__':
+    args = [x for x in sys.argv[1:] if x != '--json']
+    main(args and int(args[0]) or 10, as_json = '--json' in sys.argv)
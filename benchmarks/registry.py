@@ -0,0 +1,265 @@
+""" Benchmarks for the registry and for what auto_need costs per render.
+
+    Runs offline against the installed deform. For every case it reports wall time
+    per call, the number of memory blocks allocated per call and the peak memory
+    used, measured with tracemalloc. Run from the root of the checkout:
+
+        python benchmarks/registry.py [--json results.json] [--compare old.json] [--filter name]
+
+    Save the JSON output for one version and pass it to --compare when running
+    another to see the ratio for every case.
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import colander
+import deform
+from fanstatic import (Library,
+                       init_needed)
+
+import deform_autoneed
+
+
+WIDGET_TYPES = (
+    deform.widget.TextInputWidget,
+    deform.widget.RichTextWidget,
+    deform.widget.DateInputWidget,
+    deform.widget.AutocompleteInputWidget,
+    deform.widget.CheckedPasswordWidget,
+)
+
+FILE_COUNT = 300
+
+
+def _reset():
+    """ Forget resources created by an earlier run. """
+    deform_autoneed.deform_autoneed_lib.known_resources = {}
+    init_needed()
+
+def _mk_registry():
+    reg = deform_autoneed.ResourceRegistry()
+    reg.populate_from_resources()
+    return reg
+
+def _mk_form(widget_count):
+    schema = colander.Schema()
+    for i in range(widget_count):
+        widget = WIDGET_TYPES[i % len(WIDGET_TYPES)]()
+        schema.add(colander.SchemaNode(colander.String(), name = 'field_%s' % i, widget = widget))
+    return deform.Form(schema)
+
+
+class LargeLibrary(object):
+    """ A temporary library with enough files for a registry with hundreds of resources. """
+
+    def __init__(self, count = FILE_COUNT):
+        self.path = tempfile.mkdtemp()
+        for i in range(count):
+            with open(os.path.join(self.path, 'file_%s.js' % i), 'w') as f:
+                f.write('var x = %s;' % i)
+            with open(os.path.join(self.path, 'other_%s.js' % i), 'w') as f:
+                f.write('var y = %s;' % i)
+        self.count = count
+
+    def registry(self):
+        """ A populated registry with count extra resources over 10 requirements. """
+        reg = _mk_registry()
+        library = Library('benchmark_lib', self.path)
+        reg.libraries['benchmark_lib'] = library
+        per_requirement = self.count // 10
+        for i in range(10):
+            paths = [os.path.join(self.path, 'file_%s.js' % x) for x in range(i * per_requirement, (i + 1) * per_requirement)]
+            resources = [deform_autoneed.Resource(library, os.path.basename(x)) for x in paths]
+            reg.requirements['benchmark_%s' % i] = resources
+        reg.find_resource(paths[0]) #Builds indexes
+        return reg
+
+    def cleanup(self):
+        shutil.rmtree(self.path)
+
+
+def case_registry_construction(ctx):
+    def setup():
+        _reset()
+    def run():
+        deform_autoneed.ResourceRegistry()
+    return setup, run
+
+def case_populate_from_resources(ctx, lazy = False):
+    state = {}
+    def setup():
+        _reset()
+        state['reg'] = deform_autoneed.ResourceRegistry()
+    def run():
+        state['reg'].populate_from_resources(lazy = lazy)
+    return setup, run
+
+def case_populate_from_resources_lazy(ctx):
+    return case_populate_from_resources(ctx, lazy = True)
+
+def case_find_resource(ctx):
+    state = {}
+    def setup():
+        _reset()
+        state['reg'] = ctx['library'].registry()
+        state['path'] = os.path.join(ctx['library'].path, 'file_%s.js' % (FILE_COUNT - 1))
+    def run():
+        assert state['reg'].find_resource(state['path']) is not None
+    return setup, run
+
+def case_replace_resource(ctx):
+    state = {}
+    def setup():
+        _reset()
+        state['reg'] = ctx['library'].registry()
+        state['old'] = os.path.join(ctx['library'].path, 'file_%s.js' % (FILE_COUNT // 2))
+        state['new'] = deform_autoneed.Resource(state['reg'].libraries['benchmark_lib'], 'other_1.js')
+    def run():
+        state['reg'].replace_resource(state['old'], state['new'])
+    return setup, run
+
+def _auto_need_case(widget_count, frozen = False, **kw):
+    def case(ctx):
+        state = {}
+        def setup():
+            _reset()
+            state['reg'] = _mk_registry()
+            if frozen:
+                state['reg'] = state['reg'].freeze()
+            state['form'] = _mk_form(widget_count)
+            #First render fills the caches, the benchmark measures the steady state
+            deform_autoneed.auto_need(state['form'], reg = state['reg'], **kw)
+        def run():
+            init_needed()
+            deform_autoneed.auto_need(state['form'], reg = state['reg'], **kw)
+        return setup, run
+    return case
+
+def case_auto_need_20_forms(ctx):
+    """ A page with 20 forms of 5 widgets each, rendered in one request. """
+    state = {}
+    def setup():
+        _reset()
+        state['reg'] = _mk_registry().freeze()
+        state['forms'] = [_mk_form(5) for x in range(20)]
+        for form in state['forms']:
+            deform_autoneed.auto_need(form, reg = state['reg'])
+    def run():
+        init_needed()
+        for form in state['forms']:
+            deform_autoneed.auto_need(form, reg = state['reg'])
+    return setup, run
+
+
+#Name, case, number of samples, calls per sample. Cases that change the registry
+#can only be called once per setup.
+CASES = (
+    ('registry_construction', case_registry_construction, 20, 1),
+    ('populate_from_resources', case_populate_from_resources, 20, 1),
+    ('populate_from_resources_lazy', case_populate_from_resources_lazy, 20, 1),
+    ('find_resource', case_find_resource, 20, 100),
+    ('replace_resource', case_replace_resource, 20, 1),
+    ('auto_need_1_widget', _auto_need_case(1), 20, 100),
+    ('auto_need_50_widgets', _auto_need_case(50), 20, 20),
+    ('auto_need_500_widgets', _auto_need_case(500), 20, 5),
+    ('auto_need_50_widgets_frozen', _auto_need_case(50, frozen = True), 20, 20),
+    ('auto_need_20_forms', case_auto_need_20_forms, 20, 5),
+    ('auto_need_500_widgets_cached', _auto_need_case(500, requirements_cache = deform_autoneed.WidgetRequirementsCache()), 20, 5),
+)
+
+
+def measure(setup, run, repeat, number = 1):
+    """ Run setup before each sample of number calls to run.
+        Returns timings per call and memory use.
+    """
+    timings = []
+    blocks = []
+    peaks = []
+    for i in range(repeat):
+        setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            for j in range(number):
+                run()
+            timings.append((time.perf_counter() - start) / number)
+            setup()
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            run()
+            after = tracemalloc.take_snapshot()
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        finally:
+            gc.enable()
+        blocks.append(sum(x.count_diff for x in after.compare_to(before, 'filename') if x.count_diff > 0))
+    return {'repeat': repeat,
+            'number': number,
+            'min_us': round(min(timings) * 1e6, 2),
+            'median_us': round(statistics.median(timings) * 1e6, 2),
+            'allocated_blocks': int(statistics.median(blocks)),
+            'peak_kib': round(statistics.median(peaks) / 1024.0, 2)}
+
+def run_benchmarks(name_filter = None):
+    library = LargeLibrary()
+    ctx = {'library': library}
+    results = {}
+    try:
+        for (name, case, repeat, number) in CASES:
+            if name_filter and name_filter not in name:
+                continue
+            setup, run = case(ctx)
+            results[name] = measure(setup, run, repeat, number)
+    finally:
+        library.cleanup()
+    return results
+
+def environment():
+    from importlib.metadata import version
+    return {'python': sys.version.split()[0],
+            'deform': version('deform'),
+            'fanstatic': version('fanstatic')}
+
+def format_results(results, compare = None):
+    lines = ["%-32s %12s %12s %10s %10s" % ('case', 'median us', 'min us', 'blocks', 'peak KiB')]
+    for (name, result) in results.items():
+        line = "%-32s %12.2f %12.2f %10d %10.2f" % (name, result['median_us'], result['min_us'],
+                                                   result['allocated_blocks'], result['peak_kib'])
+        if compare and name in compare:
+            old = compare[name]['median_us']
+            line += "   %5.2fx" % (old and result['median_us'] / old or 0)
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n')[0])
+    parser.add_argument('--json', help = "Write results to this file")
+    parser.add_argument('--compare', help = "Results from an earlier run to compare with")
+    parser.add_argument('--filter', help = "Only run cases with this in their name")
+    args = parser.parse_args(argv)
+    results = run_benchmarks(args.filter)
+    compare = None
+    if args.compare:
+        with open(args.compare) as f:
+            compare = json.load(f)['results']
+    print(format_results(results, compare))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent = 2, sort_keys = True)
+    return results
+
+
+if __name__ == '__main__':
+    main()
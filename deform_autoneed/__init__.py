@@ -1,16 +1,124 @@
+import contextvars
+import functools
+import importlib.util
 import logging
 import os
 import re
+import threading
+import time
+import types
+import weakref
 
 from fanstatic import (Resource,
-                       Library)
-import pkg_resources
+                       Library,
+                       NeededResources,
+                       UnknownResourceError,
+                       get_needed)
+
+from deform_autoneed.graph import (DependencyCycleError,
+                                   DependencyGraph)
+from deform_autoneed.staticindex import get_static_index
 
 
 logger = logging.getLogger(__name__)
 
-deform_static = pkg_resources.resource_filename("deform", "static")
+
+def _package_dir(package_name):
+    """ Directory of an importable package, or None if it can't be found.
+        The package itself isn't imported.
+    """
+    try:
+        return _package_dirs[package_name]
+    except KeyError:
+        pass
+    try:
+        spec = importlib.util.find_spec(package_name)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        package_dir = None
+    elif spec.submodule_search_locations:
+        package_dir = os.path.normpath(list(spec.submodule_search_locations)[0])
+    elif spec.origin and os.path.isfile(spec.origin):
+        package_dir = os.path.dirname(os.path.normpath(spec.origin))
+    else:
+        package_dir = None
+    _package_dirs[package_name] = package_dir
+    return package_dir
+
+_package_dirs = {}
+
+
+def _resource_filename(package_name, path):
+    """ Works like ``pkg_resources.resource_filename`` for packages installed as directories. """
+    package_dir = _package_dir(package_name)
+    if package_dir is None:
+        raise ImportError("Can't find the package '%s'" % package_name)
+    return os.path.join(package_dir, *path.split('/'))
+
+
+def _distribution_version(name):
+    """ Installed version of a distribution. Cached, since reading package metadata is slow. """
+    try:
+        return _distribution_versions[name]
+    except KeyError:
+        from importlib.metadata import version
+        result = _distribution_versions[name] = version(name)
+        return result
+
+_distribution_versions = {}
+
+
+deform_static = _resource_filename("deform", "static")
 deform_autoneed_lib = Library("deform_autoneed_lib", deform_static)
+_jquery_pattern = re.compile(r'^scripts/jquery-[0-9]{1,2}(.*)\.min\.js$')
+
+
+class _RequirementsDict(dict):
+    """ The dict used for ``ResourceRegistry.requirements``. Assigning or removing
+        entries directly tells the registry that its path indexes need to be rebuilt.
+        Lists that are changed in place aren't tracked, so use the registry methods
+        for those.
+    """
+
+    def __init__(self, changed, *args, **kw):
+        super(_RequirementsDict, self).__init__(*args, **kw)
+        self._changed = changed
+
+    def __setitem__(self, key, value):
+        super(_RequirementsDict, self).__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super(_RequirementsDict, self).__delitem__(key)
+        self._changed()
+
+    def pop(self, *args):
+        result = super(_RequirementsDict, self).pop(*args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super(_RequirementsDict, self).popitem()
+        self._changed()
+        return result
+
+    def clear(self):
+        super(_RequirementsDict, self).clear()
+        self._changed()
+
+    def update(self, *args, **kw):
+        super(_RequirementsDict, self).update(*args, **kw)
+        self._changed()
+
+
+def _locked(method):
+    """ Run method while holding the registry lock. """
+    @functools.wraps(method)
+    def _wrapper(self, *args, **kw):
+        with self._lock:
+            return method(self, *args, **kw)
+    return _wrapper
 
 
 class ResourceRegistry(object):
@@ -31,11 +139,71 @@ class ResourceRegistry(object):
             and any package specifying a path that starts with 'deform:' will use this library.
             The convention is that the key for each library must be the same as the package name.
             A resource path like ``deform:some/resouce.js`` will use the library located in self.libraries['deform'].
+
+        Every resource within requirements is also indexed by its absolute path and by its
+        package path (``package:relpath``), so lookups through ``find_resource`` don't need
+        to scan the registry.
+
+        graph
+            A ``deform_autoneed.graph.DependencyGraph`` of every resource within requirements
+            and everything they depend on. It's kept in sync by the registry methods and
+            gives ``resources_for`` a precomputed order. Dependency cycles raise
+            ``DependencyCycleError``. Together with an index of which requirements
+            each resource belongs to, its dependents let ``remove_resource`` and
+            ``replace_resource`` change only the resources that are affected.
+
+        generation
+            A counter that is increased every time the registry changes. Anything cached
+            from the registry, like the resolved resources of ``resources_for``, is only
+            valid for the generation it was created in. If you change a requirement list
+            or the dependencies of a resource in place, call ``changed`` afterwards.
+
+        The methods that change the registry hold a lock while they run, and so does
+        ``resources_for`` when it resolves requirements, so resolving never sees a
+        change that is only half done. Use ``transaction`` to make many changes at once.
+        For lock-free reads, use the immutable view returned by ``freeze``.
+
+        bundler
+            An optional ``deform_autoneed.bundles.BundleBuilder``. If it's set, ``auto_need``
+            will need concatenated bundles instead of separate resources.
+
+        fingerprints
+            An optional ``deform_autoneed.fingerprint.Fingerprints``. If it's set, every
+            resource added to the registry will render with a content hash in its URL.
+
+        inline_assets
+            An optional ``deform_autoneed.inline.InlineAssets``. If it's set, small
+            resources added to the registry will render inline in the page.
+
+        instrumentation
+            An optional ``deform_autoneed.instrumentation.Instrumentation``. If it's set,
+            calls to ``auto_need``, ``need_lib`` and the patched render methods are timed
+            and counted. See ``stats``.
+
+        Requirements added through ``populate_from_resources(lazy = True)`` are only
+        created the first time they're needed, see ``load``.
     """
-    requirements = {}
-    libraries = {}
-    
+    _requirements = None
+    bundler = None
+    fingerprints = None
+    inline_assets = None
+    instrumentation = None
+
     def __init__(self, requirements = None, libraries = None, add_basics = True):
+        self._by_path = {}
+        self._by_package_path = {}
+        self.graph = DependencyGraph(sort_key = _resource_sort_key)
+        self._requirement_names = {}
+        self._index_stale = True
+        self._lock = threading.RLock()
+        self._deferring = False
+        self._deferred_change = False
+        self._frozen = None
+        self.generation = 0
+        self._resolved = {}
+        self._resolved_generation = 0
+        self._pending = {}
+        self._pending_paths = {}
         self.requirements = requirements and requirements or {}
         self.libraries = {'deform': deform_autoneed_lib}
         if libraries:
@@ -44,6 +212,92 @@ class ResourceRegistry(object):
         if add_basics:
             self.add_deform_basics()
 
+    @property
+    def requirements(self):
+        return self._requirements
+
+    @requirements.setter
+    def requirements(self, value):
+        self._requirements = _RequirementsDict(self.changed, value)
+        self.changed()
+
+    def changed(self):
+        """ Mark the registry as changed without going through the registry methods.
+            The indexes and the dependency graph are rebuilt when they're needed next,
+            and anything cached from the registry is invalidated.
+        """
+        self._index_stale = True
+        self._bump_generation()
+
+    def _bump_generation(self):
+        if self._deferring:
+            self._deferred_change = True
+        else:
+            self.generation += 1
+
+    def _save_fingerprints(self):
+        """ Write new content hashes to the fingerprint cache, once per change or batch of changes. """
+        if self.fingerprints is not None and not self._deferring:
+            self.fingerprints.save()
+
+    def _ensure_index(self):
+        """ Rebuild the path indexes and the graph if requirements were changed directly. """
+        if not self._index_stale:
+            return
+        self._by_path = {}
+        self._by_package_path = {}
+        self._requirement_names = {}
+        self.graph.clear()
+        self._index_stale = False
+        for (name, resources) in self.requirements.items():
+            for resource in resources:
+                self._index_resource(resource, name)
+
+    def _index_resource(self, resource, requirement_name):
+        if self.fingerprints is not None:
+            self.fingerprints.apply(resource)
+        if self.inline_assets is not None:
+            self.inline_assets.apply(resource)
+        if self._index_stale:
+            return #Will be picked up on next rebuild
+        self._requirement_names.setdefault(resource, set()).add(requirement_name)
+        self._by_path[self._resource_fullpath(resource)] = resource
+        package_path = self._package_path_or_none(resource)
+        if package_path is not None:
+            self._by_package_path[package_path] = resource
+        self._add_to_graph(resource)
+
+    def _add_to_graph(self, resource):
+        """ Add resource and everything it depends on to the graph. """
+        if resource in self.graph:
+            return
+        pending = [resource]
+        while pending:
+            current = pending.pop()
+            self.graph.add(current)
+            for dependency in current.depends:
+                if dependency not in self.graph:
+                    pending.append(dependency)
+                self.graph.add_dependency(current, dependency)
+
+    def _unindex_resource(self, resource):
+        if self._index_stale:
+            return
+        self._requirement_names.pop(resource, None)
+        abs_path = self._resource_fullpath(resource)
+        if self._by_path.get(abs_path) is resource:
+            del self._by_path[abs_path]
+        package_path = self._package_path_or_none(resource)
+        if package_path is not None and self._by_package_path.get(package_path) is resource:
+            del self._by_package_path[package_path]
+
+    def _package_path_or_none(self, resource):
+        try:
+            return self.resource_package_path(resource)
+        except KeyError:
+            return None
+
+    @_locked
     def create_requirement_for(self, requirement_name, resource_paths, requirement_depends = ('basic',)):
         """ Updates path_resource_registry and requirement_registry with information needed to auto_need resources.
 
@@ -63,34 +317,48 @@ class ResourceRegistry(object):
                 A list of other requirements that the added resources will depend on.
                 It will iterate on all the libraries in these and add them as a dependency.
         """
+        if self._pending:
+            for name in (requirement_name,) + tuple(requirement_depends):
+                self._load_requirement(name)
         requirement = self.requirements.setdefault(requirement_name, [])
         if isinstance(resource_paths, str):
             resource_paths = (resource_paths,)
+        self._ensure_index()
+        members = set(requirement)
+        requirement_resources = set()
+        for depend in requirement_depends:
+            requirement_resources.update(self.requirements[depend])
         previous = None #To inject linear dependencies
         for resource_path in resource_paths:
-            #Deform2 prepends path with package name. Deform 1 doesn't.
-            path_items = resource_path.split(':', 1)
-            if len(path_items) == 2:
-                logger.debug("Got resource path '%s' - assuming Deform >= 2" % resource_path)
-                #Assume deform 2
-                lib_name = path_items[0]
-                if lib_name not in self.libraries:
-                    raise KeyError("You tried to create requirements for the resource path '%s' which specifies a package that isn't known. "
-                                   "Adjust the variable 'library_registry' and add it." % resource_path)
-                library = self.libraries[lib_name]
-            else:
-                logger.debug("Got resource path '%s' - assuming Deform < 2" % resource_path)
-                library = self.libraries['deform']
-                resource_path = "deform:static/%s" % resource_path
-            depends_on = []
-            for depend in requirement_depends:
-                depends_on.extend(self.requirements[depend])
-            if previous and previous not in depends_on:
-                depends_on.append(previous)
+            library, resource_path = self._requirement_resource_path(resource_path)
+            depends_on = set(requirement_resources)
+            if previous is not None:
+                depends_on.add(previous)
             resource = self.create_resource(resource_path, library = library, depends = depends_on)
-            if resource not in requirement:
+            if resource not in members:
+                members.add(resource)
                 requirement.append(resource)
+                self._index_resource(resource, requirement_name)
             previous = resource
+        self._bump_generation()
+        self._save_fingerprints()
+
+    def _requirement_resource_path(self, resource_path):
+        """ Return the library and the package path of a resource path given to
+            ``create_requirement_for``.
+        """
+        #Deform2 prepends path with package name. Deform 1 doesn't.
+        path_items = resource_path.split(':', 1)
+        if len(path_items) == 2:
+            logger.debug("Got resource path '%s' - assuming Deform >= 2", resource_path)
+            #Assume deform 2
+            lib_name = path_items[0]
+            if lib_name not in self.libraries:
+                raise KeyError("You tried to create requirements for the resource path '%s' which specifies a package that isn't known. "
+                               "Adjust the variable 'library_registry' and add it." % resource_path)
+            return self.libraries[lib_name], resource_path
+        logger.debug("Got resource path '%s' - assuming Deform < 2", resource_path)
+        return self.libraries['deform'], "deform:static/%s" % resource_path
 
     def create_resource(self, resource_path, library = None, depends = ()):
         """ Create a ``fanstatic.Resource`` object from a path. Returns created object
@@ -109,6 +377,11 @@ class ResourceRegistry(object):
                 like ``fanstatic.Resource``.
             
         """
+        self._ensure_index()
+        if resource_path in self._by_package_path:
+            existing = self._by_package_path[resource_path]
+            if library is None or library == existing.library:
+                return existing
         lib_name, path = resource_path.split(':', 1)
         if lib_name not in self.libraries:
             assert isinstance(library, Library)
@@ -118,15 +391,15 @@ class ResourceRegistry(object):
                 assert library == self.libraries[lib_name]
             else:
                 library = self.libraries[lib_name]
-        abs_path = pkg_resources.resource_filename(lib_name, path)
+        abs_path = _resource_filename(lib_name, path)
         rel_path = abs_path.replace("%s%s" % (library.path, os.sep), '')
         rel_path = rel_path.replace(os.sep, '/')
         if rel_path not in library.known_resources:
-            logger.debug("Adding '%s' to lib %s" % (abs_path, library))
+            logger.debug("Adding '%s' to lib %s", abs_path, library)
             resource = Resource(library, rel_path, depends = depends)
             return resource
         else:
-            logger.debug("Resource '%s' already known to lib %s - skipping." % (abs_path, library))
+            logger.debug("Resource '%s' already known to lib %s - skipping.", abs_path, library)
             return library.known_resources[rel_path]
             #fixme: return already existing resource
 
@@ -136,7 +409,7 @@ class ResourceRegistry(object):
             need to guess the included deform packages in deform2.
         """
         logger.debug("Adding deform basic needs.")
-        deform_version = pkg_resources.get_distribution('deform').version
+        deform_version = _distribution_version('deform')
         paths = []
         if deform_version.startswith('0'):
             #Default resources are marked as 'deform' in deform <2
@@ -149,30 +422,32 @@ class ResourceRegistry(object):
                     paths.extend(res)
         else:
             #Deform 2-style has package info as well. We use it as a fanstatic library name too
-            #Guess jquery name
-            scripts_dir = pkg_resources.resource_filename('deform', 'static/scripts')
-            jquery_fname = None
-            for fname in os.listdir(scripts_dir):
-                if re.match('^jquery\-[0-9]{1,2}(.*)\.min\.js$', fname):
-                    jquery_fname = fname
-                    break
-            if not jquery_fname: #pragma : no coverage
+            #Guess jquery name, from the cached index of deforms static directory
+            jquery_paths = get_static_index(deform_static).find(_jquery_pattern)
+            if not jquery_paths: #pragma : no coverage
                 raise IOError("Can't fint any jquery file within deform.")
             paths.extend(['deform:static/css/form.css',
                           'deform:static/css/bootstrap.min.css',])
             #Pre-register bootstrap and dependency on jquery
-            jquery = Resource(deform_autoneed_lib, "scripts/%s" % jquery_fname)
+            jquery = Resource(deform_autoneed_lib, jquery_paths[0])
             requirement = self.requirements.setdefault('basic', [])
             requirement.append(jquery)
+            self._index_resource(jquery, 'basic')
             bootstrap_js = Resource(deform_autoneed_lib, 'scripts/bootstrap.min.js', depends = (jquery,))
             requirement.append(bootstrap_js)
+            self._index_resource(bootstrap_js, 'basic')
+            self._bump_generation()
         self.create_requirement_for('basic', paths, requirement_depends=())
 
-    def populate_from_resources(self, resource_specs = None):
+    def populate_from_resources(self, resource_specs = None, lazy = False):
         """ Walk through resources from deform or another package
             and create fanstatic resources.
             If resource_specs is another package, it needs to have the same layout as:
             deform.widget.default_resources
+
+            lazy
+                Only record the resource paths. Each requirement is created
+                the first time it's needed, see ``load``.
         """
         if resource_specs is None:
             from deform.widget import default_resources
@@ -180,7 +455,72 @@ class ResourceRegistry(object):
         for (requirement_name, rinfo) in resource_specs.items():
             for resources in rinfo.values():
                 for (res_type, resource_paths) in resources.items():
-                    self.create_requirement_for(requirement_name, resource_paths)
+                    if lazy and requirement_name not in self.requirements:
+                        self._add_pending(requirement_name, resource_paths)
+                    else:
+                        self.create_requirement_for(requirement_name, resource_paths)
+
+    @_locked
+    def _add_pending(self, requirement_name, resource_paths):
+        if isinstance(resource_paths, str):
+            resource_paths = (resource_paths,)
+        for resource_path in resource_paths:
+            #Unknown libraries raise here, like they do when requirements are created
+            library, resource_path = self._requirement_resource_path(resource_path)
+            abs_path = os.path.normpath(_resource_filename(*resource_path.split(':', 1)))
+            self._pending_paths.setdefault(abs_path, set()).add(requirement_name)
+        self._pending.setdefault(requirement_name, []).append(tuple(resource_paths))
+
+    def load(self, requirement_names = None):
+        """ Create the requirements in requirement_names that were added lazily,
+            or all of them if requirement_names is None. Each requirement is created
+            exactly once, while holding the registry lock. Returns the registry.
+
+            ``resources_for``, ``find_resource``, ``replace_resource`` and ``remove_resource``
+            call it for what they need, so lazily added requirements behave like the others.
+        """
+        pending = self._pending
+        if pending and (requirement_names is None or any(x in pending for x in requirement_names)):
+            with self._lock:
+                if requirement_names is None:
+                    requirement_names = tuple(self._pending)
+                #Count as one change, unless a transaction already defers them
+                deferring = self._deferring
+                self._deferring = True
+                try:
+                    for name in requirement_names:
+                        self._load_requirement(name)
+                finally:
+                    self._deferring = deferring
+                    if not deferring and self._deferred_change:
+                        self._deferred_change = False
+                        self.generation += 1
+                self._save_fingerprints()
+        return self
+
+    def _load_requirement(self, requirement_name):
+        specs = self._pending.pop(requirement_name, None)
+        if specs is None:
+            return
+        for (abs_path, names) in tuple(self._pending_paths.items()):
+            names.discard(requirement_name)
+            if not names:
+                del self._pending_paths[abs_path]
+        logger.debug("Creating lazily added requirement '%s'", requirement_name)
+        for resource_paths in specs:
+            self.create_requirement_for(requirement_name, resource_paths)
+
+    def _load_path(self, abs_path):
+        """ Create the lazily added requirements that contain the file at abs_path. """
+        names = self._pending_paths.get(abs_path)
+        if names:
+            self.load(tuple(names))
+
+    def static_index(self, lib_name = 'deform'):
+        """ The ``deform_autoneed.staticindex.StaticIndex`` of a registered library's directory,
+            with the files in it and the library versions detected from them.
+        """
+        return get_static_index(self.libraries[lib_name].path)
 
     def resource_package_path(self, resource):
         """ Find the resources package path, similar to:
@@ -200,10 +540,55 @@ class ResourceRegistry(object):
         if library is None:
             raise KeyError("Couldn't find any matching library for this resource in %s" % self.libraries)
         abs_path = self._resource_fullpath(resource)
-        rel_path = abs_path.replace("%s%s" % (library.path, os.sep), "%s%s" % (library.rootpath, os.sep))
+        package_dir = _package_dir(name)
+        if package_dir is not None and abs_path.startswith(package_dir + os.sep):
+            rel_path = abs_path[len(package_dir) + 1:]
+        else:
+            rel_path = abs_path.replace("%s%s" % (library.path, os.sep), "%s%s" % (library.rootpath, os.sep))
         rel_path = rel_path.replace(os.sep, '/')
         return "%s:%s" % (name, rel_path)
 
+    def resources_for(self, requirement_names):
+        """ Return a tuple with every resource needed by the requirements in requirement_names,
+            including their dependencies. Each resource is only present once and always after
+            the resources it depends on. Unknown requirement names are ignored.
+
+            The order comes from the topological order of ``graph``, which is computed once
+            for the whole registry. The result is cached per set of requirement names until
+            the registry changes.
+        """
+        key = frozenset(requirement_names)
+        if self._resolved_generation == self.generation:
+            try:
+                return self._resolved[key]
+            except KeyError:
+                pass
+        self.load(key)
+        with self._lock:
+            if self._resolved_generation != self.generation:
+                self._resolved = {}
+                self._resolved_generation = self.generation
+            resources = self._resolved.get(key)
+            if resources is None:
+                self._ensure_index()
+                roots = []
+                for name in key:
+                    roots.extend(self.requirements.get(name, ()))
+                resources = self._resolved[key] = self.graph.resolve(roots)
+        return resources
+
+    def stats(self):
+        """ Return a dict with the size of the registry and, if instrumentation is enabled,
+            timings and counters for the instrumented calls.
+        """
+        result = {'generation': self.generation,
+                  'requirements': len(self.requirements),
+                  'pending': len(self._pending),
+                  'resolved': len(self._resolved)}
+        if self.instrumentation is not None:
+            result.update(self.instrumentation.stats())
+        return result
+
     def _resource_fullpath(self, resource):
         """ Fetch full path for resource. This already exists in later versions
             of fanstatic, but it's here for compat reasons.
@@ -218,35 +603,55 @@ class ResourceRegistry(object):
                 or a full path.
         """
         assert isinstance(resource_path, str)
+        self._ensure_index()
+        if resource_path in self._by_package_path:
+            return self._by_package_path[resource_path]
+        abs_path = resource_path
         if ':' in resource_path:
             #Assume package
             try:
-                resource_path = pkg_resources.resource_filename(*resource_path.split(':', 1))
+                abs_path = _resource_filename(*resource_path.split(':', 1))
             except ImportError: # Assume assumption was wrong (probably a MS Windows path)
                 pass
-        resources = set()
-        [resources.update(x) for x in self.requirements.values()]
-        for resource in resources:
-            if resource_path == self._resource_fullpath(resource):
-                return resource
+        abs_path = os.path.normpath(abs_path)
+        resource = self._by_path.get(abs_path)
+        if resource is None and abs_path in self._pending_paths:
+            self._load_path(abs_path)
+            self._ensure_index()
+            resource = self._by_path.get(abs_path)
+        return resource
 
+    @_locked
     def remove_resource(self, resource, dependencies = True):
         """ A method to remove a resource from the requirements and from the library it's registered in.
         """
         if isinstance(resource, str):
             resource = self.find_resource(resource)
         assert isinstance(resource, Resource)
-        for resources in self.requirements.values():
-            if resource in resources:
-                resources.remove(resource)
-            if dependencies:
-                for res in resources:
-                    if resource in res.depends:
-                        res.depends.remove(resource)
-                    if resource in res.resources:
-                        res.resources.remove(resource)
+        if self._pending_paths:
+            #Otherwise it would come back when its requirement is created
+            self._load_path(self._resource_fullpath(resource))
+        self._ensure_index()
+        self._remove_resource(resource, dependencies)
+        self._bump_generation()
+
+    def _remove_resource(self, resource, dependencies):
+        """ Remove resource from the requirements it belongs to and,
+            if dependencies is true, from the resources that depend on it.
+        """
+        for name in self._requirement_names.get(resource, ()):
+            self.requirements[name].remove(resource)
+        if dependencies and resource in self.graph:
+            for res in self.graph.dependents[resource]:
+                res.depends.discard(resource)
+                resource.supports.discard(res)
+            for res in self.graph.all_dependents(resource):
+                res.resources.discard(resource)
+            self.graph.remove(resource)
+        self._unindex_resource(resource)
         del resource.library.known_resources[resource.relpath]
 
+    @_locked
     def replace_resource(self, old, new, dependencies = True):
         """ Replace a resource with a new one.
             You can either specify a resource as a package path, IE:
@@ -264,36 +669,476 @@ class ResourceRegistry(object):
         if isinstance(old, str):
             old = self.find_resource(old)
         assert isinstance(old, Resource)
+        if self._pending_paths:
+            self._load_path(self._resource_fullpath(old))
         if isinstance(new, str):
             new = self.create_resource(new)
         assert isinstance(new, Resource)
-        for resources in self.requirements.values():
-            if old in resources:
-                pos = resources.index(old)
-                resources.insert(pos, new)
-            if dependencies:
-                for res in resources:
-                    if old in res.depends:
-                        res.depends.add(new)
-                    if old in res.resources:
-                        res.resources.add(new)
-        self.remove_resource(old, dependencies = dependencies)
-
-resource_registry = ResourceRegistry()
-
-
-def auto_need(form, reg = None):
+        self._ensure_index()
+        self._add_to_graph(new)
+        dependents = ()
+        if dependencies and old in self.graph:
+            dependents = tuple(self.graph.dependents[old])
+            #Check before anything is changed
+            closure = self.graph.closure(new)
+            for res in dependents:
+                if res in closure:
+                    raise DependencyCycleError((res,) + self.graph.path(new, res))
+            for res in self.graph.all_dependents(old):
+                res.resources.update(new.resources)
+        for name in tuple(self._requirement_names.get(old, ())):
+            resources = self.requirements[name]
+            resources.insert(resources.index(old), new)
+            self._index_resource(new, name)
+        for res in dependents:
+            res.depends.add(new)
+            new.supports.add(res)
+            self.graph.add_dependency(res, new)
+        self._remove_resource(old, dependencies)
+        self._bump_generation()
+
+    def freeze(self):
+        """ Return a ``FrozenRegistry`` of the current state of the registry.
+            The view is built once per generation while holding the registry lock,
+            and published by replacing a single attribute, so it's always complete.
+            Reading from it never needs a lock.
+        """
+        frozen = self._frozen
+        if frozen is not None and frozen.generation == self.generation:
+            return frozen
+        with self._lock:
+            frozen = self._frozen
+            if frozen is None or frozen.generation != self.generation:
+                if self._resolved_generation != self.generation:
+                    self._resolved = {}
+                    self._resolved_generation = self.generation
+                frozen = self._frozen = FrozenRegistry(self)
+        return frozen
+
+    def transaction(self):
+        """ Return a ``RegistryTransaction`` that collects changes to this registry
+            and applies them together. Use it as a context manager::
+
+                with resource_registry.transaction() as transaction:
+                    transaction.replace_resource('deform:static/css/form.css', 'mytheme:static/form.css')
+                    transaction.remove_resource('deform:static/css/beautify.css')
+        """
+        return RegistryTransaction(self)
+
+
+class FrozenRegistry(object):
+    """ An immutable view of a ``ResourceRegistry`` as it was at one generation.
+        Create it through ``ResourceRegistry.freeze``. It can be passed as reg
+        to ``auto_need``, ``need_lib`` and ``need_resources``.
+
+        requirements
+            A read-only mapping of requirement names to tuples of resources.
+
+        libraries
+            A read-only mapping of the registered libraries.
+
+        Changes to the registry don't affect which requirements and resources an
+        existing view resolves. They're published as a new view the next time
+        ``freeze`` is called.
+        ``bundler`` and ``instrumentation`` are those of the registry.
+        Requirements that the registry hasn't created yet are created through
+        ``load``, which returns a new view if anything was created.
+
+        That isolation doesn't cover the ``fanstatic.Resource`` objects. They're shared
+        with the registry, and fanstatic renders the dependencies they have at that
+        time. ``replace_resource`` and ``remove_resource`` change those in place, so a
+        request that renders while they run may see a part of the change, whichever
+        view it uses. Make such changes during startup, or use a ``RegistryOverlay``,
+        which never changes shared resources.
+
+        The view shares the dependency closures, the order and the resolved
+        requirement sets with the registry, so it only adds its tuples and mappings.
+    """
+    __slots__ = ('registry', 'generation', 'requirements', 'libraries',
+                 '_closures', '_order', '_resolved')
+
+    def __init__(self, registry):
+        registry._ensure_index()
+        graph = registry.graph
+        self.registry = registry
+        self.generation = registry.generation
+        requirements = {}
+        closures = {}
+        for (name, resources) in registry.requirements.items():
+            requirements[name] = resources = tuple(resources)
+            for resource in resources:
+                if resource not in closures:
+                    #Frozensets the graph replaces instead of changing, like its order
+                    closures[resource] = graph.closure(resource)
+        self.requirements = types.MappingProxyType(requirements)
+        self.libraries = types.MappingProxyType(dict(registry.libraries))
+        self._closures = closures
+        self._order = graph.order()
+        #Only replaced by the registry when its generation changes
+        self._resolved = registry._resolved
+
+    @property
+    def bundler(self):
+        return self.registry.bundler
+
+    @property
+    def instrumentation(self):
+        return self.registry.instrumentation
+
+    def freeze(self):
+        return self
+
+    def load(self, requirement_names = None):
+        """ Create lazily added requirements in the registry, see ``ResourceRegistry.load``.
+            Returns this view, or a view of the registry afterwards if anything was created.
+        """
+        pending = self.registry._pending
+        if pending and (requirement_names is None or any(x in pending for x in requirement_names)):
+            return self.registry.load(requirement_names).freeze()
+        return self
+
+    def resources_for(self, requirement_names):
+        """ Same as ``ResourceRegistry.resources_for``. """
+        key = frozenset(requirement_names)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        reg = self.load(key)
+        if reg is not self:
+            return reg.resources_for(key)
+        result = set()
+        for name in key:
+            for resource in self.requirements.get(name, ()):
+                result.update(self._closures[resource])
+        resources = self._resolved[key] = tuple(sorted(result, key = self._order.__getitem__))
+        return resources
+
+
+class RegistryTransaction(object):
+    """ Changes to a ``ResourceRegistry`` that are validated and applied together.
+
+        The methods ``create_requirement_for``, ``remove_resource`` and ``replace_resource``
+        take the same arguments as the registry methods, but only record the change.
+        ``commit`` checks every change before anything is applied: requirement names,
+        libraries, resource files and dependency cycles, as far as they can be known
+        before the earlier changes are made. Then the changes are applied while holding
+        the registry lock, and the registry generation is increased once, so cached
+        results are invalidated once. If a change fails anyway, everything the earlier
+        ones changed is restored, including the fanstatic resources, and the generation
+        stays the same.
+
+        Views returned by ``freeze`` only pick up a commit when it's done. Fanstatic
+        resources are changed in place while it runs though, so pages rendered at the
+        same time may see a part of it.
+
+        Used as a context manager, the changes are committed when the block ends,
+        unless it raises an exception.
+    """
+
+    def __init__(self, reg):
+        self.reg = reg
+        self.operations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.operations = []
+        return False
+
+    def create_requirement_for(self, requirement_name, resource_paths, requirement_depends = ('basic',)):
+        if isinstance(resource_paths, str):
+            resource_paths = (resource_paths,)
+        self.operations.append(('create_requirement_for', (requirement_name, tuple(resource_paths), tuple(requirement_depends))))
+
+    def remove_resource(self, resource, dependencies = True):
+        self.operations.append(('remove_resource', (resource, dependencies)))
+
+    def replace_resource(self, old, new, dependencies = True):
+        self.operations.append(('replace_resource', (old, new, dependencies)))
+
+    def validate(self):
+        """ Raise an exception if any of the recorded changes can't be applied. """
+        reg = self.reg
+        requirement_names = set(reg.requirements).union(reg._pending)
+        created = set()
+        removed = set()
+        def _check_new(resource_path):
+            lib_name, path = resource_path.split(':', 1)
+            if lib_name not in reg.libraries:
+                raise KeyError("The resource path '%s' specifies a package that isn't known to the registry." % resource_path)
+            abs_path = _resource_filename(lib_name, path)
+            #Files in the cached index of the library don't need a stat
+            if not (reg.static_index(lib_name).contains_path(abs_path) or os.path.exists(abs_path)):
+                raise UnknownResourceError("Resource file does not exist: %s" % abs_path)
+            created.add(resource_path)
+        def _check_existing(resource):
+            if isinstance(resource, str):
+                if resource not in created:
+                    found = reg.find_resource(resource)
+                    if found is None:
+                        raise KeyError("No resource found for '%s'" % resource)
+                    resource = found
+            elif resource.library.known_resources.get(resource.relpath) is not resource:
+                raise KeyError("%r isn't known to its library" % resource)
+            if resource in removed:
+                raise KeyError("%r was already removed in this transaction" % resource)
+            removed.add(resource)
+            return resource
+        with reg._lock:
+            for (name, args) in self.operations:
+                if name == 'create_requirement_for':
+                    requirement_name, resource_paths, requirement_depends = args
+                    for depend in requirement_depends:
+                        if depend not in requirement_names:
+                            raise KeyError("Unknown requirement '%s'" % depend)
+                    for resource_path in resource_paths:
+                        library, resource_path = reg._requirement_resource_path(resource_path)
+                        _check_new(resource_path)
+                    requirement_names.add(requirement_name)
+                elif name == 'remove_resource':
+                    _check_existing(args[0])
+                else:
+                    old, new, dependencies = args
+                    old = _check_existing(old)
+                    if isinstance(new, str):
+                        if new in created:
+                            continue
+                        found = reg.find_resource(new)
+                        if found is None:
+                            _check_new(new)
+                            continue
+                        new = found
+                    if dependencies and isinstance(old, Resource) and old in reg.graph:
+                        for res in reg.graph.dependents[old]:
+                            if res is new or res in new.resources:
+                                #new depends on res, directly or indirectly
+                                raise DependencyCycleError((res, new, res))
+
+    def commit(self):
+        """ Validate and apply the recorded changes. """
+        reg = self.reg
+        with reg._lock:
+            self.validate()
+            state = _RegistryState(reg, [x for (name, args) in self.operations for x in args])
+            reg._deferring = True
+            try:
+                for (name, args) in self.operations:
+                    getattr(reg, name)(*args)
+            except BaseException:
+                state.restore()
+                reg._deferred_change = False
+                raise
+            finally:
+                reg._deferring = False
+                self.operations = []
+                if reg._deferred_change:
+                    reg._deferred_change = False
+                    reg.generation += 1
+            reg._save_fingerprints()
+
+
+class _RegistryState(object):
+    """ Everything the registry methods change, so a failed commit can be undone.
+        Resources in extra are saved too, if they're fanstatic resources.
+    """
+
+    def __init__(self, reg, extra = ()):
+        reg._ensure_index()
+        self.reg = reg
+        self.requirements = [(name, list(resources)) for (name, resources) in reg.requirements.items()]
+        self.libraries = dict(reg.libraries)
+        self.pending = dict((name, list(specs)) for (name, specs) in reg._pending.items())
+        self.pending_paths = dict((path, set(names)) for (path, names) in reg._pending_paths.items())
+        resources = set(reg.graph.depends)
+        resources.update(x for x in extra if isinstance(x, Resource))
+        libraries = set(self.libraries.values())
+        libraries.update(x.library for x in resources)
+        self.library_state = []
+        for library in libraries:
+            self.library_state.append((library, dict(library.known_resources), list(library.known_assets),
+                                       set(library._library_deps)))
+            resources.update(library.known_resources.values())
+        self.resources = [(x, set(x.depends), set(x.resources), set(x.supports)) for x in resources]
+
+    def restore(self):
+        reg = self.reg
+        #Not through the requirements dict, which would count as a change
+        dict.clear(reg.requirements)
+        dict.update(reg.requirements, self.requirements)
+        reg.libraries.clear()
+        reg.libraries.update(self.libraries)
+        reg._pending = self.pending
+        reg._pending_paths = self.pending_paths
+        for (library, known_resources, known_assets, library_deps) in self.library_state:
+            library.known_resources = known_resources
+            library.known_assets = known_assets
+            library._library_deps = library_deps
+        for (resource, depends, resources, supports) in self.resources:
+            resource.depends = depends
+            resource.resources = resources
+            resource.supports = supports
+        #The indexes and the graph are rebuilt from the restored requirements
+        reg._index_stale = True
+
+_resource_registry = None
+_resource_registry_lock = threading.Lock()
+
+
+def get_resource_registry():
+    """ Return the global ``ResourceRegistry``. It's created the first time it's needed,
+        so importing this package doesn't cost anything.
+        ``deform_autoneed.resource_registry`` is the same object.
+    """
+    global _resource_registry
+    if _resource_registry is None:
+        with _resource_registry_lock:
+            if _resource_registry is None:
+                _resource_registry = ResourceRegistry()
+    return _resource_registry
+
+def __getattr__(name):
+    if name == 'resource_registry':
+        return get_resource_registry()
+    raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+
+class WidgetRequirementsCache(object):
+    """ Caches the result of ``get_widget_requirements`` per form instance.
+        Forms are held weakly, so the cache never keeps a form alive.
+
+        A cached result is reused as long as the form has the same widgets
+        with the same requirements objects. Replacing a widget, or adding and
+        removing fields, causes the requirements to be computed again.
+        If you change a widgets requirements in place, call ``forget``.
+
+        Finding out whether the widgets changed still visits every field, so a hit
+        costs O(fields). It only does identity checks though, and no lists of
+        requirements are built, so it's about a third cheaper than
+        ``get_widget_requirements``.
+
+        hits and misses
+            Number of lookups that were answered from the cache and
+            number of lookups that had to walk the form.
+    """
+
+    def __init__(self):
+        self._cache = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, form):
+        """ Return the widget requirements of form. """
+        cached = self._cache.get(form)
+        if cached is not None and _same_widgets(form, cached[0]):
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        requirements = tuple(form.get_widget_requirements())
+        self._cache[form] = (_widget_signature(form), requirements)
+        return requirements
+
+    def forget(self, form):
+        """ Drop the cached requirements for form. """
+        self._cache.pop(form, None)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """ Return a dict with the number of hits, misses and cached forms. """
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+widget_requirements_cache = WidgetRequirementsCache()
+
+
+def _widget_signature(field):
+    """ A flat tuple of every widget in the field tree, its requirements and
+        the number of children of its field, in depth first order.
+        The objects themselves are kept so they can be compared by identity.
+    """
+    signature = []
+    stack = [field]
+    while stack:
+        field = stack.pop()
+        widget = field.widget
+        children = field.children
+        signature.append(widget)
+        signature.append(getattr(widget, 'requirements', None))
+        signature.append(len(children))
+        stack.extend(children)
+    return tuple(signature)
+
+def _same_widgets(field, signature):
+    """ True if the field tree still matches signature. Stops at the first difference. """
+    size = len(signature)
+    i = 0
+    stack = [field]
+    while stack:
+        field = stack.pop()
+        widget = field.widget
+        children = field.children
+        if i == size or signature[i] is not widget or signature[i + 2] != len(children):
+            return False
+        requirements = getattr(widget, 'requirements', None)
+        if signature[i + 1] is not requirements and signature[i + 1] != requirements:
+            return False
+        i += 3
+        stack.extend(children)
+    return i == size
+
+
+def auto_need(form, reg = None, requirements_cache = None):
     """ Check libraries required by the current widgets.
         Each librarys requirements is stored in the requirements_registry.
+        The resolved resources are cached by the registry, so forms with the same
+        requirements only cost a single lookup. Requirements that were already
+        needed in the current request are skipped, so rendering many forms on
+        one page only resolves what the earlier forms didn't need.
+
+        reg
+            A ``ResourceRegistry`` or a ``FrozenRegistry``. By default the frozen
+            view of the global registry.
+
+        requirements_cache
+            An optional ``WidgetRequirementsCache`` to avoid walking the
+            widgets of the same form instance on every render.
     """
     if reg is None: #pragma : no coverage
-        reg = resource_registry
-    need_lib('basic', reg = reg)
-    requirements = form.get_widget_requirements()
-    for library, version in requirements:
-        for resource in reg.requirements.get(library, ()):
-            logger.debug('Including %s via auto_need' % resource)
-            resource.need()
+        reg = get_resource_registry().freeze()
+    instrumentation = reg.instrumentation
+    if instrumentation is not None:
+        start = time.perf_counter()
+    if requirements_cache is None:
+        widget_requirements = form.get_widget_requirements()
+    else:
+        widget_requirements = requirements_cache.get(form)
+    requirement_names = set(['basic'])
+    for library, version in widget_requirements:
+        requirement_names.add(library)
+    reg = reg.load(requirement_names)
+    needed = current_needed()
+    already_needed = needed_requirements(needed)
+    if requirement_names.issubset(already_needed):
+        resources = ()
+    else:
+        new_names = requirement_names.difference(already_needed)
+        if reg.bundler is None:
+            resources = reg.resources_for(new_names)
+        else:
+            resources = reg.bundler.bundles_for(new_names, already_needed)
+        logger.debug("Including %s via auto_need", resources)
+        _need_all(resources, requirement_names, needed)
+    if instrumentation is not None:
+        hit = sorted(x for x in requirement_names if x in reg.requirements)
+        missed = sorted(x for x in requirement_names if x not in reg.requirements)
+        instrumentation.record('auto_need', time.perf_counter() - start, len(resources), hit, missed)
 
 def need_lib(lib_name, reg = None):
     """ Call this to include for instance deforms basic components
@@ -302,13 +1147,116 @@ def need_lib(lib_name, reg = None):
         just call need_lib('basic') to include it.
     """
     if reg is None: #pragma : no coverage
-        reg = resource_registry
-    [resource.need() for resource in reg.requirements[lib_name]]
+        reg = get_resource_registry().freeze()
+    instrumentation = reg.instrumentation
+    if instrumentation is not None:
+        start = time.perf_counter()
+    resources = need_resources((lib_name,), reg = reg)
+    if instrumentation is not None:
+        instrumentation.record('need_lib', time.perf_counter() - start, len(resources), (lib_name,))
+
+def need_resources(resources, reg = None):
+    """ Need several resources for the current request in one operation.
+
+        resources
+            An iterable of fanstatic resources and requirement names. A name is replaced
+            by the resources of that requirement in the registry, including their dependencies.
+            Unknown names raise a KeyError. Duplicates are only needed once, and
+            names that were already needed in the current request are skipped.
+
+        Returns a tuple of the resources that were needed.
+    """
+    needed = current_needed()
+    already_needed = needed_requirements(needed)
+    resolved = []
+    names = []
+    for item in resources:
+        if isinstance(item, str):
+            names.append(item)
+        else:
+            resolved.append(item)
+    if names:
+        if reg is None: #pragma : no coverage
+            reg = get_resource_registry().freeze()
+        reg = reg.load(names)
+        for name in names:
+            if name not in reg.requirements:
+                raise KeyError(name)
+        new_names = set(names).difference(already_needed)
+        if new_names:
+            resolved.extend(reg.resources_for(new_names))
+    resolved = tuple(dict.fromkeys(resolved))
+    _need_all(resolved, names, needed)
+    return resolved
+
+_needed_var = contextvars.ContextVar('deform_autoneed_needed', default = None)
+
+
+def current_needed():
+    """ The ``fanstatic.NeededResources`` of the current request. That's the one
+        set for the current asyncio task or context by ``deform_autoneed.asgi``,
+        if there is one, otherwise fanstatics thread-local one.
+    """
+    needed = _needed_var.get()
+    if needed is None:
+        return get_needed()
+    return needed
+
+def needed_requirements(needed = None):
+    """ Set of the requirement names that were needed in the current request,
+        through ``auto_need``, ``need_lib`` or ``need_resources``.
+        It's kept per ``fanstatic.NeededResources`` object, held weakly, and reset when
+        its resources are cleared. Other kinds of needed resources, like subclasses,
+        aren't tracked, so an empty set is returned and nothing is skipped for them.
+    """
+    if needed is None:
+        needed = current_needed()
+    if type(needed) is not NeededResources:
+        return set()
+    #NeededResources.clear replaces this set
+    resources = needed._resources
+    record = _needed_records.get(needed)
+    if record is None or record[0] is not resources:
+        record = _needed_records[needed] = (resources, set())
+    return record[1]
+
+_needed_records = weakref.WeakKeyDictionary()
+
+
+def _resolve_requirements(reg, requirement_names):
+    if reg.bundler is not None:
+        return reg.bundler.bundles_for(requirement_names)
+    return reg.resources_for(requirement_names)
 
-def patch_deform():
+def _need_all(resources, requirement_names = (), needed = None):
+    if needed is None:
+        needed = current_needed()
+    if type(needed) is NeededResources:
+        #Same as calling need without slots for each resource
+        needed._resources.update(resources)
+        needed_requirements(needed).update(requirement_names)
+    else:
+        for resource in resources:
+            needed.need(resource)
+
+def _resource_sort_key(resource):
+    return (resource.library.name, resource.relpath)
+
+def patch_deform(cache_requirements = False, requirements_cache = None):
     """ Copied from js.deform - this package should do the same thing, even though the auto_need
-        functions are different. """
+        functions are different.
+
+        cache_requirements
+            Cache the widget requirements of each form instance in
+            ``widget_requirements_cache`` instead of walking the widgets on every render.
+
+        requirements_cache
+            An object with a ``get(form)`` method to use instead, passed on to ``auto_need``.
+            For instance an ``AssetManifest`` from ``deform_autoneed.manifest.warm_up``.
+    """
     _marker = object()
+    if requirements_cache is None and cache_requirements:
+        requirements_cache = widget_requirements_cache
     from deform import (Form,
                         ValidationFailure)
     logger.debug("Patching deform methods Form.render and ValidationFailure.render to run auto_need.")
@@ -316,17 +1264,123 @@ def patch_deform():
     def form_render(self, appstruct=_marker, **kw):
         if appstruct is not _marker:  # pragma: no cover  (copied from deform)
             kw['appstruct'] = appstruct
+        reg = get_resource_registry().freeze()
+        instrumentation = reg.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
         html = super(Form, self).render(**kw)
-        auto_need(self)
+        auto_need(self, reg = reg, requirements_cache = requirements_cache)
+        if instrumentation is not None:
+            instrumentation.record('form_render', time.perf_counter() - start)
         return html
 
     def validationfailure_render(self):
-        auto_need(self.field)
-        return self.field.widget.serialize(self.field, self.cstruct)
+        reg = get_resource_registry().freeze()
+        instrumentation = reg.instrumentation
+        if instrumentation is not None:
+            start = time.perf_counter()
+        auto_need(self.field, reg = reg, requirements_cache = requirements_cache)
+        html = self.field.widget.serialize(self.field, self.cstruct)
+        if instrumentation is not None:
+            instrumentation.record('validationfailure_render', time.perf_counter() - start)
+        return html
 
     Form.render = form_render
     ValidationFailure.render = validationfailure_render
 
-def includeme(config = None):
-    resource_registry.populate_from_resources()
-    patch_deform()
+def includeme(config = None, snapshot_path = None, requirements_cache = None):
+    """ Populate the registry and patch deform.
+
+        snapshot_path
+            Restore the registry from a snapshot file at this path if it's still valid.
+            Otherwise the registry is populated the normal way and the snapshot is written,
+            so the next process can start from it. See ``deform_autoneed.snapshot``.
+
+        requirements_cache
+            Passed on to ``patch_deform``.
+
+        Settings when used as a Pyramid include:
+
+        deform_autoneed.cache_requirements
+            Cache widget requirements per form instance. (Default false)
+
+        deform_autoneed.requirements_cache
+            Same as requirements_cache. It's an object, so it has to be set in the
+            settings from Python, not in an ini-file.
+
+        deform_autoneed.snapshot
+            Same as snapshot_path.
+
+        deform_autoneed.lazy
+            Only create the resources of a requirement the first time it's needed,
+            see ``ResourceRegistry.load``. Not used together with a snapshot. (Default false)
+
+        deform_autoneed.bundle_dir
+            Write bundles of the resources each form needs to this directory,
+            and need them instead of the separate resources.
+            See ``deform_autoneed.bundles``.
+
+        deform_autoneed.fingerprints
+            Render resources with a content hash in their URL. (Default false)
+            See ``deform_autoneed.fingerprint``.
+
+        deform_autoneed.fingerprint_cache
+            A file to keep the content hashes in between restarts.
+
+        deform_autoneed.inline_threshold
+            Render CSS and Javascript files up to this many bytes inline in the page.
+            See ``deform_autoneed.inline``. (Default 0, nothing is inlined)
+
+        deform_autoneed.instrumentation
+            Collect timings and counters, see ``ResourceRegistry.stats``. (Default false)
+    """
+    settings = {}
+    if config is not None:
+        settings = config.registry.settings or {}
+    cache_requirements = _asbool(settings.get('deform_autoneed.cache_requirements', False))
+    requirements_cache = settings.get('deform_autoneed.requirements_cache', requirements_cache)
+    snapshot_path = settings.get('deform_autoneed.snapshot', snapshot_path)
+    if snapshot_path:
+        _populate_from_snapshot(snapshot_path)
+    else:
+        lazy = _asbool(settings.get('deform_autoneed.lazy', False))
+        get_resource_registry().populate_from_resources(lazy = lazy)
+    bundle_dir = settings.get('deform_autoneed.bundle_dir')
+    if bundle_dir:
+        from deform_autoneed.bundles import BundleBuilder
+        reg = get_resource_registry()
+        reg.bundler = BundleBuilder(reg, bundle_dir)
+    if _asbool(settings.get('deform_autoneed.fingerprints', False)):
+        from deform_autoneed.fingerprint import enable_fingerprints
+        enable_fingerprints(get_resource_registry(), cache_path = settings.get('deform_autoneed.fingerprint_cache'))
+    inline_threshold = int(settings.get('deform_autoneed.inline_threshold', 0))
+    if inline_threshold:
+        from deform_autoneed.inline import enable_inlining
+        enable_inlining(get_resource_registry(), threshold = inline_threshold)
+    if _asbool(settings.get('deform_autoneed.instrumentation', False)):
+        from deform_autoneed.instrumentation import enable_instrumentation
+        enable_instrumentation(get_resource_registry())
+    patch_deform(cache_requirements = cache_requirements, requirements_cache = requirements_cache)
+
+def _populate_from_snapshot(snapshot_path):
+    global _resource_registry
+    from deform_autoneed.snapshot import (load_snapshot,
+                                          save_snapshot)
+    with _resource_registry_lock:
+        reg = _resource_registry
+        if reg is None:
+            reg = ResourceRegistry(add_basics = False)
+        if not load_snapshot(snapshot_path, reg):
+            if not reg.requirements.get('basic'):
+                reg.add_deform_basics()
+            reg.populate_from_resources()
+            try:
+                save_snapshot(reg, snapshot_path)
+            except (OSError, ValueError) as exc:
+                logger.warning("Couldn't save registry snapshot to %s: %s", snapshot_path, exc)
+        _resource_registry = reg
+
+def _asbool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('true', 'yes', 'on', '1')
+    return bool(value)
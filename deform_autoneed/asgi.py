@@ -0,0 +1,117 @@
+""" Needed resources per asyncio task, for ASGI servers.
+
+    Fanstatic keeps the needed resources of a request in a thread-local, which is shared
+    by every request an event loop handles at the same time. ``InjectorMiddleware`` keeps
+    them in a context variable instead, so each request task has its own, and injects
+    the resource tags into HTML responses like fanstatics WSGI ``Injector`` does::
+
+        from deform_autoneed.asgi import InjectorMiddleware
+
+        app = InjectorMiddleware(app, bottom = True)
+
+    Keyword arguments are the same as for ``fanstatic.Injector``. ``auto_need``, ``need_lib``,
+    ``need_resources`` and the patched render methods use the needed resources of the
+    current task while the middleware runs. Tasks created within the request share them.
+    Code in other threads only does if the context is copied, like ``asyncio.to_thread`` does.
+
+    The resources still have to be published. Serve them with fanstatics ``Publisher``
+    through a WSGI adapter, or from the static directories directly.
+"""
+from fanstatic import (NEEDED,
+                       NeededResources,
+                       get_library_registry)
+from fanstatic.injector import (CONTENT_TYPES,
+                                TopBottomInjector)
+
+from deform_autoneed import _needed_var
+
+
+def init_needed(**config):
+    """ Set a new ``fanstatic.NeededResources`` for the current context and return it.
+        Arguments are passed to ``NeededResources``.
+    """
+    get_library_registry().prepare()
+    needed = NeededResources(**config)
+    _needed_var.set(needed)
+    return needed
+
+def del_needed():
+    """ Use fanstatics thread-local needed resources again in the current context. """
+    _needed_var.set(None)
+
+
+class InjectorMiddleware(object):
+    """ ASGI middleware that keeps the needed resources of each request in a context
+        variable and renders them into HTML responses.
+
+        app
+            The ASGI application to wrap.
+
+        injector
+            A fanstatic injector plugin. By default a ``TopBottomInjector``
+            configured from the keyword arguments.
+
+        Other keyword arguments are passed to ``NeededResources``.
+    """
+
+    def __init__(self, app, injector = None, **config):
+        config = dict(config)
+        if injector is None:
+            #Takes its own options out of config
+            injector = TopBottomInjector(config)
+        #Validates the rest
+        NeededResources(**config)
+        self.app = app
+        self.injector = injector
+        self.config = config
+
+    async def __call__(self, scope, receive, send):
+        #The same methods as fanstatics Injector
+        if scope['type'] != 'http' or scope.get('method') not in ('GET', 'POST', 'HEAD'):
+            await self.app(scope, receive, send)
+            return
+        get_library_registry().prepare()
+        needed = NeededResources(script_name = scope.get('root_path') or None, **self.config)
+        scope = dict(scope)
+        scope[NEEDED] = needed
+        response_start = None
+        body = []
+
+        async def _send(message):
+            nonlocal response_start
+            if message['type'] == 'http.response.start':
+                if _is_html(message.get('headers', ())):
+                    response_start = message
+                    return
+            elif message['type'] == 'http.response.body' and response_start is not None:
+                body.append(message.get('body', b''))
+                if message.get('more_body', False):
+                    return
+                html = b''.join(body)
+                start, response_start = response_start, None
+                if not html and scope['method'] == 'HEAD':
+                    #Without the body, the headers of the application are the best guess
+                    await send(start)
+                    await send(message)
+                    return
+                if needed.has_resources():
+                    html = self.injector(html, needed)
+                headers = [x for x in start.get('headers', ()) if x[0].lower() != b'content-length']
+                headers.append((b'content-length', str(len(html)).encode('latin-1')))
+                await send(dict(start, headers = headers))
+                await send({'type': 'http.response.body', 'body': html})
+                return
+            await send(message)
+
+        token = _needed_var.set(needed)
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _needed_var.reset(token)
+
+
+def _is_html(headers):
+    for (name, value) in headers:
+        if name.lower() == b'content-type':
+            return value.decode('latin-1').split(';', 1)[0].strip().lower() in CONTENT_TYPES
+    return False
@@ -0,0 +1,251 @@
+""" Concatenate the resources needed by a set of requirements into one CSS and one
+    Javascript file, so a page only needs a couple of requests for everything deform
+    wants.
+
+    Bundles are built from the resolved resources of ``ResourceRegistry.resources_for``
+    in dependency order, so they work for any library registered in the registry.
+    They're written to a directory of your choice and served as a fanstatic library
+    of their own. The file names contain a hash of the content, so they can be cached
+    forever.
+
+    Usage::
+
+        from deform_autoneed import get_resource_registry
+        from deform_autoneed.bundles import BundleBuilder
+
+        reg = get_resource_registry()
+        reg.bundler = BundleBuilder(reg, '/var/cache/myapp/bundles')
+
+    After that ``auto_need`` will need bundles instead of the separate resources.
+    When several forms are rendered in one request, each bundle only contains what
+    the forms before it didn't need, so shared code is loaded once.
+
+    Bundles are served from a library of their own, which sorts after the libraries
+    of everything bundled, so fanstatic renders them after the resources that weren't
+    bundled, like jQuery when tinymce is excluded.
+"""
+import hashlib
+import os
+import re
+import threading
+
+from fanstatic import (Library,
+                       Resource,
+                       get_library_registry)
+
+from deform_autoneed.utils import (init_late_resource,
+                                   write_atomic)
+
+
+BUNDLE_EXTENSIONS = ('.css', '.js')
+
+_css_url = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_css_charset = re.compile(r"""^@charset\s+['"][^'"]*['"]\s*;\s*""", re.MULTILINE)
+_absolute_url = re.compile(r'^([a-z][a-z0-9+.-]*:|/|#)', re.IGNORECASE)
+
+
+class BundleBuilder(object):
+    """ Builds and keeps track of bundles for a ``ResourceRegistry``.
+
+        reg
+            The registry to take resources from.
+
+        output_dir
+            Directory to write bundles to. It will be created if needed.
+
+        library_name
+            Name of the fanstatic library the bundles are served from.
+
+        url_prefix
+            Prefix of the URLs fanstatic serves libraries on. Relative ``url(...)``
+            references in CSS are rewritten to point at the original library below it.
+
+        minifiers
+            An optional dict with a file extension as key and a callable as value.
+            The callable gets the text of a whole bundle and returns the minified text.
+            For instance ``{'.js': rjsmin.jsmin, '.css': rcssmin.cssmin}``.
+
+        exclude
+            Requirement names whose resources should never be bundled. By default that's
+            tinymce, since it loads its plugins relative to its own URL. Since fanstatic
+            includes the dependencies of those resources, they aren't bundled either,
+            also not for forms that don't need the excluded requirements. Otherwise
+            they'd be loaded twice when such a form is rendered after one that
+            bundled them. The same goes for resources with ``dont_bundle`` set.
+
+        register_library
+            Add the bundle library to fanstatics library registry, so fanstatic will publish it.
+            This must happen before fanstatic has prepared its registry, i.e. during startup.
+    """
+
+    def __init__(self, reg, output_dir, library_name = 'deform_autoneed_bundles',
+                 url_prefix = '/fanstatic', minifiers = None, exclude = ('tinymce',),
+                 register_library = True):
+        self.reg = reg
+        self.output_dir = os.path.abspath(output_dir)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self.library = _BundleLibrary(library_name, self.output_dir)
+        self.url_prefix = url_prefix.rstrip('/')
+        self.minifiers = minifiers or {}
+        self.exclude = frozenset(exclude)
+        self._bundles = {}
+        self._excluded = None
+        self._generation = reg.generation
+        self._lock = threading.Lock()
+        if register_library:
+            library_registry = get_library_registry()
+            if library_registry.get(library_name) is not self.library:
+                library_registry.add(self.library)
+
+    def bundles_for(self, requirement_names, already_needed = ()):
+        """ Return a tuple of resources to need instead of the resources of requirement_names.
+            That's one bundle per file type, and any resources that can't be bundled.
+            Results are cached until the registry changes.
+
+            already_needed
+                Requirement names that were needed earlier in the same request. Their
+                resources and dependencies are left out, and the bundles sort after
+                any bundle built for a part of them.
+        """
+        key = (frozenset(requirement_names), frozenset(already_needed))
+        if self._generation != self.reg.generation:
+            self._bundles = {}
+            self._excluded = None
+            self._generation = self.reg.generation
+        try:
+            return self._bundles[key]
+        except KeyError:
+            pass
+        with self._lock:
+            result = self._bundles.get(key)
+            if result is None:
+                if self._excluded is None:
+                    self._excluded = self._find_excluded()
+                excluded = self._excluded
+                resources = self.reg.resources_for(key[0])
+                depth = 0
+                if key[1]:
+                    needed_before = set(self.reg.resources_for(key[1]))
+                    resources = tuple(x for x in resources if x not in needed_before)
+                    depth = len(needed_before)
+                result = self._bundles[key] = self.build(resources, excluded, depth)
+        return result
+
+    def _find_excluded(self):
+        """ Resources that are never bundled: those of the excluded requirements, those
+            with ``dont_bundle`` set, and everything they depend on, since fanstatic
+            includes that anyway.
+        """
+        excluded = set(self.reg.resources_for(self.exclude))
+        for library in self.reg.libraries.values():
+            for resource in list(library.known_resources.values()):
+                if resource.dont_bundle:
+                    excluded.update(resource.resources)
+        return frozenset(excluded)
+
+    def build(self, resources, excluded = (), depth = 0):
+        """ Write bundles for resources, which must be in dependency order.
+            Returns the bundle resources and any resources that weren't bundled.
+
+            depth
+                The number of resources needed before these. Fanstatic sorts bundles
+                with a larger depth after those with a smaller one.
+        """
+        by_ext = {}
+        result = []
+        for resource in resources:
+            if resource.ext in BUNDLE_EXTENSIONS and not resource.dont_bundle and resource not in excluded:
+                by_ext.setdefault(resource.ext, []).append(resource)
+            else:
+                result.append(resource)
+        for ext in BUNDLE_EXTENSIONS:
+            if ext in by_ext:
+                result.append(self._write_bundle(ext, by_ext[ext], depth))
+        return tuple(result)
+
+    def _write_bundle(self, ext, resources, depth):
+        contents = []
+        for resource in resources:
+            with open(resource.fullpath(), 'rb') as f:
+                text = f.read().decode('utf-8', 'surrogateescape')
+            if ext == '.css':
+                text = self._rewrite_css(text, resource)
+            contents.append(text)
+        if ext == '.js':
+            #Guard against files that don't end their last statement
+            text = ';\n'.join(contents)
+        else:
+            text = '\n'.join(contents)
+        minifier = self.minifiers.get(ext)
+        if minifier is not None:
+            text = minifier(text)
+        data = text.encode('utf-8', 'surrogateescape')
+        relpath = hashlib.sha1(data).hexdigest()[:20]
+        if depth:
+            #The same content may be needed at different depths
+            relpath = "%s-%d" % (relpath, depth)
+        relpath += ext
+        path = os.path.join(self.output_dir, relpath)
+        if not os.path.exists(path):
+            write_atomic(path, data)
+        bundle = self.library.known_resources.get(relpath)
+        if bundle is None:
+            bundle = init_late_resource(_Bundle(self.library, relpath, depth, tuple(resources)))
+            self.library.sort_after(resources)
+        return bundle
+
+    def _rewrite_css(self, text, resource):
+        """ Make relative urls point to where the original file is published,
+            and drop @charset rules since they're only allowed first in a file.
+        """
+        base = "%s/%s/" % (self.url_prefix, resource.library.name)
+        dirname = os.path.dirname(resource.relpath)
+        def _replace(match):
+            quote, url = match.groups()
+            if _absolute_url.match(url):
+                return match.group(0)
+            path = os.path.normpath(os.path.join(dirname, url)).replace(os.sep, '/')
+            return "url(%s%s%s%s)" % (quote, base, path, quote)
+        return _css_url.sub(_replace, _css_charset.sub('', text))
+
+
+class _BundleLibrary(Library):
+    """ The library bundles are served from. Bundles contain resources of other libraries
+        instead of depending on them, so fanstatic can't number it from its dependencies.
+        Its library number is raised above the number of every library a bundle contains
+        resources of, or that those resources depend on, as bundles are added.
+    """
+
+    def init_library_nr(self):
+        if self.library_nr is None:
+            self.library_nr = 0
+
+    def sort_after(self, resources):
+        for resource in resources:
+            for dependency in resource.resources:
+                library = dependency.library
+                if library is self:
+                    continue
+                if library.library_nr is None:
+                    library.init_library_nr()
+                self.library_nr = max(self.library_nr or 0, library.library_nr + 1)
+
+
+class _Bundle(Resource):
+    """ A bundle resource. Bundles don't depend on each other, since the bundles needed
+        before one differ between requests. Their dependency number is the number of
+        resources that were needed before them instead, which only grows within a request,
+        so fanstatic renders them in the order they were needed.
+
+        bundled
+            The resources the bundle contains.
+    """
+
+    def __init__(self, library, relpath, depth, bundled):
+        self.depth = depth
+        self.bundled = bundled
+        super(_Bundle, self).__init__(library, relpath)
+
+    def init_dependency_nr(self):
+        self.dependency_nr = self.depth
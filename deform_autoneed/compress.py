@@ -0,0 +1,167 @@
+""" Build gzip (and brotli, if the ``brotli`` package is installed) versions of every
+    resource the registry knows about, and serve them to clients that accept them.
+
+    Compression happens once, ahead of time, in a pool of processes. Output goes to a
+    separate directory, so the installed packages can stay read-only::
+
+        from deform_autoneed import get_resource_registry
+        from deform_autoneed.compress import precompress
+
+        precompress(get_resource_registry(), '/var/cache/myapp/compressed')
+
+    ``PrecompressedPublisher`` is a WSGI application that serves registered resources
+    and picks a precompressed version based on the Accept-Encoding header.
+    It's meant to replace fanstatics publisher, for instance::
+
+        from fanstatic import Delegator, Injector, Publisher, get_library_registry
+        from deform_autoneed.compress import PrecompressedPublisher
+
+        publisher = PrecompressedPublisher(reg, '/var/cache/myapp/compressed',
+                                           fallback = Publisher(get_library_registry()))
+        app = Delegator(Injector(app), publisher)
+"""
+from concurrent.futures import ProcessPoolExecutor
+import gzip
+import mimetypes
+import os
+
+import webob
+import webob.dec
+import webob.exc
+import webob.static
+
+from deform_autoneed.utils import (forever_headers,
+                                   preferred_encodings,
+                                   split_publisher_path,
+                                   write_atomic)
+
+try:
+    import brotli
+except ImportError: #pragma : no coverage
+    brotli = None
+
+
+def available_encodings():
+    """ File extensions of the compression formats that can be built here. """
+    if brotli is None:
+        return ('.gz',)
+    return ('.br', '.gz')
+
+
+def registered_resources(reg):
+    """ Yield (library name, resource) for every resource known to the libraries of reg. """
+    for (name, library) in reg.libraries.items():
+        for resource in list(library.known_resources.values()):
+            yield (library.name, resource)
+
+
+def compressed_path(output_dir, library_name, relpath, ext):
+    return os.path.join(output_dir, library_name, *relpath.split('/')) + ext
+
+
+def precompress(reg, output_dir, processes = None, encodings = None):
+    """ Write compressed versions of every registered resource to output_dir,
+        as ``<output_dir>/<library name>/<relpath>.gz`` and ``.br``.
+        Files that are newer than their source are skipped.
+
+        processes
+            Number of worker processes. None means one per CPU, 0 compresses
+            in this process.
+
+        encodings
+            Extensions of the formats to build, by default all that are available.
+
+        Returns a list of the files that were written.
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    jobs = []
+    for (library_name, resource) in registered_resources(reg):
+        source = resource.fullpath()
+        if not os.path.isfile(source):
+            continue
+        for ext in encodings:
+            target = compressed_path(output_dir, library_name, resource.relpath, ext)
+            if not _is_up_to_date(target, source):
+                jobs.append((source, target, ext))
+    if not jobs:
+        return []
+    if processes == 0:
+        return [_compress_file(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers = processes) as executor:
+        return list(executor.map(_compress_file, *zip(*jobs)))
+
+def _compress_file(source, target, ext):
+    with open(source, 'rb') as f:
+        data = f.read()
+    if ext == '.br':
+        data = brotli.compress(data)
+    else:
+        data = gzip.compress(data, compresslevel = 9, mtime = 0)
+    target_dir = os.path.dirname(target)
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir, exist_ok = True)
+    write_atomic(target, data)
+    return target
+
+
+def _is_up_to_date(target, source):
+    try:
+        return os.stat(target).st_mtime >= os.stat(source).st_mtime
+    except OSError:
+        return False
+
+
+class PrecompressedPublisher(object):
+    """ WSGI application that serves registered resources, preferably precompressed.
+
+        URLs are split by ``deform_autoneed.utils.split_publisher_path``.
+
+        reg
+            The registry whose libraries should be served.
+
+        output_dir
+            Where ``precompress`` wrote compressed files.
+
+        fallback
+            Optional WSGI application for anything that isn't a registered resource,
+            like images and fonts. If it's None, those requests get a 404.
+    """
+
+    def __init__(self, reg, output_dir, fallback = None):
+        self.reg = reg
+        self.output_dir = output_dir
+        self.fallback = fallback
+
+    def find(self, library_name, relpath):
+        """ Return the registered resource, or None. """
+        for library in self.reg.libraries.values():
+            if library.name == library_name:
+                return library.known_resources.get(relpath)
+
+    @webob.dec.wsgify
+    def __call__(self, request):
+        library_name, relpath, versioned = split_publisher_path(request.path_info)
+        resource = None
+        if relpath is not None:
+            resource = self.find(library_name, relpath)
+        if resource is None:
+            if self.fallback is not None:
+                return request.get_response(self.fallback)
+            raise webob.exc.HTTPNotFound()
+        source = resource.fullpath()
+        content_type = mimetypes.guess_type(source)[0] or 'application/octet-stream'
+        path = source
+        content_encoding = None
+        for (ext, encoding) in preferred_encodings(request.headers.get('Accept-Encoding', '')):
+            candidate = compressed_path(self.output_dir, resource.library.name, resource.relpath, ext)
+            if _is_up_to_date(candidate, source):
+                path = candidate
+                content_encoding = encoding
+                break
+        app = webob.static.FileApp(path, content_type = content_type, content_encoding = content_encoding)
+        response = request.get_response(app)
+        response.vary = ('Accept-Encoding',)
+        if versioned and response.status.startswith('20'):
+            response.headerlist.extend(forever_headers())
+        return response
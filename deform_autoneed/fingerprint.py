@@ -0,0 +1,132 @@
+""" Content hashes for registered resources, so they can be served with URLs that
+    change whenever the file does.
+
+    Fingerprinted resources render with a ``:version:<hash>`` step in their URL,
+    which fanstatics publisher skips and answers with headers that let browsers
+    cache the resource forever. A new deform version or a replaced resource gets
+    a new URL, so repeat visitors never need to revalidate.
+
+    Usage::
+
+        from deform_autoneed import get_resource_registry
+        from deform_autoneed.fingerprint import enable_fingerprints
+
+        enable_fingerprints(get_resource_registry(), cache_path = '/var/cache/myapp/fingerprints.json')
+
+    Hashes are cached in cache_path by path, size and modification time, so a restart
+    doesn't need to read the files again. The registry writes new hashes to it after
+    ``create_requirement_for``, after creating lazily added requirements and after a
+    transaction is committed.
+"""
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from fanstatic import VERSION_PREFIX
+
+from deform_autoneed.utils import write_atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+class Fingerprints(object):
+    """ Keeps track of content hashes of resource files.
+
+        cache_path
+            Optional JSON file to keep hashes in between restarts.
+
+        length
+            Number of characters of the hex digest to use.
+    """
+
+    def __init__(self, cache_path = None, length = 16):
+        self.cache_path = cache_path
+        self.length = length
+        self._hashes = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if cache_path:
+            self.load()
+
+    def load(self):
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for (path, (mtime, size, digest)) in data.items():
+            self._hashes[path] = (mtime, size, digest)
+
+    def save(self):
+        """ Write cached hashes to cache_path, if anything changed. """
+        if not self.cache_path or not self._dirty:
+            return
+        with self._lock:
+            data = dict((path, list(value)) for (path, value) in self._hashes.items())
+            self._dirty = False
+        write_atomic(self.cache_path, json.dumps(data, sort_keys = True))
+
+    def digest(self, path):
+        """ Content hash of the file at path. """
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached is not None and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(functools.partial(f.read, 65536), b''):
+                hasher.update(chunk)
+        digest = hasher.hexdigest()[:self.length]
+        with self._lock:
+            self._hashes[path] = (stat.st_mtime, stat.st_size, digest)
+            self._dirty = True
+        return digest
+
+    def fingerprint(self, resource):
+        """ Content hash of a ``fanstatic.Resource``, or None if its file doesn't exist. """
+        try:
+            return self.digest(resource.fullpath())
+        except OSError:
+            return None
+
+    def apply(self, resource):
+        """ Make resource render with its fingerprint in the URL. """
+        digest = self.fingerprint(resource)
+        if digest is None:
+            logger.debug("Can't fingerprint %s, file is missing", resource)
+            return
+        resource.render = functools.partial(_render_fingerprinted, resource, digest)
+        resource.fingerprint = digest
+
+    def url(self, resource, library_url):
+        """ Fingerprinted URL of resource, where library_url is what fanstatic
+            would use for the library, like ``NeededResources.library_url``.
+        """
+        return _fingerprinted_url(resource, self.fingerprint(resource), library_url)
+
+
+def _fingerprinted_url(resource, digest, library_url):
+    #Fanstatic only skips one version step, so a library signature is replaced
+    base, sep, last = library_url.rpartition('/')
+    if sep and last.startswith(VERSION_PREFIX):
+        library_url = base
+    return "%s/%s%s/%s" % (library_url, VERSION_PREFIX, digest, resource.relpath)
+
+def _render_fingerprinted(resource, digest, library_url):
+    return resource.renderer(_fingerprinted_url(resource, digest, library_url))
+
+
+def enable_fingerprints(reg, cache_path = None):
+    """ Fingerprint every resource in reg, and any resource registered later.
+        Returns the ``Fingerprints`` object, which is also set as ``reg.fingerprints``.
+    """
+    fingerprints = reg.fingerprints = Fingerprints(cache_path = cache_path)
+    for resources in reg.requirements.values():
+        for resource in resources:
+            fingerprints.apply(resource)
+    fingerprints.save()
+    return fingerprints
@@ -0,0 +1,206 @@
+""" An explicit dependency graph of the resources in a ``ResourceRegistry``.
+
+    Fanstatic keeps dependencies on each ``Resource``. The graph mirrors them and adds
+    what the registry needs to resolve requirements quickly: dependents of each
+    resource, a topological order of every resource and transitive closures.
+    The order and closures are computed once. Changes only drop the closures of the
+    nodes they affect, and the order is computed again when it's needed next.
+"""
+
+
+class DependencyCycleError(ValueError):
+    """ Raised when a dependency would make a resource depend on itself.
+
+        cycle
+            The resources that form the cycle, starting and ending with the same resource.
+    """
+
+    def __init__(self, cycle):
+        self.cycle = tuple(cycle)
+        ValueError.__init__(self, "Dependency cycle: %s" % " -> ".join(str(x) for x in self.cycle))
+
+
+class DependencyGraph(object):
+    """ Dependencies between nodes, usually ``fanstatic.Resource`` objects.
+
+        depends
+            A dict with each node as key and the set of nodes it depends on directly as value.
+
+        dependents
+            The reverse, a dict with each node as key and the set of nodes that depend on it.
+
+        sort_key
+            Optional key function that orders the dependencies of a node,
+            so the topological order doesn't depend on set ordering.
+    """
+
+    def __init__(self, sort_key = None):
+        self.depends = {}
+        self.dependents = {}
+        self.sort_key = sort_key
+        self._order = None
+        self._closures = {}
+
+    def __contains__(self, node):
+        return node in self.depends
+
+    def __len__(self):
+        return len(self.depends)
+
+    def _changed(self, node = None):
+        """ Drop the order, and the closures of node and everything that depends on it.
+            Closures are replaced rather than changed, so they can be shared.
+        """
+        self._order = None
+        if node is None or not self._closures:
+            return
+        self._closures.pop(node, None)
+        for dependent in self.all_dependents(node):
+            self._closures.pop(dependent, None)
+
+    def add(self, node, depends = ()):
+        """ Add node with dependencies. Dependencies that aren't in the graph are added too. """
+        if node not in self.depends:
+            self.depends[node] = set()
+            self.dependents[node] = set()
+            #Nothing depends on a new node, so no closure changes
+            self._order = None
+        for dependency in depends:
+            self.add_dependency(node, dependency)
+
+    def add_dependency(self, node, dependency):
+        """ Make node depend on dependency. Raises ``DependencyCycleError`` if dependency
+            already depends on node, directly or indirectly.
+        """
+        self.add(node)
+        self.add(dependency)
+        if dependency in self.depends[node]:
+            return
+        #Only possible if something depends on node, like when a resource is replaced
+        if node == dependency or (self.dependents[node] and self._depends_on(dependency, node)):
+            raise DependencyCycleError((node,) + self.path(dependency, node))
+        self._changed(node)
+        self.depends[node].add(dependency)
+        self.dependents[dependency].add(node)
+
+    def _depends_on(self, node, other):
+        """ True if node depends on other, directly or indirectly. """
+        closure = self._closures.get(node)
+        if closure is not None:
+            return other in closure
+        stack = [node]
+        seen = set(stack)
+        while stack:
+            for dependency in self.depends[stack.pop()]:
+                if dependency == other:
+                    return True
+                if dependency not in seen:
+                    seen.add(dependency)
+                    stack.append(dependency)
+        return False
+
+    def remove_dependency(self, node, dependency):
+        self._changed(node)
+        self.depends[node].discard(dependency)
+        self.dependents[dependency].discard(node)
+
+    def remove(self, node):
+        """ Remove node and every dependency to and from it. """
+        self._changed(node)
+        for dependency in self.depends.pop(node):
+            self.dependents[dependency].discard(node)
+        for dependent in self.dependents.pop(node):
+            self.depends[dependent].discard(node)
+
+    def clear(self):
+        self.depends = {}
+        self.dependents = {}
+        self._order = None
+        self._closures = {}
+
+    def _sorted(self, nodes):
+        if self.sort_key is None:
+            return list(nodes)
+        return sorted(nodes, key = self.sort_key)
+
+    def path(self, start, goal):
+        """ A path of dependencies from start to goal, or None. """
+        stack = [(start, (start,))]
+        seen = set()
+        while stack:
+            node, path = stack.pop()
+            if node == goal:
+                return path
+            if node in seen:
+                continue
+            seen.add(node)
+            for dependency in self.depends[node]:
+                stack.append((dependency, path + (dependency,)))
+
+    def order(self):
+        """ A dict with every node as key and its position in a topological order as value.
+            Nodes come after everything they depend on, otherwise they're in the order
+            they were added.
+        """
+        if self._order is not None:
+            return self._order
+        order = {}
+        for root in self.depends:
+            if root in order:
+                continue
+            #Iterative depth first search, so deep graphs don't hit the recursion limit
+            stack = [(root, iter(self._sorted(self.depends[root])))]
+            visiting = set([root])
+            while stack:
+                node, dependencies = stack[-1]
+                for dependency in dependencies:
+                    if dependency in order:
+                        continue
+                    if dependency in visiting:
+                        #Only possible if depends was changed directly
+                        nodes = [x[0] for x in stack]
+                        raise DependencyCycleError(nodes[nodes.index(dependency):] + [dependency])
+                    visiting.add(dependency)
+                    stack.append((dependency, iter(self._sorted(self.depends[dependency]))))
+                    break
+                else:
+                    stack.pop()
+                    visiting.discard(node)
+                    order[node] = len(order)
+        self._order = order
+        return order
+
+    def closure(self, node):
+        """ Frozenset of node and everything it depends on, directly or indirectly. """
+        try:
+            return self._closures[node]
+        except KeyError:
+            pass
+        result = set([node])
+        pending = [node]
+        while pending:
+            for dependency in self.depends[pending.pop()]:
+                if dependency not in result:
+                    result.add(dependency)
+                    pending.append(dependency)
+        result = self._closures[node] = frozenset(result)
+        return result
+
+    def all_dependents(self, node):
+        """ Set of everything that depends on node, directly or indirectly. """
+        result = set()
+        pending = [node]
+        while pending:
+            for dependent in self.dependents[pending.pop()]:
+                if dependent not in result:
+                    result.add(dependent)
+                    pending.append(dependent)
+        return result
+
+    def resolve(self, nodes):
+        """ Tuple of nodes and everything they depend on, in topological order. """
+        result = set()
+        for node in nodes:
+            result.update(self.closure(node))
+        order = self.order()
+        return tuple(sorted(result, key = order.__getitem__))
@@ -0,0 +1,146 @@
+""" Inline small CSS and Javascript resources in the page instead of linking to them,
+    so tiny files like deforms ``form.css`` don't cost a request of their own.
+
+    Usage::
+
+        from deform_autoneed import get_resource_registry
+        from deform_autoneed.inline import enable_inlining
+
+        enable_inlining(get_resource_registry(), threshold = 2048)
+
+    Resources up to threshold bytes are read once, when they're added to the registry,
+    and kept in memory by path and modification time. Rendering them never touches
+    the disk. Larger resources, and stylesheets that refer to other files through
+    ``url()`` or ``@import``, are linked as usual. Call ``InlineAssets.refresh``
+    to pick up files that changed on disk.
+
+    Enable fingerprints first, if you use them. Linked resources keep their fingerprinted URLs.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+#Formats of inlined resources, by file extension
+INLINE_FORMATS = {'.css': '<style>%s</style>',
+                  '.js': '<script>%s</script>'}
+
+_closing_tags = {'.css': re.compile(r'</(style)', re.IGNORECASE),
+                 '.js': re.compile(r'</(script)', re.IGNORECASE)}
+_css_references = re.compile(r'url\(|@import', re.IGNORECASE)
+
+
+class InlineAssets(object):
+    """ Keeps the contents of small resource files in memory and renders them inline.
+
+        threshold
+            Size in bytes of the largest file that is inlined.
+    """
+
+    def __init__(self, threshold = 2048):
+        self.threshold = threshold
+        self._contents = {}
+        self._resources = {}
+        self._lock = threading.Lock()
+
+    def read(self, path, ext):
+        """ Inline markup of the file at path, or None if it shouldn't be inlined.
+            Cached by path and modification time.
+        """
+        stat = os.stat(path)
+        cached = self._contents.get(path)
+        if cached is not None and cached[0] == stat.st_mtime:
+            return cached[1]
+        markup = None
+        if stat.st_size <= self.threshold:
+            with open(path, 'rb') as f:
+                data = f.read(self.threshold + 1)
+            try:
+                text = data.decode('utf-8')
+            except UnicodeDecodeError:
+                text = None
+            if text is None or len(data) > self.threshold:
+                pass
+            elif ext == '.css' and _css_references.search(text):
+                logger.debug("Not inlining %s, it refers to other files", path)
+            else:
+                #A closing tag within the content would end the element early
+                text = _closing_tags[ext].sub(r'<\\/\1', text)
+                markup = INLINE_FORMATS[ext] % text
+        self._contents[path] = (stat.st_mtime, markup)
+        return markup
+
+    def apply(self, resource):
+        """ Make resource render inline if it's small enough. """
+        if resource.ext not in INLINE_FORMATS:
+            return
+        path = resource.fullpath()
+        try:
+            markup = self.read(path, resource.ext)
+        except OSError:
+            logger.debug("Can't inline %s, file is missing", resource)
+            return
+        #Fingerprinted resources have their own render method, which is kept for larger files
+        fallback = resource.__dict__.get('render')
+        if fallback is not None and isinstance(fallback, functools.partial) and fallback.func is _render_inline:
+            fallback = fallback.args[2]
+        resource.render = functools.partial(_render_inline, self, resource, fallback)
+        resource.inlined = markup is not None
+        with self._lock:
+            self._resources[path] = resource
+
+    def markup(self, resource):
+        """ The cached inline markup of resource, or None if it's linked. """
+        cached = self._contents.get(resource.fullpath())
+        if cached is None:
+            return None
+        return cached[1]
+
+    def refresh(self):
+        """ Read files that changed on disk since they were cached. """
+        with self._lock:
+            resources = tuple(self._resources.values())
+        for resource in resources:
+            self.apply(resource)
+
+
+def _render_inline(inline_assets, resource, fallback, library_url):
+    markup = inline_assets.markup(resource)
+    if markup is not None:
+        return markup
+    if fallback is not None:
+        return fallback(library_url)
+    return resource.renderer("%s/%s" % (library_url, resource.relpath))
+
+
+def enable_inlining(reg, threshold = 2048):
+    """ Inline every small resource in reg, and any resource registered later.
+        Returns the ``InlineAssets`` object, which is also set as ``reg.inline_assets``.
+    """
+    inline_assets = reg.inline_assets = InlineAssets(threshold = threshold)
+    for resources in reg.requirements.values():
+        for resource in resources:
+            inline_assets.apply(resource)
+    return inline_assets
+
+def disable_inlining(reg):
+    """ Link every resource in reg again. """
+    inline_assets = reg.inline_assets
+    reg.inline_assets = None
+    if inline_assets is None:
+        return
+    with inline_assets._lock:
+        resources = tuple(inline_assets._resources.values())
+        inline_assets._resources = {}
+    for resource in resources:
+        fallback = resource.render.args[2]
+        if fallback is None:
+            del resource.render
+        else:
+            resource.render = fallback
+        resource.inlined = False
@@ -0,0 +1,111 @@
+""" Timings and counters for ``auto_need``, ``need_lib`` and the patched render methods.
+
+    Instrumentation is off by default and costs a single attribute lookup per call
+    while it's off. Enable it on a registry::
+
+        from deform_autoneed import get_resource_registry
+        from deform_autoneed.instrumentation import enable_instrumentation
+
+        instrumentation = enable_instrumentation(get_resource_registry())
+
+    Stats are aggregated in-process and returned by ``ResourceRegistry.stats()``.
+    To send every call to a metrics exporter, add a hook. It's called with a
+    ``CallStats`` tuple after each instrumented call::
+
+        def export(call):
+            histogram.labels(call.name).observe(call.duration)
+
+        instrumentation.add_hook(export)
+"""
+from collections import (Counter,
+                         namedtuple)
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+CallStats = namedtuple('CallStats', ['name', 'duration', 'resources', 'hit', 'missed'])
+CallStats.__doc__ = """ One instrumented call.
+
+    name
+        What was called: 'auto_need', 'need_lib', 'form_render' or 'validationfailure_render'.
+
+    duration
+        Wall time in seconds.
+
+    resources
+        Number of resources that were needed.
+
+    hit and missed
+        Requirement names that were found in the registry, and names that weren't
+        and therefore were ignored.
+"""
+
+
+class Instrumentation(object):
+    """ Aggregates ``CallStats`` and passes them on to hooks. Thread safe. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hooks = []
+        self.reset()
+
+    def add_hook(self, hook):
+        """ Call hook with a ``CallStats`` after every instrumented call. """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def record(self, name, duration, resources = 0, hit = (), missed = ()):
+        call = CallStats(name, duration, resources, tuple(hit), tuple(missed))
+        with self._lock:
+            calls = self._calls.get(name)
+            if calls is None:
+                calls = self._calls[name] = {'calls': 0, 'total_time': 0.0, 'max_time': 0.0, 'resources': 0}
+            calls['calls'] += 1
+            calls['total_time'] += duration
+            if duration > calls['max_time']:
+                calls['max_time'] = duration
+            calls['resources'] += resources
+            self._hit.update(call.hit)
+            self._missed.update(call.missed)
+        for hook in self.hooks:
+            try:
+                hook(call)
+            except Exception:
+                logger.exception("Instrumentation hook %r failed", hook)
+        return call
+
+    def stats(self):
+        """ Return a dict with totals per call name and counts of requirement names
+            hit and missed.
+        """
+        with self._lock:
+            calls = {}
+            for (name, value) in self._calls.items():
+                calls[name] = dict(value)
+                calls[name]['mean_time'] = value['total_time'] / value['calls']
+            return {'calls': calls,
+                    'requirements_hit': dict(self._hit),
+                    'requirements_missed': dict(self._missed)}
+
+    def reset(self):
+        with self._lock:
+            self._calls = {}
+            self._hit = Counter()
+            self._missed = Counter()
+
+
+def enable_instrumentation(reg):
+    """ Start collecting stats for reg. Returns the ``Instrumentation`` object,
+        which is also set as ``reg.instrumentation``.
+    """
+    if reg.instrumentation is None:
+        reg.instrumentation = Instrumentation()
+    return reg.instrumentation
+
+def disable_instrumentation(reg):
+    reg.instrumentation = None
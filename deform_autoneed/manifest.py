@@ -0,0 +1,160 @@
+""" Resolve the resources of known forms during startup, and export them as a manifest.
+
+    Usage::
+
+        from deform_autoneed.manifest import warm_up
+
+        manifest = warm_up({'login': LoginSchema(), 'profile': profile_form})
+        manifest.save('/var/www/static/deform_manifest.json')
+
+    Forms can be deform forms or colander schemas. Requirement names that aren't in the
+    registry are logged as warnings, or raise a KeyError with ``strict = True``.
+
+    The manifest can be used as the ``requirements_cache`` of ``auto_need``. Warmed up
+    forms, and forms built from a warmed up schema instance, then skip walking their widgets::
+
+        auto_need(form, requirements_cache = manifest)
+
+    Forms and schemas are held weakly, so keep the instances you render with. Forms built
+    from a warmed up schema are expected to use the widgets of the schema.
+
+    The JSON file maps each form id to the package paths of its resources, in the
+    order they should be included.
+"""
+import json
+import logging
+import threading
+import weakref
+
+from deform_autoneed.utils import write_atomic
+
+
+logger = logging.getLogger(__name__)
+
+
+class AssetManifest(object):
+    """ The widget requirements and resources of warmed up forms.
+
+        reg
+            The ``ResourceRegistry`` to resolve requirements with. By default the global registry.
+
+        strict
+            Raise a KeyError for forms that have requirements the registry doesn't know.
+
+        unknown
+            A dict with form ids as keys and sorted lists of unknown requirement names as values.
+    """
+
+    def __init__(self, reg = None, strict = False):
+        if reg is None:
+            from deform_autoneed import get_resource_registry
+            reg = get_resource_registry()
+        self.reg = reg
+        self.strict = strict
+        self.unknown = {}
+        self._forms = {}
+        self._by_form = weakref.WeakKeyDictionary()
+        self._resolved = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+    def add(self, form, form_id = None):
+        """ Add a deform form or a colander schema. form_id defaults to the formid
+            of a form, or the name or class name of a schema.
+        """
+        import deform
+        key = form
+        if not isinstance(form, deform.Field):
+            if form_id is None:
+                form_id = form.name or form.__class__.__name__
+            form = deform.Form(form)
+        if form_id is None:
+            form_id = form.formid
+        widget_requirements = tuple(form.get_widget_requirements())
+        requirement_names = frozenset(['basic']).union(x[0] for x in widget_requirements)
+        reg = self.reg.load(requirement_names)
+        unknown = sorted(x for x in requirement_names if x not in reg.requirements)
+        if unknown:
+            if self.strict:
+                raise KeyError("Form '%s' has requirements the registry doesn't know: %s" % (form_id, ", ".join(unknown)))
+            logger.warning("Form '%s' has requirements the registry doesn't know: %s", form_id, ", ".join(unknown))
+            self.unknown[form_id] = unknown
+        else:
+            self.unknown.pop(form_id, None)
+        self._forms[form_id] = requirement_names
+        self._by_form[key] = widget_requirements
+        self.resources(form_id)
+
+    def warm_up(self, forms):
+        """ Add every form in forms, which is either a dict with form ids as keys
+            or an iterable of forms and schemas.
+        """
+        if isinstance(forms, dict):
+            for (form_id, form) in forms.items():
+                self.add(form, form_id)
+        else:
+            for form in forms:
+                self.add(form)
+        return self
+
+    def __contains__(self, form_id):
+        return form_id in self._forms
+
+    def requirement_names(self, form_id):
+        return self._forms[form_id]
+
+    def resources(self, form_id):
+        """ The resources to need for form_id, resolved once per registry generation. """
+        generation = self.reg.generation
+        if self._generation != generation:
+            with self._lock:
+                if self._generation != generation:
+                    self._resolved = {}
+                    self._generation = generation
+        try:
+            return self._resolved[form_id]
+        except KeyError:
+            pass
+        from deform_autoneed import _resolve_requirements
+        resources = self._resolved[form_id] = _resolve_requirements(self.reg, self._forms[form_id])
+        return resources
+
+    def need(self, form_id):
+        """ Need the resources of form_id without a form. """
+        from deform_autoneed import _need_all
+        _need_all(self.resources(form_id), self._forms[form_id])
+
+    def get(self, form):
+        """ The widget requirements of form, like ``WidgetRequirementsCache.get``.
+            Forms that weren't warmed up, or built from a warmed up schema, are walked as usual.
+        """
+        widget_requirements = self._by_form.get(form)
+        if widget_requirements is None:
+            widget_requirements = self._by_form.get(form.schema)
+        if widget_requirements is None:
+            return form.get_widget_requirements()
+        return widget_requirements
+
+    def _package_path(self, resource):
+        try:
+            return self.reg.resource_package_path(resource)
+        except KeyError:
+            return "%s:%s" % (resource.library.name, resource.relpath)
+
+    def manifest(self):
+        """ A dict with form ids as keys and lists of package paths as values,
+            in the order they should be included. Bundles aren't used here.
+        """
+        result = {}
+        for (form_id, requirement_names) in self._forms.items():
+            result[form_id] = [self._package_path(x) for x in self.reg.resources_for(requirement_names)]
+        return result
+
+    def save(self, path):
+        """ Write the manifest to path as JSON. The file is replaced atomically. """
+        write_atomic(path, json.dumps(self.manifest(), indent = 2, sort_keys = True))
+
+
+def warm_up(forms, reg = None, strict = False):
+    """ Return an ``AssetManifest`` with forms added. See ``AssetManifest.warm_up``. """
+    return AssetManifest(reg = reg, strict = strict).warm_up(forms)
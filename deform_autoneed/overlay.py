@@ -0,0 +1,262 @@
+""" Registries that change a few resources of a shared registry, for instance one per
+    tenant with its own theme, without copying the shared registry.
+
+    Usage::
+
+        from deform_autoneed import get_resource_registry
+        from deform_autoneed.overlay import RegistryOverlay
+
+        tenant_reg = RegistryOverlay(get_resource_registry())
+        tenant_reg.replace_resource('deform:static/css/form.css', 'tenant_theme:static/form.css')
+
+        auto_need(form, reg = tenant_reg)
+
+    An overlay only stores its own changes. Resources that depend on a replaced or removed
+    resource are needed as copies with the new dependencies, since fanstatic would otherwise
+    include the original dependencies as well. The copies aren't registered in any library,
+    and sort after their new dependencies, like the originals sort after the old ones.
+    Their ``overlay_state`` tells whether the overlay still resolves to them.
+    The shared requirements and resources are never changed. Package paths that aren't
+    registered yet are added to their library though, so fanstatic can publish them.
+    Everything else is shared with the base registry.
+"""
+from collections import ChainMap
+import copy
+import threading
+
+from fanstatic import Resource
+
+from deform_autoneed.utils import init_late_resource
+
+
+class RegistryOverlay(object):
+    """ Changes on top of a base ``ResourceRegistry``. It can be passed as reg to
+        ``auto_need``, ``need_lib`` and ``need_resources``.
+
+        Changes to the base registry are picked up, and resolved resources are cached
+        per overlay until either of them changes. Bundles of the base registry aren't
+        used, since they contain the resources that the overlay replaces.
+    """
+    bundler = None
+
+    def __init__(self, base):
+        self.base = base
+        self.replacements = {}
+        self.removed = set()
+        self.added = {}
+        self._lock = threading.Lock()
+        self._changes = 0
+        self._state = None
+
+    @property
+    def instrumentation(self):
+        return self.base.instrumentation
+
+    def _resolve(self, resource, create = False):
+        if isinstance(resource, str):
+            path = resource
+            resource = self.base.find_resource(path)
+            if resource is None and create:
+                resource = init_late_resource(self.base.create_resource(path))
+            if resource is None:
+                raise KeyError("No resource found for '%s'" % path)
+        assert isinstance(resource, Resource)
+        return resource
+
+    def _changed(self):
+        self._changes += 1
+
+    def replace_resource(self, old, new):
+        """ Use new instead of old, within requirements and as a dependency.
+            Both can be resources or package paths. A path to new that isn't registered
+            is added to its library, but not to the base registry.
+        """
+        old = self._resolve(old)
+        new = self._resolve(new, create = True)
+        with self._lock:
+            self.replacements[old] = new
+            self.removed.discard(old)
+            self._changed()
+
+    def remove_resource(self, resource):
+        """ Leave out resource, within requirements and as a dependency. """
+        resource = self._resolve(resource)
+        with self._lock:
+            self.removed.add(resource)
+            self.replacements.pop(resource, None)
+            self._changed()
+
+    def set_requirement(self, requirement_name, resources):
+        """ Use resources for requirement_name instead of what the base registry has.
+            Resources can be fanstatic resources or package paths.
+        """
+        resources = tuple(self._resolve(x, create = True) for x in resources)
+        with self._lock:
+            self.added[requirement_name] = resources
+            self._changed()
+
+    def load(self, requirement_names = None):
+        """ Create lazily added requirements of the base registry. Returns the overlay. """
+        self.base.load(requirement_names)
+        return self
+
+    def _current(self):
+        """ The resolved state for the current generation of the base and the overlay. """
+        state = self._state
+        key = (self.base.generation, self._changes)
+        if state is not None and state.key == key:
+            return state
+        with self._lock:
+            state = self._state
+            if state is None or state.key != key:
+                state = self._state = _OverlayState(self, key)
+        return state
+
+    @property
+    def requirements(self):
+        return self._current().requirements
+
+    def resources_for(self, requirement_names):
+        """ Same as ``ResourceRegistry.resources_for``, with the changes of this overlay.
+            Resources affected by a change are returned as copies.
+        """
+        self.base.load(requirement_names)
+        return self._current().resources_for(requirement_names)
+
+
+class _OverlayState(object):
+    """ Everything an overlay derives from its base at one generation. Never changed
+        after it's created, apart from its caches.
+    """
+    __slots__ = ('key', 'requirements', '_overlay', '_replacements', '_removed', '_affected',
+                 '_copies', '_libraries', '_order', '_resolved')
+
+    def __init__(self, overlay, key):
+        self.key = key
+        self._overlay = overlay
+        self._replacements = dict(overlay.replacements)
+        self._removed = frozenset(overlay.removed)
+        changed = set(self._replacements) | self._removed
+        affected = set()
+        with overlay.base._lock:
+            base = overlay.base.freeze()
+            graph = overlay.base.graph
+            for resource in changed:
+                if resource in graph:
+                    affected.update(graph.all_dependents(resource))
+        self._affected = frozenset(affected)
+        self._copies = {}
+        self._libraries = {}
+        self._order = base._order
+        self._resolved = {}
+        overrides = {}
+        for (name, resources) in base.requirements.items():
+            if changed.intersection(resources):
+                overrides[name] = tuple(x for x in map(self._map, resources) if x is not None)
+        overrides.update(overlay.added)
+        self.requirements = ChainMap(overrides, base.requirements)
+
+    def is_current(self):
+        """ False if the overlay or its base registry changed since this state was created. """
+        overlay = self._overlay
+        return self.key == (overlay.base.generation, overlay._changes)
+
+    def _map(self, resource):
+        """ What resource is replaced with, or None if it's removed. """
+        seen = set()
+        while resource in self._replacements and resource not in seen:
+            seen.add(resource)
+            resource = self._replacements[resource]
+        if resource in self._removed:
+            return None
+        return resource
+
+    def _needable(self, resource):
+        """ resource, or a copy of it with the changed dependencies if it's affected. """
+        if resource not in self._affected:
+            return resource
+        result = self._copies.get(resource)
+        if result is not None:
+            return result
+        result = copy.copy(resource)
+        depends = set()
+        for dependency in resource.depends:
+            dependency = self._map(dependency)
+            if dependency is not None:
+                depends.add(self._needable(dependency))
+        result.depends = depends
+        result.overlay_state = self
+        result.supports = set()
+        result.resources = set([result])
+        for dependency in depends:
+            result.resources.update(dependency.resources)
+        self._set_sort_numbers(result)
+        self._copies[resource] = result
+        return result
+
+    def _set_sort_numbers(self, result):
+        """ Number a copy the way fanstatic numbers resources, so it's sorted after its
+            dependencies. If one of them is in a library that sorts after the library
+            of the copy, the copy gets a library of its own with a larger number.
+            It's a copy of the original library, so it renders the same URLs.
+        """
+        library = result.library
+        for dependency in result.depends:
+            _init_sort_numbers(dependency)
+        _init_sort_numbers(result)
+        library_nr = library.library_nr
+        for dependency in result.depends:
+            if dependency.library.name == library.name:
+                library_nr = max(library_nr, dependency.library.library_nr)
+            else:
+                library_nr = max(library_nr, dependency.library.library_nr + 1)
+        dependency_nr = result.dependency_nr
+        for dependency in result.depends:
+            if dependency.library.name == library.name and dependency.library.library_nr == library_nr:
+                dependency_nr = max(dependency_nr, dependency.dependency_nr + 1)
+        result.dependency_nr = dependency_nr
+        if library_nr != library.library_nr:
+            key = (library, library_nr)
+            result.library = self._libraries.get(key)
+            if result.library is None:
+                result.library = self._libraries[key] = copy.copy(library)
+                result.library.library_nr = library_nr
+
+    def _sort_key(self, resource):
+        position = self._order.get(resource)
+        if position is None:
+            return (1, 0, resource.library.name, resource.relpath)
+        return (0, position, '', '')
+
+    def resources_for(self, requirement_names):
+        key = frozenset(requirement_names)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        result = []
+        seen = set()
+        roots = []
+        for name in key:
+            roots.extend(self.requirements.get(name, ()))
+        #Depth first, so dependencies come first. The depth is that of the dependency graph.
+        def _visit(resource):
+            resource = self._map(resource)
+            if resource is None or resource in seen:
+                return
+            seen.add(resource)
+            for dependency in sorted(resource.depends, key = self._sort_key):
+                _visit(dependency)
+            result.append(self._needable(resource))
+        for resource in sorted(roots, key = self._sort_key):
+            _visit(resource)
+        resources = self._resolved[key] = tuple(result)
+        return resources
+
+
+def _init_sort_numbers(resource):
+    """ Number resource and its dependencies, if fanstatic hasn't done so yet. """
+    if getattr(resource, 'dependency_nr', None) is None:
+        for dependency in resource.depends:
+            _init_sort_numbers(dependency)
+    init_late_resource(resource)
@@ -0,0 +1,120 @@
+""" Tell browsers about the resources deform needs before they've parsed the page,
+    through ``Link: <url>; rel=preload`` response headers and, where the server
+    supports it, a 103 Early Hints response.
+
+    ``PreloadMiddleware`` must run inside fanstatics injector, since it reads what was
+    needed during the request::
+
+        from fanstatic import Fanstatic
+        from deform_autoneed.preload import PreloadMiddleware
+
+        app = Fanstatic(PreloadMiddleware(app, early_hints = True))
+
+    The resources each route needed are remembered, so the next request to the same
+    route can get its early hints before the form is rendered. No hints are sent for
+    a route if any of its resources were removed or replaced since, in the registry or in
+    the ``RegistryOverlay`` they came from.
+    Early hints are sent through a ``wsgi.early_hints`` callable in the WSGI environment,
+    for servers that provide one.
+"""
+import threading
+
+from fanstatic.inclusion import sort_resources
+
+from deform_autoneed import current_needed
+from deform_autoneed.fingerprint import _fingerprinted_url
+
+
+#Values for the as attribute of preload links, by file extension
+PRELOAD_TYPES = {'.css': 'style',
+                 '.js': 'script'}
+
+
+def resource_url(resource, library_url):
+    """ The URL fanstatic renders for resource, where library_url is the URL
+        of its library, like ``NeededResources.library_url`` returns it.
+    """
+    digest = getattr(resource, 'fingerprint', None)
+    if digest:
+        return _fingerprinted_url(resource, digest, library_url)
+    return "%s/%s" % (library_url, resource.relpath)
+
+def preload_links(resources, needed = None):
+    """ A list of Link header values that preload resources. Resources that
+        can't be preloaded, like images, and resources rendered inline are skipped.
+    """
+    if needed is None:
+        needed = current_needed()
+    links = []
+    for resource in resources:
+        preload_type = PRELOAD_TYPES.get(resource.ext)
+        if preload_type is None or getattr(resource, 'inlined', False):
+            continue
+        url = resource_url(resource, needed.library_url(resource.library))
+        links.append("<%s>; rel=preload; as=%s" % (url, preload_type))
+    return links
+
+
+class PreloadMiddleware(object):
+    """ WSGI middleware that adds preload Link headers for the resources that were
+        needed during the request, the same ones fanstatic renders into the page.
+
+        app
+            The WSGI application to wrap.
+
+        early_hints
+            Send a 103 Early Hints response with the links of the route,
+            if it's known from an earlier request.
+
+        route_key
+            A callable that returns the key of the route from a WSGI environment.
+            By default the path. Return None for requests that shouldn't be remembered.
+
+        max_routes
+            Number of routes to remember at most.
+    """
+
+    def __init__(self, app, early_hints = False, route_key = None, max_routes = 1000):
+        self.app = app
+        self.early_hints = early_hints
+        self.route_key = route_key or _path_route_key
+        self.max_routes = max_routes
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def remember(self, key, resources):
+        if key is None or self.routes.get(key) == resources:
+            return
+        with self._lock:
+            if key in self.routes or len(self.routes) < self.max_routes:
+                self.routes[key] = resources
+
+    def __call__(self, environ, start_response):
+        key = self.route_key(environ)
+        if self.early_hints:
+            send_hints = environ.get('wsgi.early_hints')
+            known = self.routes.get(key)
+            if send_hints is not None and known and all(_is_registered(x) for x in known):
+                send_hints([('Link', x) for x in preload_links(known)])
+        def _start_response(status, headers, exc_info = None):
+            needed = current_needed()
+            if needed.has_resources():
+                resources = tuple(sort_resources(needed.resources()))
+                headers = list(headers)
+                headers.extend(('Link', x) for x in preload_links(resources, needed))
+                if status.startswith('200'):
+                    self.remember(key, resources)
+            return start_response(status, headers, exc_info)
+        return self.app(environ, _start_response)
+
+
+def _is_registered(resource):
+    """ False for resources that were removed or replaced since they were remembered. """
+    state = getattr(resource, 'overlay_state', None)
+    if state is not None:
+        #Copies from an overlay aren't registered, but belong to the state it had
+        return state.is_current()
+    return resource.library.known_resources.get(resource.relpath) is resource
+
+def _path_route_key(environ):
+    return environ.get('PATH_INFO', '')
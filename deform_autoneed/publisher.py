@@ -0,0 +1,248 @@
+""" A WSGI publisher for registered resources that serves them from memory.
+
+    Fanstatics publisher looks at the file system for every request. ``MemoryPublisher``
+    only serves the resources known to the libraries of a registry, and prepares
+    everything it needs to answer once: size, modification time, ETag, Last-Modified
+    and content type. Contents of small files are kept in memory, up to a total size,
+    and the least recently used ones are dropped when that's exceeded. Larger files
+    are sent through ``wsgi.file_wrapper``, so servers can use sendfile::
+
+        from fanstatic import Delegator, Injector
+        from deform_autoneed.publisher import MemoryPublisher
+
+        publisher = MemoryPublisher(reg, max_memory = 32 * 1024 * 1024)
+        app = Delegator(Injector(app), publisher)
+
+    Conditional requests are answered from the prepared ETag and Last-Modified values.
+    With output_dir, files written by ``deform_autoneed.compress.precompress`` are served
+    to clients that accept them. Files that change on disk are picked up by ``refresh``,
+    and resources added to the registry the next time it's used.
+"""
+from collections import OrderedDict
+from email.utils import (formatdate,
+                         parsedate_tz,
+                         mktime_tz)
+import mimetypes
+import os
+import threading
+
+from deform_autoneed.compress import (compressed_path,
+                                      registered_resources)
+from deform_autoneed.utils import (ENCODINGS,
+                                   forever_headers,
+                                   preferred_encodings,
+                                   split_publisher_path)
+
+
+#Size of the blocks larger files are sent in
+BLOCK_SIZE = 64 * 1024
+
+
+class _Asset(object):
+    """ Everything needed to answer requests for one file. """
+    __slots__ = ('path', 'size', 'mtime', 'etag', 'last_modified', 'headers')
+
+    def __init__(self, path, content_type, encoding = None, digest = None):
+        stat = os.stat(path)
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        if digest:
+            self.etag = '"%s%s"' % (digest, encoding and '-' + encoding or '')
+        else:
+            self.etag = '"%x-%x%s"' % (stat.st_mtime_ns, stat.st_size, encoding and '-' + encoding or '')
+        self.last_modified = formatdate(self.mtime, usegmt = True)
+        self.headers = [('Content-Type', content_type),
+                        ('ETag', self.etag),
+                        ('Last-Modified', self.last_modified)]
+        if encoding:
+            self.headers.append(('Content-Encoding', encoding))
+
+
+class MemoryPublisher(object):
+    """ WSGI application that serves the registered resources of reg, at the same URLs
+        as ``PrecompressedPublisher``.
+
+        max_memory
+            Total size in bytes of the file contents kept in memory.
+
+        max_file_size
+            Files larger than this are never kept in memory, but sent from disk.
+
+        output_dir
+            Optional directory with files written by ``precompress``.
+
+        fallback
+            Optional WSGI application for anything that isn't a registered resource,
+            like images and fonts. If it's None, those requests get a 404.
+    """
+
+    def __init__(self, reg, max_memory = 16 * 1024 * 1024, max_file_size = 256 * 1024,
+                 output_dir = None, fallback = None):
+        self.reg = reg
+        self.max_memory = max_memory
+        self.max_file_size = max_file_size
+        self.output_dir = output_dir
+        self.fallback = fallback
+        self.hits = 0
+        self.misses = 0
+        self._assets = {}
+        self._generation = None
+        self._contents = OrderedDict()
+        self._memory = 0
+        self._lock = threading.Lock()
+        self._update()
+
+    def _update(self, refresh = False):
+        """ Prepare assets for resources that were registered since the last time,
+            and forget those that aren't registered anymore.
+        """
+        with self._lock:
+            generation = self.reg.generation
+            if generation == self._generation and not refresh:
+                return
+            assets = {}
+            for (library_name, resource) in registered_resources(self.reg):
+                key = (library_name, resource.relpath)
+                variants = not refresh and self._assets.get(key) or None
+                if variants is None:
+                    variants = self._prepare(library_name, resource)
+                assets[key] = variants
+            self._assets = assets
+            self._generation = generation
+            if refresh:
+                self._contents = OrderedDict()
+                self._memory = 0
+
+    def _prepare(self, library_name, resource):
+        """ Dict of content encodings and their ``_Asset``, None for the file itself. """
+        source = resource.fullpath()
+        content_type = mimetypes.guess_type(source)[0] or 'application/octet-stream'
+        digest = getattr(resource, 'fingerprint', None)
+        try:
+            variants = {None: _Asset(source, content_type, digest = digest)}
+        except OSError:
+            return {}
+        if self.output_dir is not None:
+            for (ext, encoding) in ENCODINGS:
+                path = compressed_path(self.output_dir, library_name, resource.relpath, ext)
+                try:
+                    if os.stat(path).st_mtime >= os.stat(source).st_mtime:
+                        variants[encoding] = _Asset(path, content_type, encoding, digest)
+                except OSError:
+                    pass
+        return variants
+
+    def refresh(self):
+        """ Prepare every asset again and forget the contents in memory,
+            for instance after files changed on disk.
+        """
+        self._update(refresh = True)
+
+    def _content(self, asset):
+        """ Contents of asset from memory, or None if it's too large to keep. """
+        with self._lock:
+            data = self._contents.get(asset.path)
+            if data is not None:
+                self._contents.move_to_end(asset.path)
+                self.hits += 1
+                return data
+            self.misses += 1
+        if asset.size > self.max_file_size or asset.size > self.max_memory:
+            return None
+        with open(asset.path, 'rb') as f:
+            data = f.read()
+        with self._lock:
+            if asset.path not in self._contents:
+                self._contents[asset.path] = data
+                self._memory += len(data)
+                while self._memory > self.max_memory:
+                    path, dropped = self._contents.popitem(last = False)
+                    self._memory -= len(dropped)
+        return data
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'files': len(self._contents),
+                    'memory': self._memory}
+
+    def __call__(self, environ, start_response):
+        if self._generation != self.reg.generation:
+            self._update()
+        library_name, relpath, versioned = split_publisher_path(environ.get('PATH_INFO', ''))
+        variants = None
+        if relpath is not None:
+            variants = self._assets.get((library_name, relpath))
+        if not variants:
+            if self.fallback is not None:
+                return self.fallback(environ, start_response)
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found']
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if method not in ('GET', 'HEAD'):
+            start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Type', 'text/plain')])
+            return [b'Method Not Allowed']
+        asset = variants[None]
+        if len(variants) > 1:
+            for (ext, encoding) in preferred_encodings(environ.get('HTTP_ACCEPT_ENCODING', '')):
+                if encoding in variants:
+                    asset = variants[encoding]
+                    break
+        headers = list(asset.headers)
+        if self.output_dir is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+        if versioned:
+            headers.extend(forever_headers())
+        if _not_modified(environ, asset):
+            start_response('304 Not Modified', headers)
+            return []
+        if method == 'HEAD':
+            headers.append(('Content-Length', str(asset.size)))
+            start_response('200 OK', headers)
+            return []
+        data = self._content(asset)
+        if data is not None:
+            headers.append(('Content-Length', str(len(data))))
+            start_response('200 OK', headers)
+            return [data]
+        headers.append(('Content-Length', str(asset.size)))
+        start_response('200 OK', headers)
+        f = open(asset.path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, BLOCK_SIZE)
+        return _FileIterator(f)
+
+
+class _FileIterator(object):
+
+    def __init__(self, f):
+        self.f = f
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = self.f.read(BLOCK_SIZE)
+        if not data:
+            raise StopIteration
+        return data
+
+    def close(self):
+        self.f.close()
+
+
+def _not_modified(environ, asset):
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        #A weak comparison, as it should be for conditional GET and HEAD requests
+        tags = [x.strip() for x in if_none_match.split(',')]
+        return '*' in tags or asset.etag in tags or ('W/' + asset.etag) in tags
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        parsed = parsedate_tz(if_modified_since)
+        if parsed is not None:
+            return mktime_tz(parsed) >= asset.mtime
+    return False
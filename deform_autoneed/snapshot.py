@@ -0,0 +1,131 @@
+""" Save a populated ``ResourceRegistry`` to disk and restore it without resolving
+    any resource paths or importing deform.
+
+    A snapshot is only used if it was made with the same versions of deform and
+    fanstatic, and if the static directories of the registered libraries haven't
+    been modified since. Otherwise it's ignored and the registry has to be populated
+    the normal way.
+"""
+import json
+import logging
+import os
+
+from fanstatic import Resource
+
+from deform_autoneed.utils import write_atomic
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FORMAT = 1
+
+
+def snapshot_key(reg):
+    """ Return a dict with everything a snapshot of reg depends on. """
+    from deform_autoneed import _distribution_version
+    libraries = {}
+    for (name, library) in reg.libraries.items():
+        libraries[name] = [library.name, library.path, _directory_mtimes(library.path)]
+    return {'format': SNAPSHOT_FORMAT,
+            'deform': _distribution_version('deform'),
+            'fanstatic': _distribution_version('fanstatic'),
+            'libraries': libraries}
+
+def _directory_mtimes(path):
+    """ Modification times of the library directory and the directories directly within it.
+        Adding or removing files changes them.
+    """
+    mtimes = {}
+    try:
+        entries = os.listdir(path)
+    except OSError:
+        return mtimes
+    mtimes['.'] = os.stat(path).st_mtime
+    for fname in entries:
+        fpath = os.path.join(path, fname)
+        if os.path.isdir(fpath):
+            mtimes[fname] = os.stat(fpath).st_mtime
+    return mtimes
+
+
+def dump_registry(reg):
+    """ Return a JSON-serializable dict with the requirements of reg, which libraries
+        and relative paths their resources have and what each resource depends on.
+        Lazily added requirements are created first.
+    """
+    reg.load()
+    lib_names = dict((id(library), name) for (name, library) in reg.libraries.items())
+    def _resource_id(resource):
+        try:
+            return "%s:%s" % (lib_names[id(resource.library)], resource.relpath)
+        except KeyError:
+            raise ValueError("The library of %r isn't registered in the registry, so it can't be saved." % resource)
+    requirements = {}
+    resources = {}
+    pending = []
+    for (name, requirement) in reg.requirements.items():
+        requirements[name] = [_resource_id(x) for x in requirement]
+        pending.extend(requirement)
+    while pending:
+        resource = pending.pop()
+        resource_id = _resource_id(resource)
+        if resource_id in resources:
+            continue
+        depends = sorted(resource.depends, key = _resource_id)
+        resources[resource_id] = [_resource_id(x) for x in depends]
+        pending.extend(depends)
+    return {'key': snapshot_key(reg),
+            'requirements': requirements,
+            'resources': resources}
+
+def restore_registry(data, reg):
+    """ Populate reg from data created by ``dump_registry``. Resources that the libraries
+        already know about are reused. Existing requirements in reg are replaced.
+    """
+    resources = {}
+    def _get_resource(resource_id, visiting = ()):
+        if resource_id in resources:
+            return resources[resource_id]
+        if resource_id in visiting:
+            raise ValueError("Dependency cycle in snapshot at '%s'" % resource_id)
+        lib_name, relpath = resource_id.split(':', 1)
+        library = reg.libraries[lib_name]
+        if relpath in library.known_resources:
+            resource = library.known_resources[relpath]
+        else:
+            depends = [_get_resource(x, visiting + (resource_id,)) for x in data['resources'][resource_id]]
+            resource = Resource(library, relpath, depends = depends)
+        resources[resource_id] = resource
+        return resource
+    requirements = {}
+    for (name, resource_ids) in data['requirements'].items():
+        requirements[name] = [_get_resource(x) for x in resource_ids]
+    reg.requirements = requirements
+
+
+def save_snapshot(reg, path):
+    """ Write a snapshot of reg to path. The file is replaced atomically. """
+    data = dump_registry(reg)
+    write_atomic(path, json.dumps(data, sort_keys = True))
+    logger.debug("Saved registry snapshot to %s", path)
+
+def load_snapshot(path, reg):
+    """ Populate reg from the snapshot at path. Returns True if the snapshot was used,
+        False if it doesn't exist or isn't valid for the current environment.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        logger.debug("No usable registry snapshot at %s", path)
+        return False
+    if data.get('key') != snapshot_key(reg):
+        logger.debug("Registry snapshot at %s is outdated", path)
+        return False
+    try:
+        restore_registry(data, reg)
+    except (KeyError, ValueError) as exc:
+        logger.warning("Couldn't restore registry snapshot at %s: %s", path, exc)
+        return False
+    logger.debug("Restored registry from snapshot at %s", path)
+    return True
@@ -0,0 +1,147 @@
+""" A cached index of the files in a static directory, like deforms ``static`` folder.
+
+    Each directory is walked once per process. The index keeps the size and modification
+    time of every file, and the versions of libraries that can be detected from their
+    file names, like ``jquery-2.0.3.min.js``, or from a header comment, like bootstrap::
+
+        from deform_autoneed.staticindex import get_static_index
+
+        index = get_static_index(deform_static)
+        index.versions['jquery']    # ('2.0.3', 'scripts/jquery-2.0.3.min.js')
+
+    Files added or changed later aren't picked up until ``refresh`` or
+    ``clear_static_indexes`` is called.
+"""
+import os
+import re
+import threading
+
+
+#Versions in file names, like jquery-2.0.3.min.js or jquery.form-3.09.js
+_versioned_name = re.compile(r'^(?P<name>[\w.]+?)-(?P<version>\d+(?:\.\d+)*)(?:\.min)?\.(?:js|css)$')
+#Libraries without a version in their file name, but with one in their header comment
+HEADER_VERSIONS = {'bootstrap': re.compile(r'Bootstrap v(?P<version>\d+(?:\.\d+)*)')}
+
+
+class StaticIndex(object):
+    """ The files below path.
+
+        files
+            A dict with the path of each file relative to path, with '/' as separator,
+            as key and a tuple of size and modification time as value.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.normpath(path)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        """ Walk the directory again. """
+        files = {}
+        for (dirpath, dirnames, filenames) in os.walk(self.path):
+            dirnames.sort()
+            reldir = os.path.relpath(dirpath, self.path).replace(os.sep, '/')
+            prefix = reldir != '.' and reldir + '/' or ''
+            for fname in sorted(filenames):
+                try:
+                    stat = os.stat(os.path.join(dirpath, fname))
+                except OSError:
+                    continue
+                files[prefix + fname] = (stat.st_size, stat.st_mtime)
+        with self._lock:
+            self.files = files
+            self._versions = None
+            self._found = {}
+
+    def __contains__(self, relpath):
+        return relpath in self.files
+
+    def __len__(self):
+        return len(self.files)
+
+    def stat(self, relpath):
+        """ Size and modification time of relpath. Raises KeyError for unknown files. """
+        return self.files[relpath]
+
+    def relpath(self, abs_path):
+        """ abs_path relative to the indexed directory, or None if it's outside of it. """
+        abs_path = os.path.normpath(abs_path)
+        if not abs_path.startswith(self.path + os.sep):
+            return None
+        return abs_path[len(self.path) + 1:].replace(os.sep, '/')
+
+    def contains_path(self, abs_path):
+        """ True if abs_path is an indexed file. """
+        relpath = self.relpath(abs_path)
+        return relpath is not None and relpath in self.files
+
+    def find(self, pattern):
+        """ Sorted tuple of relative paths that match the regular expression pattern.
+            Cached per pattern.
+        """
+        try:
+            return self._found[pattern]
+        except KeyError:
+            pass
+        regex = isinstance(pattern, str) and re.compile(pattern) or pattern
+        result = self._found[pattern] = tuple(x for x in sorted(self.files) if regex.match(x))
+        return result
+
+    @property
+    def versions(self):
+        """ A dict with library names as keys and tuples of version and relative path
+            as values. Minified files are preferred.
+        """
+        versions = self._versions
+        if versions is not None:
+            return versions
+        versions = {}
+        for relpath in sorted(self.files):
+            fname = relpath.rsplit('/', 1)[-1]
+            match = _versioned_name.match(fname)
+            if match is not None:
+                name, version = match.group('name'), match.group('version')
+            else:
+                name = fname.split('.', 1)[0]
+                if name not in HEADER_VERSIONS or not fname.endswith('.js'):
+                    continue
+                version = self._header_version(relpath, HEADER_VERSIONS[name])
+                if version is None:
+                    continue
+            if name not in versions or ('.min.' in fname and '.min.' not in versions[name][1]):
+                versions[name] = (version, relpath)
+        self._versions = versions
+        return versions
+
+    def _header_version(self, relpath, pattern):
+        try:
+            with open(os.path.join(self.path, *relpath.split('/')), 'rb') as f:
+                header = f.read(512).decode('utf-8', 'replace')
+        except OSError:
+            return None
+        match = pattern.search(header)
+        return match and match.group('version') or None
+
+
+_static_indexes = {}
+_static_indexes_lock = threading.Lock()
+
+
+def get_static_index(path):
+    """ The ``StaticIndex`` of path. It's created the first time it's needed. """
+    path = os.path.normpath(path)
+    try:
+        return _static_indexes[path]
+    except KeyError:
+        pass
+    with _static_indexes_lock:
+        index = _static_indexes.get(path)
+        if index is None:
+            index = _static_indexes[path] = StaticIndex(path)
+    return index
+
+def clear_static_indexes():
+    """ Forget every index, so directories are walked again when they're needed next. """
+    with _static_indexes_lock:
+        _static_indexes.clear()
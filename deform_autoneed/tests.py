@@ -1,4 +1,5 @@
 from unittest import TestCase
+import os
 
 import deform
 import colander
@@ -135,6 +136,34 @@ class ResourceRegistryTests(TestCase):
         res = obj.find_resource(relpath)
         self.assertIsInstance(res, Resource)
 
+    def test_find_resource_after_direct_assignment(self):
+        obj = self._cut(add_basics = False)
+        obj.libraries['deform_autoneed'] = library = Library('deform_autoneed', 'testing_fixture')
+        resource_js = Resource(library, 'dummy.js')
+        obj.requirements['dummy'] = [resource_js]
+        self.assertEqual(obj.find_resource('deform_autoneed:testing_fixture/dummy.js'), resource_js)
+
+    def test_find_resource_index_follows_replace(self):
+        obj = self._cut(add_basics = False)
+        obj.libraries['deform_autoneed'] = library = Library('deform_autoneed', 'testing_fixture')
+        resource_js = Resource(library, 'dummy.js')
+        obj.requirements['dummy'] = [resource_js]
+        obj.replace_resource('deform_autoneed:testing_fixture/dummy.js', 'deform_autoneed:testing_fixture/dummy.css')
+        self.assertEqual(obj.find_resource('deform_autoneed:testing_fixture/dummy.js'), None)
+        res = obj.find_resource('deform_autoneed:testing_fixture/dummy.css')
+        self.assertEqual(res, obj.requirements['dummy'][0])
+        self.assertEqual(obj.find_resource(obj._resource_fullpath(res)), res)
+
+    def test_find_resource_nonexistent(self):
+        obj = self._cut(add_basics = False)
+        self.assertEqual(obj.find_resource('deform:static/css/beautify.css'), None)
+
+    def test_create_resource_uses_index(self):
+        obj = self._cut(add_basics = False)
+        obj.create_requirement_for('something', 'css/beautify.css', requirement_depends = [])
+        res = obj.create_resource('deform:static/css/beautify.css')
+        self.assertEqual(res, obj.requirements['something'][0])
+
     def test_remove_resource(self):
         obj = self._cut()
         obj.create_requirement_for('something', 'css/beautify.css', requirement_depends = [])
@@ -178,6 +207,45 @@ class ResourceRegistryTests(TestCase):
         self.assertNotIn(resource_js, obj.requirements['dummy'])
         self.assertEqual(obj.requirements['dummy'][0].relpath, 'dummy.css')
 
+    def test_replace_resource_updates_dependents(self):
+        obj = self._cut()
+        obj.populate_from_resources()
+        jquery = obj.requirements['basic'][0]
+        dependents = obj.graph.all_dependents(jquery)
+        testing_fixture_dir = resource_filename('deform_autoneed', 'testing_fixture')
+        new = Resource(Library('deform_autoneed', testing_fixture_dir), 'dummy.js')
+        obj.replace_resource(jquery, new)
+        self.assertTrue(dependents)
+        for res in dependents:
+            self.assertNotIn(jquery, res.resources)
+            self.assertIn(new, res.resources)
+        for res in obj.graph.dependents[new]:
+            self.assertIn(new, res.depends)
+            self.assertNotIn(jquery, res.depends)
+        for resources in obj.requirements.values():
+            self.assertNotIn(jquery, resources)
+        self.assertNotIn(jquery, obj.graph)
+
+    def test_graph_follows_registry(self):
+        obj = self._cut()
+        obj.populate_from_resources()
+        deform_js = obj.find_resource('deform:static/scripts/deform.js')
+        self.assertIn(deform_js, obj.graph)
+        self.assertEqual(obj.graph.depends[deform_js], deform_js.depends)
+
+    def test_replace_resource_cycle(self):
+        from deform_autoneed.graph import DependencyCycleError
+        obj = self._cut()
+        obj.populate_from_resources()
+        jquery = obj.requirements['basic'][0]
+        dependent = obj.find_resource('deform:static/scripts/deform.js')
+        testing_fixture_dir = resource_filename('deform_autoneed', 'testing_fixture')
+        testing_lib = Library('deform_autoneed', testing_fixture_dir)
+        new = Resource(testing_lib, 'dummy.js', depends = [dependent])
+        self.assertRaises(DependencyCycleError, obj.replace_resource, jquery, new)
+        self.assertIn(jquery, obj.requirements['basic'])
+        self.assertNotIn(new, dependent.depends)
+
     def test_replace_resource_that_has_a_requirement(self):
         obj = self._cut()
         obj.libraries['deform_autoneed'] = library = Library('deform_autoneed', 'testing_fixture')
@@ -194,6 +262,388 @@ class ResourceRegistryTests(TestCase):
         self.assertEqual(len(resources), 2)
 
 
+class RegistryTransactionTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _mk_populated(self):
+        reg = _mk_reg()
+        reg.populate_from_resources()
+        return reg
+
+    def test_commit(self):
+        reg = self._mk_populated()
+        generation = reg.generation
+        with reg.transaction() as transaction:
+            transaction.create_requirement_for('something', 'css/beautify.css', requirement_depends = [])
+            transaction.replace_resource('deform:static/scripts/jquery.form-3.09.js', 'deform:static/scripts/jquery.form.js')
+            transaction.remove_resource('deform:static/css/beautify.css')
+            self.assertEqual(reg.generation, generation)
+        self.assertEqual(reg.generation, generation + 1)
+        self.assertEqual(reg.requirements['something'], [])
+        self.assertEqual(reg.find_resource('deform:static/scripts/jquery.form-3.09.js'), None)
+        self.assertIn('scripts/jquery.form.js', [x.relpath for x in reg.resources_for(['jquery.form'])])
+
+    def test_cycle(self):
+        from deform_autoneed.graph import DependencyCycleError
+        reg = self._mk_populated()
+        transaction = reg.transaction()
+        transaction.replace_resource('deform:static/css/form.css', 'deform:static/css/typeahead.css')
+        self.assertRaises(DependencyCycleError, transaction.validate)
+
+    def test_validated_before_applied(self):
+        reg = self._mk_populated()
+        transaction = reg.transaction()
+        transaction.replace_resource('deform:static/scripts/jquery.form-3.09.js', 'deform:static/scripts/jquery.form.js')
+        transaction.remove_resource('deform:static/css/does_not_exist.css')
+        self.assertRaises(KeyError, transaction.commit)
+        self.assertNotEqual(reg.find_resource('deform:static/scripts/jquery.form-3.09.js'), None)
+
+    def test_unknown_requirement_depends(self):
+        reg = self._mk_populated()
+        transaction = reg.transaction()
+        transaction.create_requirement_for('something', 'css/beautify.css', requirement_depends = ['nothing'])
+        self.assertRaises(KeyError, transaction.validate)
+        transaction = reg.transaction()
+        transaction.create_requirement_for('nothing', 'css/form.css', requirement_depends = [])
+        transaction.create_requirement_for('something', 'css/beautify.css', requirement_depends = ['nothing'])
+        transaction.validate()
+
+    def test_missing_file(self):
+        from fanstatic import UnknownResourceError
+        reg = self._mk_populated()
+        transaction = reg.transaction()
+        transaction.create_requirement_for('something', 'css/does_not_exist.css')
+        self.assertRaises(UnknownResourceError, transaction.validate)
+
+    def test_removed_twice(self):
+        reg = self._mk_populated()
+        transaction = reg.transaction()
+        transaction.remove_resource('deform:static/css/form.css')
+        transaction.replace_resource('deform:static/css/form.css', 'deform:static/scripts/jquery.form.js')
+        self.assertRaises(KeyError, transaction.validate)
+
+    def test_exception_discards(self):
+        reg = self._mk_populated()
+        generation = reg.generation
+        try:
+            with reg.transaction() as transaction:
+                transaction.remove_resource('deform:static/css/form.css')
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(reg.generation, generation)
+        self.assertNotEqual(reg.find_resource('deform:static/css/form.css'), None)
+
+    def test_failed_commit_restored(self):
+        reg = _mk_reg()
+        generation = reg.generation
+        basic = list(reg.requirements['basic'])
+        resolved = reg.resources_for(['basic'])
+        jquery, bootstrap_js = basic[:2]
+        bootstrap_resources = set(bootstrap_js.resources)
+        def _remove_resource(*args):
+            raise RuntimeError()
+        reg.remove_resource = _remove_resource
+        transaction = reg.transaction()
+        transaction.replace_resource(jquery, 'deform:static/scripts/jquery.form.js')
+        transaction.remove_resource('deform:static/css/form.css')
+        self.assertRaises(RuntimeError, transaction.commit)
+        self.assertEqual(reg.generation, generation)
+        self.assertEqual(reg.requirements['basic'], basic)
+        self.assertEqual(bootstrap_js.resources, bootstrap_resources)
+        self.assertIn(jquery, bootstrap_js.depends)
+        known_resources = reg.libraries['deform'].known_resources
+        self.assertIs(known_resources[jquery.relpath], jquery)
+        self.assertNotIn('scripts/jquery.form.js', known_resources)
+        self.assertIs(reg.find_resource(jquery.fullpath()), jquery)
+        reg.changed()
+        self.assertEqual(reg.resources_for(['basic']), resolved)
+
+
+class LazyPopulationTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _mk_lazy(self):
+        reg = _mk_reg()
+        reg.populate_from_resources(lazy = True)
+        return reg
+
+    def test_nothing_created(self):
+        reg = self._mk_lazy()
+        self.assertEqual(set(reg.requirements), set(['basic']))
+        self.assertNotIn('scripts/jquery.form-3.09.js', reg.libraries['deform'].known_resources)
+        from deform.widget import default_resources
+        self.assertEqual(reg.stats()['pending'], len(default_resources))
+
+    def test_resources_for(self):
+        reg = self._mk_lazy()
+        lazy = reg.resources_for(['jquery.form'])
+        self.assertIn('jquery.form', reg.requirements)
+        self.assertNotIn('tinymce', reg.requirements)
+        _clearFLib()
+        eager = _mk_reg()
+        eager.populate_from_resources()
+        self.assertEqual([x.relpath for x in lazy], [x.relpath for x in eager.resources_for(['jquery.form'])])
+
+    def test_created_once(self):
+        reg = self._mk_lazy()
+        reg.load(['jquery.form'])
+        resources = list(reg.requirements['jquery.form'])
+        reg.load(['jquery.form'])
+        reg.create_requirement_for('jquery.form', 'deform:static/scripts/jquery.form.js')
+        self.assertEqual(reg.requirements['jquery.form'][:-1], resources)
+
+    def test_created_once_threads(self):
+        import threading
+        reg = self._mk_lazy()
+        results = []
+        threads = [threading.Thread(target = lambda: results.append(reg.resources_for(['tinymce']))) for x in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(reg.requirements['tinymce']), 1)
+        self.assertEqual(len(set(results)), 1)
+
+    def test_auto_need_frozen(self):
+        from deform_autoneed import auto_need
+        reg = self._mk_lazy()
+        auto_need(_mk_richtext_form(), reg = reg.freeze())
+        self.assertIn('tinymce.min.js', [x.filename for x in get_needed().resources()])
+
+    def test_need_lib(self):
+        from deform_autoneed import need_lib
+        reg = self._mk_lazy()
+        need_lib('jquery.form', reg = reg.freeze())
+        self.assertIn('jquery.form-3.09.js', [x.filename for x in get_needed().resources()])
+
+    def test_find_resource(self):
+        reg = self._mk_lazy()
+        resource = reg.find_resource('deform:static/scripts/jquery.form-3.09.js')
+        self.assertIn(resource, reg.requirements['jquery.form'])
+        self.assertNotIn('tinymce', reg.requirements)
+
+    def test_replace_resource(self):
+        reg = self._mk_lazy()
+        reg.replace_resource('deform:static/scripts/jquery.form-3.09.js', 'deform:static/scripts/jquery.form.js')
+        self.assertEqual([x.relpath for x in reg.resources_for(['jquery.form'])][-1], 'scripts/jquery.form.js')
+
+    def test_load_all(self):
+        reg = self._mk_lazy()
+        reg.load()
+        self.assertEqual(reg.stats()['pending'], 0)
+        self.assertIn('fileupload', reg.requirements)
+
+    def test_unknown_library(self):
+        reg = _mk_reg()
+        self.assertRaises(KeyError, reg.populate_from_resources, {'something': {None: {'js': 'unknown:file.js'}}}, lazy = True)
+
+
+class FrozenRegistryTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _mk_populated(self):
+        reg = _mk_reg()
+        reg.populate_from_resources()
+        return reg
+
+    def test_freeze(self):
+        reg = self._mk_populated()
+        frozen = reg.freeze()
+        self.assertIs(frozen, reg.freeze())
+        self.assertEqual(frozen.resources_for(['basic', 'tinymce']), reg.resources_for(['basic', 'tinymce']))
+        self.assertEqual(frozen.requirements['basic'], tuple(reg.requirements['basic']))
+        self.assertFalse(hasattr(frozen, '__dict__'))
+
+    def test_immutable(self):
+        frozen = self._mk_populated().freeze()
+        def _assign():
+            frozen.requirements['basic'] = ()
+        self.assertRaises(TypeError, _assign)
+        self.assertRaises(AttributeError, setattr, frozen, 'something', 1)
+
+    def test_changes_publish_new_view(self):
+        reg = self._mk_populated()
+        frozen = reg.freeze()
+        before = frozen.resources_for(['basic'])
+        reg.replace_resource('deform:static/css/form.css', 'deform:static/css/beautify.css')
+        self.assertEqual(frozen.resources_for(['basic']), before)
+        self.assertIsNot(reg.freeze(), frozen)
+        self.assertIn('css/beautify.css', [x.relpath for x in reg.freeze().resources_for(['basic'])])
+
+    def test_shares_resolved(self):
+        reg = self._mk_populated()
+        frozen = reg.freeze()
+        self.assertIs(frozen.resources_for(['basic']), reg.resources_for(['basic']))
+        self.assertIs(reg.resources_for(['tinymce']), frozen.resources_for(['tinymce']))
+
+    def test_auto_need(self):
+        from deform_autoneed import auto_need
+        frozen = self._mk_populated().freeze()
+        auto_need(_mk_richtext_form(), reg = frozen)
+        self.assertIn('deform.js', [x.filename for x in get_needed().resources()])
+
+    def test_libraries_not_shared(self):
+        from deform_autoneed import ResourceRegistry
+        first = ResourceRegistry(add_basics = False)
+        second = ResourceRegistry(add_basics = False)
+        first.libraries['something'] = Library('something', 'testing_fixture')
+        self.assertNotIn('something', second.libraries)
+        self.assertNotIn('libraries', ResourceRegistry.__dict__)
+
+
+class RegistryOverlayTests(TestCase):
+    tearDown = _clearFLib
+
+    def setUp(self):
+        _clearFLib()
+        self.base = _mk_reg()
+        self.base.populate_from_resources()
+        testing_fixture_dir = resource_filename('deform_autoneed', 'testing_fixture')
+        self.library = Library('deform_autoneed', testing_fixture_dir)
+
+    def _cut(self):
+        from deform_autoneed.overlay import RegistryOverlay
+        return RegistryOverlay(self.base)
+
+    def test_unchanged(self):
+        obj = self._cut()
+        self.assertEqual(obj.resources_for(['basic', 'tinymce']), self.base.resources_for(['basic', 'tinymce']))
+
+    def test_replace_resource(self):
+        from deform_autoneed import auto_need
+        obj = self._cut()
+        jquery = self.base.requirements['basic'][0]
+        base_resources = self.base.resources_for(['basic', 'jquery.form'])
+        new = Resource(self.library, 'dummy.js')
+        obj.replace_resource(jquery, new)
+        resources = obj.resources_for(['basic', 'jquery.form'])
+        self.assertNotIn(jquery, resources)
+        self.assertIn(new, resources)
+        self.assertEqual(len(resources), len(base_resources))
+        for (i, resource) in enumerate(resources):
+            for dependency in resource.depends:
+                self.assertLess(resources.index(dependency), i)
+        auto_need(_mk_richtext_form(), reg = obj)
+        needed = get_needed().resources()
+        self.assertNotIn(jquery, needed)
+        self.assertIn(new, needed)
+        #The base registry is unchanged
+        self.assertEqual(self.base.resources_for(['basic', 'jquery.form']), base_resources)
+        self.assertIn(jquery, self.base.requirements['basic'][1].depends)
+
+    def test_replace_resource_sorted_first(self):
+        from fanstatic.inclusion import sort_resources
+        from deform_autoneed import auto_need
+        #Normally done when fanstatic prepares its library registry
+        self.base.libraries['deform'].init_library_nr()
+        for resource in self.base.resources_for(self.base.requirements):
+            resource.init_dependency_nr()
+        theme = Library('theme', resource_filename('deform_autoneed', 'testing_fixture'))
+        obj = self._cut()
+        obj.replace_resource(self.base.requirements['basic'][0], Resource(theme, 'dummy.js'))
+        class DateSchema(colander.Schema):
+            date = colander.SchemaNode(colander.Date(), widget = deform.widget.DateInputWidget())
+        auto_need(deform.Form(DateSchema()), reg = obj)
+        rendered = [x.relpath for x in sort_resources(get_needed().resources()) if x.ext == '.js']
+        self.assertEqual(rendered[0], 'dummy.js')
+        self.assertIn('scripts/deform.js', rendered)
+        #The shared library keeps its number
+        self.assertEqual(self.base.requirements['basic'][1].library.library_nr, 0)
+
+    def test_replace_resource_path(self):
+        obj = self._cut()
+        obj.replace_resource('deform:static/css/form.css', 'deform:static/scripts/jquery.form.js')
+        relpaths = [x.relpath for x in obj.resources_for(['basic'])]
+        self.assertNotIn('css/form.css', relpaths)
+        self.assertIn('scripts/jquery.form.js', relpaths)
+        self.assertNotIn('css/form.css', [x.relpath for x in obj.requirements['basic']])
+
+    def test_remove_resource(self):
+        obj = self._cut()
+        obj.remove_resource('deform:static/css/form.css')
+        self.assertNotIn('css/form.css', [x.relpath for x in obj.resources_for(['basic', 'tinymce'])])
+        for resource in obj.resources_for(['basic', 'tinymce']):
+            self.assertNotIn('css/form.css', [x.relpath for x in resource.resources])
+
+    def test_set_requirement(self):
+        from deform_autoneed import need_resources
+        obj = self._cut()
+        dummy = Resource(self.library, 'dummy.js')
+        obj.set_requirement('tenant_widget', [dummy])
+        self.assertEqual(need_resources(['tenant_widget'], reg = obj), (dummy,))
+        self.assertNotIn('tenant_widget', self.base.requirements)
+
+    def test_cached_until_changed(self):
+        obj = self._cut()
+        first = obj.resources_for(['basic'])
+        self.assertIs(first, obj.resources_for(['basic']))
+        self.base.replace_resource('deform:static/css/form.css', 'deform:static/scripts/jquery.form.js')
+        self.assertNotEqual(first, obj.resources_for(['basic']))
+
+
+class DependencyGraphTests(TestCase):
+
+    @property
+    def _cut(self):
+        from deform_autoneed.graph import DependencyGraph
+        return DependencyGraph
+
+    def test_order(self):
+        obj = self._cut()
+        obj.add('c', ['b'])
+        obj.add('b', ['a'])
+        obj.add('d')
+        order = obj.order()
+        self.assertLess(order['a'], order['b'])
+        self.assertLess(order['b'], order['c'])
+        self.assertEqual(len(order), 4)
+
+    def test_closure_and_resolve(self):
+        obj = self._cut()
+        obj.add('c', ['b'])
+        obj.add('b', ['a'])
+        obj.add('d', ['a'])
+        self.assertEqual(obj.closure('c'), frozenset(['a', 'b', 'c']))
+        self.assertEqual(obj.resolve(['d', 'c']), ('a', 'b', 'c', 'd'))
+
+    def test_cycle(self):
+        from deform_autoneed.graph import DependencyCycleError
+        obj = self._cut()
+        obj.add('c', ['b'])
+        obj.add('b', ['a'])
+        try:
+            obj.add_dependency('a', 'c')
+        except DependencyCycleError as exc:
+            self.assertEqual(exc.cycle, ('a', 'c', 'b', 'a'))
+        else:
+            self.fail("Cycle not detected")
+        self.assertEqual(obj.depends['a'], set())
+
+    def test_closures_kept_for_unaffected_nodes(self):
+        obj = self._cut()
+        obj.add('c', ['b'])
+        obj.add('b', ['a'])
+        obj.add('e', ['d'])
+        closure_c = obj.closure('c')
+        closure_e = obj.closure('e')
+        obj.add('f', ['c'])
+        self.assertIs(obj.closure('c'), closure_c)
+        obj.add_dependency('a', 'd')
+        self.assertIs(obj.closure('e'), closure_e)
+        self.assertEqual(obj.closure('c'), frozenset(['a', 'b', 'c', 'd']))
+        self.assertEqual(obj.closure('f'), frozenset(['a', 'b', 'c', 'd', 'f']))
+
+    def test_remove(self):
+        obj = self._cut()
+        obj.add('c', ['b'])
+        obj.add('b', ['a'])
+        obj.remove('b')
+        self.assertEqual(obj.depends['c'], set())
+        self.assertEqual(obj.dependents['a'], set())
+        self.assertEqual(obj.resolve(['c']), ('c',))
+
+
 class AutoNeedTests(TestCase):
     tearDown = _clearFLib
 
@@ -214,6 +664,1118 @@ class AutoNeedTests(TestCase):
         self.assertIn('deform.js', [x.filename for x in resources])
 
 
+    def test_auto_need_includes_basic(self):
+        form = _mk_richtext_form()
+        self._fut(form, reg = self.reg)
+        filenames = [x.filename for x in get_needed().resources()]
+        self.assertIn('form.css', filenames)
+
+    def _record_resources_for(self):
+        calls = []
+        resources_for = self.reg.resources_for
+        def _resources_for(requirement_names):
+            calls.append(set(requirement_names))
+            return resources_for(requirement_names)
+        self.reg.resources_for = _resources_for
+        return calls
+
+    def test_auto_need_skips_needed_requirements(self):
+        form = _mk_richtext_form()
+        self._fut(form, reg = self.reg)
+        resources = get_needed().resources()
+        calls = self._record_resources_for()
+        self._fut(form, reg = self.reg)
+        self._fut(deform.Form(colander.Schema()), reg = self.reg)
+        self.assertEqual(calls, [])
+        self.assertEqual(get_needed().resources(), resources)
+
+    def test_auto_need_resolves_new_requirements_only(self):
+        from deform_autoneed import needed_requirements
+        self._fut(deform.Form(colander.Schema()), reg = self.reg)
+        calls = self._record_resources_for()
+        self._fut(_mk_richtext_form(), reg = self.reg)
+        self.assertEqual(calls, [set(['tinymce'])])
+        self.assertIn('tinymce', needed_requirements())
+        self.assertIn('form.css', [x.filename for x in get_needed().resources()])
+
+    def test_needed_requirements_reset_on_clear(self):
+        from deform_autoneed import needed_requirements
+        from fanstatic import clear_needed
+        self._fut(_mk_richtext_form(), reg = self.reg)
+        clear_needed()
+        self.assertEqual(needed_requirements(), set())
+        self._fut(_mk_richtext_form(), reg = self.reg)
+        self.assertIn('form.css', [x.filename for x in get_needed().resources()])
+
+    def test_need_resources(self):
+        from deform_autoneed import need_resources
+        extra = self.reg.requirements['jquery.form'][-1]
+        result = need_resources(['basic', extra, 'basic', extra], reg = self.reg)
+        self.assertEqual(len(result), len(set(result)))
+        self.assertEqual(set(get_needed().resources()), set(result))
+        self.assertIn(extra, result)
+
+    def test_need_resources_unknown_name(self):
+        from deform_autoneed import need_resources
+        self.assertRaises(KeyError, need_resources, ['does_not_exist'], reg = self.reg)
+
+    def test_need_resources_needed_subclass(self):
+        from deform_autoneed import _needed_var
+        from deform_autoneed import need_resources
+        from fanstatic import NeededResources
+        calls = []
+        class Needed(NeededResources):
+            def need(self, resource, slots = None):
+                calls.append(resource)
+                NeededResources.need(self, resource, slots)
+        needed = Needed()
+        token = _needed_var.set(needed)
+        try:
+            result = need_resources(['basic'], reg = self.reg)
+            need_resources(['basic'], reg = self.reg)
+        finally:
+            _needed_var.reset(token)
+        self.assertEqual(calls, list(result) * 2)
+        self.assertEqual(vars(needed).keys(), vars(NeededResources()).keys())
+
+    def test_need_resources_without_needed(self):
+        from deform_autoneed import need_resources
+        from fanstatic import del_needed
+        del_needed()
+        self.assertTrue(need_resources(['basic'], reg = self.reg))
+
+    def test_resources_for_cached(self):
+        first = self.reg.resources_for(['basic', 'jquery.form'])
+        self.assertIs(first, self.reg.resources_for(('jquery.form', 'basic')))
+
+    def test_resources_for_dependencies_first(self):
+        resources = self.reg.resources_for(['basic', 'jquery.form'])
+        for (i, resource) in enumerate(resources):
+            for dependency in resource.depends:
+                self.assertLess(resources.index(dependency), i)
+
+    def test_resources_for_unknown_name(self):
+        self.assertEqual(self.reg.resources_for(['does_not_exist']), ())
+
+    def test_resources_for_invalidated_on_change(self):
+        first = self.reg.resources_for(['basic'])
+        generation = self.reg.generation
+        self.reg.replace_resource('deform:static/css/form.css', 'deform:static/css/beautify.css')
+        self.assertGreater(self.reg.generation, generation)
+        second = self.reg.resources_for(['basic'])
+        self.assertNotIn('css/form.css', [x.relpath for x in second])
+        self.assertIn('css/beautify.css', [x.relpath for x in second])
+        self.assertNotEqual(first, second)
+
+
+class WidgetRequirementsCacheTests(TestCase):
+
+    @property
+    def _cut(self):
+        from deform_autoneed import WidgetRequirementsCache
+        return WidgetRequirementsCache
+
+    def test_get(self):
+        obj = self._cut()
+        form = _mk_richtext_form()
+        self.assertEqual(obj.get(form), tuple(form.get_widget_requirements()))
+        self.assertEqual(obj.get(form), tuple(form.get_widget_requirements()))
+        self.assertEqual(obj.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+    def test_widget_replaced(self):
+        obj = self._cut()
+        form = _mk_richtext_form()
+        obj.get(form)
+        form['richtext'].widget = deform.widget.TextInputWidget()
+        self.assertEqual(obj.get(form), tuple(form.get_widget_requirements()))
+        self.assertEqual(obj.misses, 2)
+
+    def test_field_removed(self):
+        obj = self._cut()
+        form = _mk_richtext_form()
+        obj.get(form)
+        del form.children[0]
+        self.assertEqual(obj.get(form), tuple(form.get_widget_requirements()))
+        self.assertEqual(obj.misses, 2)
+
+    def test_forms_held_weakly(self):
+        import gc
+        obj = self._cut()
+        obj.get(_mk_richtext_form())
+        gc.collect()
+        self.assertEqual(obj.stats()['size'], 0)
+
+    def test_auto_need_with_cache(self):
+        from deform_autoneed import auto_need
+        _clearFLib()
+        reg = _mk_reg()
+        reg.populate_from_resources()
+        obj = self._cut()
+        form = _mk_richtext_form()
+        auto_need(form, reg = reg, requirements_cache = obj)
+        auto_need(form, reg = reg, requirements_cache = obj)
+        self.assertEqual(obj.hits, 1)
+        self.assertIn('deform.js', [x.filename for x in get_needed().resources()])
+        _clearFLib()
+
+
+class SnapshotTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _mk_populated(self):
+        reg = _mk_reg()
+        reg.populate_from_resources()
+        return reg
+
+    def _summary(self, reg):
+        result = {}
+        for (name, resources) in reg.requirements.items():
+            result[name] = [(x.relpath, sorted(y.relpath for y in x.depends)) for x in resources]
+        return result
+
+    def test_save_and_load(self):
+        import os
+        import tempfile
+        from deform_autoneed import ResourceRegistry
+        from deform_autoneed.snapshot import save_snapshot, load_snapshot
+        reg = self._mk_populated()
+        expected = self._summary(reg)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'snapshot.json')
+            save_snapshot(reg, path)
+            _clearFLib()
+            restored = ResourceRegistry(add_basics = False)
+            self.assertTrue(load_snapshot(path, restored))
+        self.assertEqual(self._summary(restored), expected)
+        self.assertTrue(restored.find_resource('deform:static/scripts/deform.js'))
+
+    def test_load_missing(self):
+        from deform_autoneed.snapshot import load_snapshot
+        self.assertFalse(load_snapshot('/does/not/exist.json', _mk_reg()))
+
+    def test_load_outdated(self):
+        import json
+        import os
+        import tempfile
+        from deform_autoneed.snapshot import save_snapshot, load_snapshot
+        reg = self._mk_populated()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'snapshot.json')
+            save_snapshot(reg, path)
+            with open(path) as f:
+                data = json.load(f)
+            data['key']['deform'] = '0.0.1'
+            with open(path, 'w') as f:
+                json.dump(data, f)
+            self.assertFalse(load_snapshot(path, reg))
+
+    def test_dump_unknown_library(self):
+        from deform_autoneed.snapshot import dump_registry
+        reg = _mk_reg()
+        library = Library('deform_autoneed', 'testing_fixture')
+        reg.requirements['dummy'] = [Resource(library, 'dummy.js')]
+        self.assertRaises(ValueError, dump_registry, reg)
+
+
+class BundleBuilderTests(TestCase):
+    tearDown = _clearFLib
+
+    def setUp(self):
+        import tempfile
+        _clearFLib()
+        self.reg = _mk_reg()
+        self.reg.populate_from_resources()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def _cut(self, **kw):
+        from deform_autoneed.bundles import BundleBuilder
+        kw.setdefault('register_library', False)
+        return BundleBuilder(self.reg, self.tmpdir.name, **kw)
+
+    def _read(self, resource):
+        with open(resource.fullpath()) as f:
+            return f.read()
+
+    def test_bundles_for(self):
+        obj = self._cut(exclude = ())
+        bundles = obj.bundles_for(['basic', 'jquery.form'])
+        self.assertEqual([x.ext for x in bundles], ['.css', '.js'])
+        js = self._read(bundles[1])
+        resources = [x for x in self.reg.resources_for(['basic', 'jquery.form']) if x.ext == '.js']
+        positions = []
+        for resource in resources:
+            with open(resource.fullpath()) as f:
+                positions.append(js.index(f.read()[:200]))
+        self.assertEqual(positions, sorted(positions))
+
+    def test_bundles_for_cached(self):
+        obj = self._cut()
+        self.assertIs(obj.bundles_for(['basic']), obj.bundles_for(['basic']))
+
+    def test_bundles_for_registry_changed(self):
+        obj = self._cut(exclude = ())
+        first = obj.bundles_for(['basic'])
+        self.reg.remove_resource('deform:static/css/form.css')
+        second = obj.bundles_for(['basic'])
+        self.assertNotEqual(first[0].relpath, second[0].relpath)
+
+    def test_css_urls_rewritten(self):
+        obj = self._cut(url_prefix = '/static')
+        os.mkdir(os.path.join(self.tmpdir.name, 'css'))
+        with open(os.path.join(self.tmpdir.name, 'css', 'urls.css'), 'w') as f:
+            f.write('@charset "utf-8";\n.a {background: url("../img/a.png")}\n'
+                    '.b {background: url(data:image/png;base64,AAAA)}\n'
+                    '.c {background: url(/abs.png)}\n')
+        resource = Resource(Library('other', self.tmpdir.name), 'css/urls.css')
+        text = self._read(obj.build([resource])[0])
+        self.assertIn('url("/static/other/img/a.png")', text)
+        self.assertIn('url(data:image/png;base64,AAAA)', text)
+        self.assertIn('url(/abs.png)', text)
+        self.assertNotIn('@charset', text)
+
+    def test_minifiers(self):
+        obj = self._cut(minifiers = {'.css': lambda x: '/* min */'}, exclude = ())
+        bundles = obj.bundles_for(['basic'])
+        self.assertEqual(self._read(bundles[0]), '/* min */')
+
+    def test_auto_need_with_bundler(self):
+        from deform_autoneed import auto_need
+        self.reg.bundler = self._cut()
+        form = _mk_richtext_form()
+        auto_need(form, reg = self.reg)
+        resources = get_needed().resources()
+        self.assertEqual(set([x.library.name for x in resources]), set(['deform_autoneed_bundles', 'deform_autoneed_lib']))
+        unbundled = [x for x in resources if x.library.name == 'deform_autoneed_lib']
+        self.assertEqual(set(unbundled), self.reg.requirements['tinymce'][0].resources)
+
+    def test_auto_need_several_forms_with_bundler(self):
+        from deform_autoneed import auto_need
+        from fanstatic.inclusion import sort_resources
+        self.reg.bundler = self._cut(exclude = ())
+        class DateSchema(colander.Schema):
+            date = colander.SchemaNode(colander.Date(), widget = deform.widget.DateInputWidget())
+        class AutocompleteSchema(colander.Schema):
+            text = colander.SchemaNode(colander.String(),
+                                       widget = deform.widget.AutocompleteInputWidget(values = ['a']))
+        auto_need(deform.Form(DateSchema()), reg = self.reg)
+        auto_need(deform.Form(AutocompleteSchema(), formid = 'other'), reg = self.reg)
+        bundles = [x for x in sort_resources(get_needed().resources()) if x.ext == '.js']
+        self.assertEqual(len(bundles), 2)
+        first, second = [x.bundled for x in bundles]
+        self.assertFalse(set(first) & set(second))
+        self.assertIn(self.reg.requirements['basic'][0], first)
+        self.assertIn(self.reg.requirements['typeahead'][0], second)
+
+    def _prepare(self):
+        #Normally done when fanstatic prepares its library registry
+        self.reg.libraries['deform'].init_library_nr()
+        for resource in self.reg.resources_for(self.reg.requirements):
+            resource.init_dependency_nr()
+        self.reg.bundler = self._cut()
+
+    def _rendered_js(self):
+        from fanstatic import Inclusion
+        result = []
+        for resource in Inclusion(get_needed()).resources:
+            if resource.ext != '.js':
+                continue
+            if resource.library is self.reg.bundler.library:
+                result.extend(x.relpath for x in resource.bundled)
+            else:
+                result.append(resource.relpath)
+        return result
+
+    def test_bundles_after_excluded_dependencies(self):
+        from deform_autoneed import auto_need
+        self._prepare()
+        class Schema(colander.Schema):
+            text = colander.SchemaNode(colander.String(), widget = deform.widget.RichTextWidget())
+            date = colander.SchemaNode(colander.Date(), widget = deform.widget.DateInputWidget())
+        auto_need(deform.Form(Schema()), reg = self.reg)
+        rendered = self._rendered_js()
+        self.assertLess(rendered.index('scripts/jquery-2.0.3.min.js'), rendered.index('scripts/deform.js'))
+        self.assertLess(rendered.index('scripts/jquery-2.0.3.min.js'), rendered.index('scripts/jquery.form-3.09.js'))
+        self.assertIn('pickadate/picker.js', rendered)
+
+    def test_excluded_dependencies_not_loaded_twice(self):
+        from deform_autoneed import auto_need
+        self._prepare()
+        auto_need(deform.Form(colander.Schema()), reg = self.reg)
+        auto_need(_mk_richtext_form(), reg = self.reg)
+        rendered = self._rendered_js()
+        self.assertEqual(len(rendered), len(set(rendered)))
+        self.assertLess(rendered.index('scripts/jquery-2.0.3.min.js'), rendered.index('scripts/deform.js'))
+        self.assertIn('tinymce/tinymce.min.js', rendered)
+
+    def test_exclude_nothing(self):
+        obj = self._cut(exclude = ())
+        bundles = obj.bundles_for(['basic', 'tinymce'])
+        self.assertEqual(set([x.library for x in bundles]), set([obj.library]))
+
+
+class FingerprintTests(TestCase):
+    tearDown = _clearFLib
+
+    def setUp(self):
+        import tempfile
+        _clearFLib()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.library = Library('fingerprint_testing', self.tmpdir.name)
+        self.path = os.path.join(self.tmpdir.name, 'dummy.js')
+        with open(self.path, 'w') as f:
+            f.write('var a = 1;')
+        self.resource = Resource(self.library, 'dummy.js')
+
+    @property
+    def _cut(self):
+        from deform_autoneed.fingerprint import Fingerprints
+        return Fingerprints
+
+    def test_fingerprint_changes_with_content(self):
+        obj = self._cut()
+        first = obj.fingerprint(self.resource)
+        with open(self.path, 'w') as f:
+            f.write('var a = 22;')
+        self.assertNotEqual(obj.fingerprint(self.resource), first)
+
+    def test_url(self):
+        obj = self._cut()
+        digest = obj.fingerprint(self.resource)
+        self.assertEqual(obj.url(self.resource, '/fanstatic/fingerprint_testing'),
+                         '/fanstatic/fingerprint_testing/:version:%s/dummy.js' % digest)
+        self.assertEqual(obj.url(self.resource, '/fanstatic/fingerprint_testing/:version:abc'),
+                         '/fanstatic/fingerprint_testing/:version:%s/dummy.js' % digest)
+
+    def test_apply_render(self):
+        obj = self._cut()
+        obj.apply(self.resource)
+        self.assertIn(':version:%s/dummy.js' % self.resource.fingerprint,
+                      self.resource.render('/fanstatic/fingerprint_testing'))
+
+    def test_cache_reused_after_restart(self):
+        import json
+        cache_path = os.path.join(self.tmpdir.name, 'cache.json')
+        obj = self._cut(cache_path = cache_path)
+        obj.fingerprint(self.resource)
+        obj.save()
+        with open(cache_path) as f:
+            data = json.load(f)
+        data[self.path][2] = 'cached'
+        with open(cache_path, 'w') as f:
+            json.dump(data, f)
+        self.assertEqual(self._cut(cache_path = cache_path).fingerprint(self.resource), 'cached')
+
+    def test_enable_fingerprints(self):
+        from deform_autoneed.fingerprint import enable_fingerprints
+        reg = _mk_reg()
+        fingerprints = enable_fingerprints(reg)
+        self.assertIs(reg.fingerprints, fingerprints)
+        form_css = reg.find_resource('deform:static/css/form.css')
+        self.assertTrue(form_css.fingerprint)
+        reg.create_requirement_for('something', 'css/beautify.css', requirement_depends = [])
+        self.assertTrue(reg.requirements['something'][0].fingerprint)
+
+    def test_lazily_created_saved(self):
+        import json
+        from deform_autoneed import ResourceRegistry
+        from deform_autoneed.fingerprint import enable_fingerprints
+        cache_path = os.path.join(self.tmpdir.name, 'cache.json')
+        reg = ResourceRegistry()
+        reg.populate_from_resources(lazy = True)
+        enable_fingerprints(reg, cache_path = cache_path)
+        with open(cache_path) as f:
+            saved = json.load(f)
+        reg.resources_for(['tinymce'])
+        with open(cache_path) as f:
+            self.assertIn(reg.requirements['tinymce'][0].fullpath(), json.load(f))
+        self.assertNotIn(reg.requirements['tinymce'][0].fullpath(), saved)
+
+
+class StaticIndexTests(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        os.mkdir(os.path.join(self.tmpdir.name, 'scripts'))
+        for (fname, content) in (('scripts/jquery-1.9.1.js', ''),
+                                 ('scripts/jquery-1.9.1.min.js', ''),
+                                 ('scripts/bootstrap.min.js', '/*!\n * Bootstrap v3.3.6 (http://getbootstrap.com)\n */'),
+                                 ('form.css', 'form {}')):
+            with open(os.path.join(self.tmpdir.name, *fname.split('/')), 'w') as f:
+                f.write(content)
+
+    @property
+    def _cut(self):
+        from deform_autoneed.staticindex import StaticIndex
+        return StaticIndex
+
+    def test_files(self):
+        obj = self._cut(self.tmpdir.name)
+        self.assertIn('scripts/jquery-1.9.1.js', obj)
+        self.assertEqual(obj.stat('form.css')[0], 7)
+        self.assertTrue(obj.contains_path(os.path.join(self.tmpdir.name, 'form.css')))
+        self.assertFalse(obj.contains_path('/somewhere/else/form.css'))
+
+    def test_versions(self):
+        obj = self._cut(self.tmpdir.name)
+        self.assertEqual(obj.versions['jquery'], ('1.9.1', 'scripts/jquery-1.9.1.min.js'))
+        self.assertEqual(obj.versions['bootstrap'], ('3.3.6', 'scripts/bootstrap.min.js'))
+
+    def test_find_and_refresh(self):
+        obj = self._cut(self.tmpdir.name)
+        self.assertEqual(obj.find(r'^scripts/jquery'), ('scripts/jquery-1.9.1.js', 'scripts/jquery-1.9.1.min.js'))
+        os.remove(os.path.join(self.tmpdir.name, 'scripts', 'jquery-1.9.1.js'))
+        self.assertEqual(len(obj.find(r'^scripts/jquery')), 2)
+        obj.refresh()
+        self.assertEqual(obj.find(r'^scripts/jquery'), ('scripts/jquery-1.9.1.min.js',))
+
+    def test_get_static_index(self):
+        from deform_autoneed.staticindex import (get_static_index,
+                                                 clear_static_indexes)
+        index = get_static_index(self.tmpdir.name)
+        self.assertIs(get_static_index(self.tmpdir.name + os.sep), index)
+        clear_static_indexes()
+        self.assertIsNot(get_static_index(self.tmpdir.name), index)
+
+    def test_registry_static_index(self):
+        _clearFLib()
+        reg = _mk_reg()
+        version, relpath = reg.static_index().versions['jquery']
+        self.assertEqual(reg.requirements['basic'][0].relpath, relpath)
+
+
+class InlineAssetsTests(TestCase):
+    tearDown = _clearFLib
+
+    def setUp(self):
+        import tempfile
+        _clearFLib()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.library = Library('inline_testing', self.tmpdir.name)
+        self.path = os.path.join(self.tmpdir.name, 'dummy.js')
+        with open(self.path, 'w') as f:
+            f.write('var a = "</script>";')
+        self.resource = Resource(self.library, 'dummy.js')
+
+    @property
+    def _cut(self):
+        from deform_autoneed.inline import InlineAssets
+        return InlineAssets
+
+    def test_inline(self):
+        obj = self._cut()
+        obj.apply(self.resource)
+        self.assertTrue(self.resource.inlined)
+        self.assertEqual(self.resource.render('/fanstatic/inline_testing'), '<script>var a = "<\\/script>";</script>')
+
+    def test_no_disk_reads_when_rendering(self):
+        obj = self._cut()
+        obj.apply(self.resource)
+        os.remove(self.path)
+        self.assertIn('var a', self.resource.render('/fanstatic/inline_testing'))
+
+    def test_over_threshold_linked(self):
+        obj = self._cut(threshold = 5)
+        obj.apply(self.resource)
+        self.assertFalse(self.resource.inlined)
+        self.assertIn('src="/fanstatic/inline_testing/dummy.js"', self.resource.render('/fanstatic/inline_testing'))
+
+    def test_css_with_references_linked(self):
+        path = os.path.join(self.tmpdir.name, 'dummy.css')
+        with open(path, 'w') as f:
+            f.write('a { background: url(img.png); }')
+        resource = Resource(self.library, 'dummy.css')
+        self._cut().apply(resource)
+        self.assertFalse(resource.inlined)
+
+    def test_refresh(self):
+        obj = self._cut(threshold = 30)
+        obj.apply(self.resource)
+        with open(self.path, 'w') as f:
+            f.write('var a = "a much longer value than before";')
+        os.utime(self.path, (0, 0))
+        obj.refresh()
+        self.assertFalse(self.resource.inlined)
+        self.assertIn('src=', self.resource.render('/fanstatic/inline_testing'))
+
+    def test_fingerprinted_fallback(self):
+        from deform_autoneed.fingerprint import Fingerprints
+        Fingerprints().apply(self.resource)
+        self._cut(threshold = 5).apply(self.resource)
+        self.assertIn(':version:', self.resource.render('/fanstatic/inline_testing'))
+
+    def test_enable_and_disable_inlining(self):
+        from deform_autoneed.inline import (enable_inlining,
+                                            disable_inlining)
+        reg = _mk_reg()
+        inline_assets = enable_inlining(reg, threshold = 4096)
+        self.assertIs(reg.inline_assets, inline_assets)
+        form_css = reg.find_resource('deform:static/css/form.css')
+        self.assertTrue(form_css.inlined)
+        self.assertFalse(reg.find_resource('deform:static/css/bootstrap.min.css').inlined)
+        reg.create_requirement_for('something', 'css/typeahead.css', requirement_depends = [])
+        self.assertTrue(reg.requirements['something'][0].inlined)
+        disable_inlining(reg)
+        self.assertIn('href=', form_css.render('/fanstatic/deform'))
+
+
+class PrecompressTests(TestCase):
+    tearDown = _clearFLib
+
+    def setUp(self):
+        import tempfile
+        _clearFLib()
+        self.reg = _mk_reg()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def test_precompress(self):
+        import gzip
+        from deform_autoneed.compress import precompress
+        written = precompress(self.reg, self.tmpdir.name, processes = 0, encodings = ('.gz',))
+        form_css = self.reg.find_resource('deform:static/css/form.css')
+        target = os.path.join(self.tmpdir.name, 'deform_autoneed_lib', 'css', 'form.css.gz')
+        self.assertIn(target, written)
+        with open(form_css.fullpath(), 'rb') as f:
+            original = f.read()
+        with gzip.open(target) as f:
+            self.assertEqual(f.read(), original)
+
+    def test_precompress_skips_up_to_date(self):
+        from deform_autoneed.compress import precompress
+        self.assertTrue(precompress(self.reg, self.tmpdir.name, processes = 0, encodings = ('.gz',)))
+        self.assertEqual(precompress(self.reg, self.tmpdir.name, processes = 0, encodings = ('.gz',)), [])
+
+    def test_precompress_process_pool(self):
+        from deform_autoneed.compress import precompress
+        written = precompress(self.reg, self.tmpdir.name, processes = 2, encodings = ('.gz',))
+        self.assertEqual(len(written), len(self.reg.libraries['deform'].known_resources))
+
+    def _publisher(self, **kw):
+        from deform_autoneed.compress import precompress, PrecompressedPublisher
+        precompress(self.reg, self.tmpdir.name, processes = 0, encodings = ('.gz',))
+        return PrecompressedPublisher(self.reg, self.tmpdir.name, **kw)
+
+    def test_publisher_gzip(self):
+        import gzip
+        from webob import Request
+        app = self._publisher()
+        request = Request.blank('/deform_autoneed_lib/css/form.css', headers = {'Accept-Encoding': 'gzip, deflate'})
+        response = request.get_response(app)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(response.content_type, 'text/css')
+        self.assertIn('Accept-Encoding', response.vary)
+        with open(self.reg.find_resource('deform:static/css/form.css').fullpath(), 'rb') as f:
+            self.assertEqual(gzip.decompress(response.body), f.read())
+
+    def test_publisher_skips_outdated(self):
+        from webob import Request
+        app = self._publisher()
+        target = os.path.join(self.tmpdir.name, 'deform_autoneed_lib', 'css', 'form.css.gz')
+        os.utime(target, (0, 0))
+        request = Request.blank('/deform_autoneed_lib/css/form.css', headers = {'Accept-Encoding': 'gzip'})
+        self.assertEqual(request.get_response(app).content_encoding, None)
+
+    def test_publisher_identity_versioned(self):
+        from webob import Request
+        app = self._publisher()
+        response = Request.blank('/deform_autoneed_lib/:version:abc/css/form.css').get_response(app)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.content_encoding, None)
+        self.assertTrue(response.cache_control.max_age > 0)
+
+    def test_publisher_conditional(self):
+        from webob import Request
+        app = self._publisher()
+        response = Request.blank('/deform_autoneed_lib/css/form.css').get_response(app)
+        request = Request.blank('/deform_autoneed_lib/css/form.css',
+                                headers = {'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(request.get_response(app).status_int, 304)
+
+    def test_accepted_encodings(self):
+        from deform_autoneed.utils import accepted_encodings
+        self.assertEqual(accepted_encodings(''), set())
+        self.assertEqual(accepted_encodings('gzip;q=0, br'), set(['br']))
+        self.assertEqual(accepted_encodings('*'), set(['*', 'br', 'gzip']))
+        self.assertEqual(accepted_encodings('gzip;q=0, *'), set(['*', 'br']))
+
+    def test_split_publisher_path(self):
+        from deform_autoneed.utils import split_publisher_path
+        self.assertEqual(split_publisher_path('/deform/:version:abc/css/form.css'), ('deform', 'css/form.css', True))
+        self.assertEqual(split_publisher_path('/deform/css/form.css'), ('deform', 'css/form.css', False))
+        self.assertEqual(split_publisher_path('/deform'), ('deform', None, False))
+
+    def test_publisher_unknown(self):
+        from webob import Request, Response
+        app = self._publisher()
+        self.assertEqual(Request.blank('/deform_autoneed_lib/fonts/nothing.woff').get_response(app).status_int, 404)
+        app = self._publisher(fallback = Response('fallback'))
+        self.assertEqual(Request.blank('/deform_autoneed_lib/fonts/nothing.woff').get_response(app).text, 'fallback')
+
+
+class MemoryPublisherTests(TestCase):
+    tearDown = _clearFLib
+
+    def setUp(self):
+        _clearFLib()
+        self.reg = _mk_reg()
+        self.reg.populate_from_resources()
+
+    def _cut(self, *args, **kw):
+        from deform_autoneed.publisher import MemoryPublisher
+        return MemoryPublisher(self.reg, *args, **kw)
+
+    def _read(self, resource_path):
+        with open(self.reg.find_resource(resource_path).fullpath(), 'rb') as f:
+            return f.read()
+
+    def test_serve_from_memory(self):
+        from webob import Request
+        app = self._cut()
+        for i in range(2):
+            response = Request.blank('/deform_autoneed_lib/css/form.css').get_response(app)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.content_type, 'text/css')
+        self.assertEqual(response.body, self._read('deform:static/css/form.css'))
+        self.assertEqual(app.stats()['hits'], 1)
+        self.assertEqual(app.stats()['misses'], 1)
+
+    def test_conditional(self):
+        from webob import Request
+        app = self._cut()
+        response = Request.blank('/deform_autoneed_lib/css/form.css').get_response(app)
+        request = Request.blank('/deform_autoneed_lib/css/form.css', headers = {'If-None-Match': response.headers['ETag']})
+        self.assertEqual(request.get_response(app).status_int, 304)
+        request = Request.blank('/deform_autoneed_lib/css/form.css', headers = {'If-None-Match': '"other"'})
+        self.assertEqual(request.get_response(app).status_int, 200)
+        request = Request.blank('/deform_autoneed_lib/css/form.css',
+                                headers = {'If-Modified-Since': response.headers['Last-Modified']})
+        self.assertEqual(request.get_response(app).status_int, 304)
+
+    def test_versioned(self):
+        from webob import Request
+        response = Request.blank('/deform_autoneed_lib/:version:abc/css/form.css').get_response(self._cut())
+        self.assertEqual(response.status_int, 200)
+        self.assertTrue(response.cache_control.max_age > 0)
+
+    def test_memory_bounded(self):
+        from webob import Request
+        form_css = self._read('deform:static/css/form.css')
+        app = self._cut(max_memory = len(form_css) + 10)
+        Request.blank('/deform_autoneed_lib/css/form.css').get_response(app)
+        self.assertEqual(app.stats()['memory'], len(form_css))
+        response = Request.blank('/deform_autoneed_lib/scripts/deform.js').get_response(app)
+        self.assertEqual(response.body, self._read('deform:static/scripts/deform.js'))
+        self.assertLessEqual(app.stats()['memory'], len(form_css) + 10)
+
+    def test_large_files_from_disk(self):
+        from webob import Request
+        app = self._cut(max_file_size = 10)
+        wrapped = []
+        def file_wrapper(f, block_size):
+            wrapped.append(f)
+            return iter(lambda: f.read(block_size), b'')
+        request = Request.blank('/deform_autoneed_lib/scripts/deform.js', environ = {'wsgi.file_wrapper': file_wrapper})
+        response = request.get_response(app)
+        self.assertEqual(response.body, self._read('deform:static/scripts/deform.js'))
+        self.assertEqual(len(wrapped), 1)
+        self.assertEqual(app.stats()['memory'], 0)
+
+    def test_head_and_methods(self):
+        from webob import Request
+        app = self._cut()
+        response = Request.blank('/deform_autoneed_lib/css/form.css', method = 'HEAD').get_response(app)
+        self.assertEqual(response.status_int, 200)
+        self.assertEqual(response.body, b'')
+        self.assertEqual(app.stats()['files'], 0)
+        response = Request.blank('/deform_autoneed_lib/css/form.css', method = 'POST').get_response(app)
+        self.assertEqual(response.status_int, 405)
+
+    def test_unknown(self):
+        from webob import Request, Response
+        self.assertEqual(Request.blank('/deform_autoneed_lib/fonts/nothing.woff').get_response(self._cut()).status_int, 404)
+        self.assertEqual(Request.blank('/deform_autoneed_lib/../../setup.py').get_response(self._cut()).status_int, 404)
+        app = self._cut(fallback = Response('fallback'))
+        self.assertEqual(Request.blank('/deform_autoneed_lib/fonts/nothing.woff').get_response(app).text, 'fallback')
+
+    def test_registered_later(self):
+        from webob import Request
+        app = self._cut()
+        self.assertEqual(Request.blank('/deform_autoneed_lib/css/beautify.css').get_response(app).status_int, 404)
+        self.reg.create_requirement_for('something', 'css/beautify.css', requirement_depends = [])
+        self.assertEqual(Request.blank('/deform_autoneed_lib/css/beautify.css').get_response(app).status_int, 200)
+
+    def test_precompressed(self):
+        import gzip
+        import tempfile
+        from webob import Request
+        from deform_autoneed.compress import precompress
+        with tempfile.TemporaryDirectory() as tmpdir:
+            precompress(self.reg, tmpdir, processes = 0, encodings = ('.gz',))
+            app = self._cut(output_dir = tmpdir)
+            request = Request.blank('/deform_autoneed_lib/css/form.css', headers = {'Accept-Encoding': 'gzip'})
+            response = request.get_response(app)
+            self.assertEqual(response.content_encoding, 'gzip')
+            self.assertIn('Accept-Encoding', response.vary)
+            self.assertEqual(gzip.decompress(response.body), self._read('deform:static/css/form.css'))
+            response = Request.blank('/deform_autoneed_lib/css/form.css').get_response(app)
+            self.assertEqual(response.content_encoding, None)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        from deform_autoneed.instrumentation import enable_instrumentation
+        _clearFLib()
+        self.reg = _mk_reg()
+        self.reg.populate_from_resources()
+        self.instrumentation = enable_instrumentation(self.reg)
+
+    tearDown = _clearFLib
+
+    def test_stats_disabled(self):
+        from deform_autoneed import ResourceRegistry
+        reg = ResourceRegistry(add_basics = False)
+        self.assertEqual(set(reg.stats()), set(['generation', 'requirements', 'pending', 'resolved']))
+
+    def test_auto_need(self):
+        from deform_autoneed import auto_need
+        form = _mk_richtext_form()
+        auto_need(form, reg = self.reg)
+        auto_need(form, reg = self.reg)
+        stats = self.reg.stats()
+        self.assertEqual(stats['calls']['auto_need']['calls'], 2)
+        self.assertGreater(stats['calls']['auto_need']['resources'], 0)
+        self.assertEqual(stats['requirements_hit']['tinymce'], 2)
+        self.assertEqual(stats['requirements_missed'], {})
+
+    def test_auto_need_missed(self):
+        from deform_autoneed import auto_need
+        form = _mk_richtext_form()
+        form['richtext'].widget.requirements = (('does_not_exist', None),)
+        auto_need(form, reg = self.reg)
+        self.assertEqual(self.reg.stats()['requirements_missed'], {'does_not_exist': 1})
+
+    def test_need_lib(self):
+        from deform_autoneed import need_lib
+        need_lib('basic', reg = self.reg)
+        stats = self.reg.stats()
+        self.assertEqual(stats['calls']['need_lib']['resources'], len(self.reg.resources_for(['basic'])))
+        self.assertEqual(stats['requirements_hit'], {'basic': 1})
+
+    def test_hooks(self):
+        from deform_autoneed import need_lib
+        calls = []
+        def _failing(call):
+            raise ValueError()
+        self.instrumentation.add_hook(_failing)
+        self.instrumentation.add_hook(calls.append)
+        need_lib('basic', reg = self.reg)
+        self.assertEqual([x.name for x in calls], ['need_lib'])
+        self.assertEqual(calls[0].hit, ('basic',))
+
+    def test_reset(self):
+        from deform_autoneed import need_lib
+        need_lib('basic', reg = self.reg)
+        self.instrumentation.reset()
+        self.assertEqual(self.reg.stats()['calls'], {})
+
+
+class AssetManifestTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _cut(self, **kw):
+        from deform_autoneed.manifest import AssetManifest
+        self.reg = _mk_reg()
+        self.reg.populate_from_resources()
+        return AssetManifest(reg = self.reg, **kw)
+
+    def test_warm_up_schema(self):
+        class Schema(colander.Schema):
+            date = colander.SchemaNode(colander.Date(), widget = deform.widget.DateInputWidget())
+        obj = self._cut().warm_up({'dates': Schema()})
+        self.assertIn('dates', obj)
+        self.assertEqual(obj.resources('dates'), self.reg.resources_for(obj.requirement_names('dates')))
+        self.assertIs(obj.resources('dates'), obj.resources('dates'))
+
+    def test_manifest(self):
+        import json
+        import tempfile
+        obj = self._cut().warm_up([_mk_richtext_form()])
+        paths = obj.manifest()['deform']
+        self.assertIn('deform:static/scripts/deform.js', paths)
+        jquery = self.reg.resource_package_path(self.reg.requirements['basic'][0])
+        self.assertLess(paths.index(jquery), paths.index('deform:static/scripts/deform.js'))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'manifest.json')
+            obj.save(path)
+            with open(path) as f:
+                self.assertEqual(json.load(f), {'deform': paths})
+
+    def test_unknown(self):
+        form = _mk_richtext_form()
+        form['richtext'].widget.requirements = (('does_not_exist', None),)
+        obj = self._cut()
+        obj.add(form, 'broken')
+        self.assertEqual(obj.unknown, {'broken': ['does_not_exist']})
+        _clearFLib()
+        obj = self._cut(strict = True)
+        self.assertRaises(KeyError, obj.add, form, 'broken')
+
+    def test_requirements_cache(self):
+        from deform_autoneed import auto_need
+        class Schema(colander.Schema):
+            richtext = colander.SchemaNode(colander.String(), widget = deform.widget.RichTextWidget())
+        schema = Schema()
+        obj = self._cut()
+        obj.add(schema)
+        form = deform.Form(schema)
+        form.get_widget_requirements = None
+        auto_need(form, reg = self.reg, requirements_cache = obj)
+        self.assertIn('deform.js', [x.filename for x in get_needed().resources()])
+
+    def test_requirements_cache_other_form(self):
+        from deform_autoneed import auto_need
+        masked = colander.Schema()
+        masked.add(colander.SchemaNode(colander.String(), name = 'text',
+                                       widget = deform.widget.TextInputWidget(mask = '999')))
+        richtext = colander.Schema()
+        richtext.add(colander.SchemaNode(colander.String(), name = 'text',
+                                         widget = deform.widget.RichTextWidget()))
+        obj = self._cut()
+        obj.add(deform.Form(masked))
+        auto_need(deform.Form(richtext), reg = self.reg, requirements_cache = obj)
+        filenames = [x.filename for x in get_needed().resources()]
+        self.assertIn('tinymce.min.js', filenames)
+        self.assertNotIn('jquery.maskedinput-1.3.1.min.js', filenames)
+
+    def test_need(self):
+        obj = self._cut()
+        obj.add(_mk_richtext_form(), 'richtext')
+        obj.need('richtext')
+        self.assertIn('deform.js', [x.filename for x in get_needed().resources()])
+
+
+class PreloadTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _app(self, forms = (_mk_richtext_form,), **kw):
+        from fanstatic import Injector
+        from deform_autoneed import auto_need
+        from deform_autoneed.preload import PreloadMiddleware
+        reg = _mk_reg()
+        reg.populate_from_resources()
+        #Normally done when fanstatic prepares its library registry
+        reg.libraries['deform'].library_nr = None
+        reg.libraries['deform'].init_library_nr()
+        for resource in reg.resources_for(reg.requirements):
+            resource.init_dependency_nr()
+        def _app(environ, start_response):
+            for (i, form_factory) in enumerate(forms):
+                form = form_factory()
+                form.formid = 'form%d' % i
+                auto_need(form, reg = self.render_reg)
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return [b'<html><head></head><body></body></html>']
+        self.reg = self.render_reg = reg
+        self.middleware = PreloadMiddleware(_app, **kw)
+        return Injector(self.middleware)
+
+    def test_link_headers(self):
+        from webob import Request
+        response = Request.blank('/form').get_response(self._app())
+        links = response.headers.getall('Link')
+        self.assertIn('</fanstatic/deform_autoneed_lib/scripts/deform.js>; rel=preload; as=script', links)
+        self.assertIn('</fanstatic/deform_autoneed_lib/css/form.css>; rel=preload; as=style', links)
+        self.assertIn(self.reg.requirements['tinymce'][0], self.middleware.routes['/form'])
+
+    def test_early_hints(self):
+        from webob import Request
+        hints = []
+        app = self._app(early_hints = True)
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        self.assertEqual(hints, [])
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        self.assertEqual(len(hints), 1)
+        self.assertIn(('Link', '</fanstatic/deform_autoneed_lib/scripts/deform.js>; rel=preload; as=script'), hints[0])
+
+    def test_no_early_hints_after_replace(self):
+        from webob import Request
+        hints = []
+        app = self._app(early_hints = True)
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        self.reg.replace_resource('deform:static/css/form.css', 'deform:static/css/beautify.css')
+        self.reg.find_resource('deform:static/css/beautify.css').init_dependency_nr()
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        self.assertEqual(hints, [])
+
+    def test_early_hints_with_overlay(self):
+        from webob import Request
+        from deform_autoneed.overlay import RegistryOverlay
+        hints = []
+        app = self._app(early_hints = True)
+        self.render_reg = RegistryOverlay(self.reg)
+        theme = Library('theme', resource_filename('deform_autoneed', 'testing_fixture'))
+        self.render_reg.replace_resource('deform:static/css/form.css', Resource(theme, 'dummy.css'))
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        self.assertEqual(len(hints), 1)
+        self.assertIn(('Link', '</fanstatic/theme/dummy.css>; rel=preload; as=style'), hints[0])
+        self.render_reg.remove_resource('deform:static/scripts/deform.js')
+        Request.blank('/form', environ = {'wsgi.early_hints': hints.append}).get_response(app)
+        self.assertEqual(len(hints), 1)
+
+    def test_links_with_bundler(self):
+        import tempfile
+        from webob import Request
+        from deform_autoneed.bundles import BundleBuilder
+        def _mk_date_form():
+            class Schema(colander.Schema):
+                date = colander.SchemaNode(colander.Date(), widget = deform.widget.DateInputWidget())
+            return deform.Form(Schema())
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        app = self._app(forms = (_mk_date_form, _mk_richtext_form))
+        self.reg.bundler = BundleBuilder(self.reg, tmpdir.name, register_library = False)
+        response = Request.blank('/form').get_response(app)
+        urls = [x.split('>', 1)[0][1:] for x in response.headers.getall('Link')]
+        self.assertTrue([x for x in urls if '/deform_autoneed_bundles/' in x])
+        for url in urls:
+            self.assertIn(url, response.text)
+
+    def test_fingerprinted_url(self):
+        from deform_autoneed.preload import resource_url
+        resource = Resource(Library('deform_autoneed', 'testing_fixture'), 'dummy.js')
+        self.assertEqual(resource_url(resource, '/fanstatic/lib'), '/fanstatic/lib/dummy.js')
+        resource.fingerprint = 'abc'
+        self.assertEqual(resource_url(resource, '/fanstatic/lib'), '/fanstatic/lib/:version:abc/dummy.js')
+
+
+class AsgiTests(TestCase):
+    setUp = tearDown = _clearFLib
+
+    def _mk_prepared(self):
+        reg = _mk_reg()
+        reg.populate_from_resources()
+        #Normally done when fanstatic prepares its library registry
+        reg.libraries['deform'].library_nr = None
+        reg.libraries['deform'].init_library_nr()
+        for resource in reg.resources_for(reg.requirements):
+            resource.init_dependency_nr()
+        return reg
+
+    def _request(self, app, path = '/', method = 'GET'):
+        import asyncio
+        messages = []
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        async def send(message):
+            messages.append(message)
+        scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'headers': []}
+        asyncio.run(app(scope, receive, send))
+        return messages
+
+    def _asgi_app(self, reg, form_factory = _mk_richtext_form):
+        from deform_autoneed import auto_need
+        async def app(scope, receive, send):
+            auto_need(form_factory(), reg = reg)
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/html; charset=utf-8'), (b'content-length', b'39')]})
+            await send({'type': 'http.response.body', 'body': b'<html><head></head>', 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'<body></body></html>'})
+        return app
+
+    def test_same_as_wsgi(self):
+        from fanstatic import Injector
+        from webob import Request
+        from deform_autoneed import auto_need
+        from deform_autoneed.asgi import InjectorMiddleware
+        reg = self._mk_prepared()
+        def wsgi_app(environ, start_response):
+            auto_need(_mk_richtext_form(), reg = reg)
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return [b'<html><head></head><body></body></html>']
+        expected = Request.blank('/').get_response(Injector(wsgi_app)).body
+        messages = self._request(InjectorMiddleware(self._asgi_app(reg)))
+        self.assertEqual(messages[1]['body'], expected)
+        self.assertIn((b'content-length', str(len(expected)).encode()), messages[0]['headers'])
+        self.assertIn(b'tinymce', expected)
+
+    def test_head_same_as_wsgi(self):
+        from fanstatic import Injector
+        from webob import Request
+        from deform_autoneed import auto_need
+        from deform_autoneed.asgi import InjectorMiddleware
+        reg = self._mk_prepared()
+        def wsgi_app(environ, start_response):
+            auto_need(_mk_richtext_form(), reg = reg)
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return [b'<html><head></head><body></body></html>']
+        expected = Request.blank('/', method = 'HEAD').get_response(Injector(wsgi_app))
+        messages = self._request(InjectorMiddleware(self._asgi_app(reg)), method = 'HEAD')
+        self.assertIn((b'content-length', str(expected.content_length).encode()), messages[0]['headers'])
+        self.assertNotEqual(expected.content_length, 39)
+
+    def test_head_without_body(self):
+        from deform_autoneed.asgi import InjectorMiddleware
+        reg = self._mk_prepared()
+        async def app(scope, receive, send):
+            from deform_autoneed import need_lib
+            need_lib('basic', reg = reg)
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/html'), (b'content-length', b'39')]})
+            await send({'type': 'http.response.body', 'body': b''})
+        messages = self._request(InjectorMiddleware(app), method = 'HEAD')
+        self.assertIn((b'content-length', b'39'), messages[0]['headers'])
+        self.assertEqual(messages[1]['body'], b'')
+
+    def test_tasks_isolated(self):
+        import asyncio
+        from deform_autoneed import (auto_need,
+                                     current_needed,
+                                     needed_requirements)
+        from deform_autoneed.asgi import InjectorMiddleware
+        reg = self._mk_prepared()
+        results = {}
+        def _app(form_factory):
+            async def app(scope, receive, send):
+                auto_need(form_factory(), reg = reg)
+                await asyncio.sleep(0)
+                results[scope['path']] = set(needed_requirements(current_needed()))
+                await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+                await send({'type': 'http.response.body', 'body': b''})
+            return app
+        async def _run():
+            async def receive():
+                return {'type': 'http.request'}
+            async def send(message):
+                pass
+            scopes = [{'type': 'http', 'method': 'GET', 'path': '/rich'},
+                      {'type': 'http', 'method': 'GET', 'path': '/plain'}]
+            await asyncio.gather(InjectorMiddleware(_app(_mk_richtext_form))(scopes[0], receive, send),
+                                 InjectorMiddleware(_app(lambda: deform.Form(colander.Schema())))(scopes[1], receive, send))
+        asyncio.run(_run())
+        self.assertIn('tinymce', results['/rich'])
+        self.assertNotIn('tinymce', results['/plain'])
+        self.assertFalse(get_needed().has_resources())
+
+    def test_other_content_types_untouched(self):
+        from deform_autoneed.asgi import InjectorMiddleware
+        reg = self._mk_prepared()
+        async def app(scope, receive, send):
+            from deform_autoneed import need_lib
+            need_lib('basic', reg = reg)
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+            await send({'type': 'http.response.body', 'body': b'{"head": "</head>"}'})
+        messages = self._request(InjectorMiddleware(app))
+        self.assertEqual(messages[1]['body'], b'{"head": "</head>"}')
+
+
 class IntegrationTests(TestCase):
     tearDown = setUp = _clearFLib
 
@@ -240,3 +1802,126 @@ class IntegrationTests(TestCase):
             exc.render()
         resources = get_needed().resources()
         self.assertIn('deform.js', [x.filename for x in resources])
+
+    def test_includeme_cache_requirements_setting(self):
+        import deform_autoneed
+        class _Config(object):
+            class registry(object):
+                settings = {'deform_autoneed.cache_requirements': 'true'}
+        deform_autoneed.widget_requirements_cache.clear()
+        try:
+            deform_autoneed.includeme(_Config())
+            form = _mk_richtext_form()
+            form.render()
+            form.render()
+            self.assertEqual(deform_autoneed.widget_requirements_cache.hits, 1)
+        finally:
+            deform_autoneed.patch_deform()
+
+    def test_includeme_requirements_cache_setting(self):
+        import deform_autoneed
+        from deform_autoneed.manifest import AssetManifest
+        calls = []
+        class _Manifest(AssetManifest):
+            def get(self, form):
+                calls.append(form)
+                return super(_Manifest, self).get(form)
+        manifest = _Manifest()
+        class _Config(object):
+            class registry(object):
+                settings = {'deform_autoneed.requirements_cache': manifest}
+        try:
+            deform_autoneed.includeme(_Config())
+            schema = _mk_richtext_form().schema
+            manifest.warm_up([schema])
+            form = deform.Form(schema)
+            form.render()
+            self.assertEqual(calls, [form])
+            self.assertIn('tinymce', deform_autoneed.needed_requirements(get_needed()))
+        finally:
+            deform_autoneed.patch_deform()
+
+    def test_includeme_instrumentation_setting(self):
+        import deform_autoneed
+        class _Config(object):
+            class registry(object):
+                settings = {'deform_autoneed.instrumentation': 'true'}
+        reg = deform_autoneed.get_resource_registry()
+        try:
+            deform_autoneed.includeme(_Config())
+            form = _mk_richtext_form()
+            form.render()
+            try:
+                form.validate([('foo', 'bar')])
+            except deform.ValidationFailure as exc:
+                exc.render()
+            calls = reg.stats()['calls']
+            self.assertEqual(calls['form_render']['calls'], 1)
+            self.assertEqual(calls['validationfailure_render']['calls'], 1)
+            self.assertEqual(calls['auto_need']['calls'], 2)
+        finally:
+            reg.instrumentation = None
+
+    def test_includeme_inline_threshold_setting(self):
+        import deform_autoneed
+        from deform_autoneed.inline import disable_inlining
+        class _Config(object):
+            class registry(object):
+                settings = {'deform_autoneed.inline_threshold': '2048'}
+        reg = deform_autoneed.get_resource_registry()
+        try:
+            deform_autoneed.includeme(_Config())
+            self.assertEqual(reg.inline_assets.threshold, 2048)
+            self.assertTrue(reg.find_resource('deform:static/css/form.css').inlined)
+        finally:
+            disable_inlining(reg)
+
+    def test_includeme_lazy_setting(self):
+        import deform_autoneed
+        class _Config(object):
+            class registry(object):
+                settings = {'deform_autoneed.lazy': 'true'}
+        old_reg = deform_autoneed._resource_registry
+        deform_autoneed._resource_registry = None
+        try:
+            deform_autoneed.includeme(_Config())
+            reg = deform_autoneed.get_resource_registry()
+            self.assertNotIn('tinymce', reg.requirements)
+            _mk_richtext_form().render()
+            self.assertIn('tinymce', reg.requirements)
+            self.assertIn('tinymce.min.js', [x.filename for x in get_needed().resources()])
+        finally:
+            deform_autoneed._resource_registry = old_reg
+
+    def test_import_is_lazy(self):
+        import subprocess
+        import sys
+        code = ("import sys, deform_autoneed; "
+                "print(deform_autoneed._resource_registry is None, 'pkg_resources' in sys.modules)")
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode().split(), ['True', 'False'])
+
+    def test_resource_registry_attribute(self):
+        import deform_autoneed
+        self.assertIs(deform_autoneed.resource_registry, deform_autoneed.get_resource_registry())
+
+    def test_includeme_snapshot(self):
+        import os
+        import tempfile
+        import deform_autoneed
+        original = deform_autoneed._resource_registry
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, 'snapshot.json')
+                deform_autoneed._resource_registry = None
+                deform_autoneed.includeme(snapshot_path = path)
+                self.assertTrue(os.path.exists(path))
+                _clearFLib()
+                deform_autoneed._resource_registry = None
+                deform_autoneed.includeme(snapshot_path = path)
+                self.assertIn('jquery.form', deform_autoneed.resource_registry.requirements)
+            form = _mk_richtext_form()
+            form.render()
+            self.assertIn('deform.js', [x.filename for x in get_needed().resources()])
+        finally:
+            deform_autoneed._resource_registry = original
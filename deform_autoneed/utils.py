@@ -0,0 +1,99 @@
+""" Helpers shared by the modules of deform_autoneed: writing files atomically,
+    setting up resources created after fanstatic prepared its registry, and the
+    parts of serving resources that all publishers have in common.
+"""
+from email.utils import formatdate
+import os
+import time
+
+from fanstatic import VERSION_PREFIX
+from fanstatic.publisher import FOREVER
+
+
+#Extensions and the encoding name used in Accept-Encoding, in order of preference
+ENCODINGS = (('.br', 'br'),
+             ('.gz', 'gzip'))
+
+
+def write_atomic(path, data):
+    """ Write data, bytes or text, to path through a temporary file, so readers never
+        see a partial file.
+    """
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    with open(tmp_path, isinstance(data, bytes) and 'wb' or 'w') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def init_late_resource(resource):
+    """ Set the library and dependency numbers fanstatic sorts by on a resource.
+        Fanstatic only does this when it prepares its registry, which may already have
+        happened when the resource is created.
+    """
+    if getattr(resource, 'dependency_nr', None) is None:
+        if resource.library.library_nr is None:
+            resource.library.init_library_nr()
+        resource.init_dependency_nr()
+    return resource
+
+
+def split_publisher_path(path):
+    """ Split a path below fanstatics publisher signature, like
+        ``/<library name>/<optional :version: step>/<relpath>``.
+
+        Returns (library name, relpath, versioned). relpath is None when path is too short.
+        Versioned paths should get far-future cache headers, see ``forever_headers``.
+    """
+    steps = path.strip('/').split('/')
+    versioned = False
+    if len(steps) > 2 and steps[1].startswith(VERSION_PREFIX):
+        del steps[1]
+        versioned = True
+    if len(steps) < 2:
+        return (steps[0], None, versioned)
+    return (steps[0], '/'.join(steps[1:]), versioned)
+
+
+def forever_headers():
+    """ The cache headers fanstatics publisher sends for versioned URLs. """
+    return [('Cache-Control', 'max-age=%d' % FOREVER),
+            ('Expires', formatdate(time.time() + FOREVER, usegmt = True))]
+
+
+def accepted_encodings(header):
+    """ Set of content codings an Accept-Encoding header allows, ignoring any with q=0.
+        A missing header means that only uncompressed responses are safe.
+        ``*`` allows the codings of ``ENCODINGS`` that aren't refused with q=0.
+    """
+    result = set()
+    refused = set()
+    for item in header.split(','):
+        parts = item.split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, sep, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            result.add(coding)
+        else:
+            refused.add(coding)
+    if '*' in result:
+        result.update(encoding for (ext, encoding) in ENCODINGS if encoding not in refused)
+    return result
+
+
+def preferred_encodings(header):
+    """ Yield (extension, encoding) of the ``ENCODINGS`` an Accept-Encoding header
+        allows, most preferred first.
+    """
+    accepted = accepted_encodings(header)
+    for (ext, encoding) in ENCODINGS:
+        if encoding in accepted:
+            yield (ext, encoding)
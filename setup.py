@@ -23,7 +23,6 @@ setup(name='deform_autoneed',
         "Topic :: Internet :: WWW/HTTP :: WSGI :: Application",
         "Development Status :: 4 - Beta",
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
-        "Programming Language :: Python :: 2.7",
         "Programming Language :: Python :: 3",
         ],
       author='Robin Harms Oredsson',
@@ -33,6 +32,7 @@ setup(name='deform_autoneed',
       packages=find_packages(),
       include_package_data=True,
       zip_safe=False,
+      python_requires = '>=3.8',
       install_requires = requires,
       tests_require = requires,
       test_suite = "deform_autoneed",